@@ -0,0 +1,41 @@
+from fastapi import APIRouter
+from typing import Optional
+from app.core.indexes import explain_hot_queries, verify_indexes
+from app.services.llm_executor import llm_executor
+from app.services.llm_cache import llm_cache
+from app.services.llm_router import llm_router
+from app.services.llm_client import rag
+from app.services.lexical_index import lexical_indexes
+from app.services.enrichment import enrichment_pipeline
+from app.services.local_classifier import local_classifier, stored_report
+
+router = APIRouter()
+
+@router.get("/indexes")
+async def index_problems():
+    # read-only; indexes are created at startup or with ``python -m app.core.indexes``
+    return {"problems": await verify_indexes()}
+
+@router.get("/explain")
+async def explain_queries(user_id: Optional[str] = None):
+    plans = await explain_hot_queries(user_id)
+    return {
+        "plans": plans,
+        "collection_scans": [p["name"] for p in plans if p["collection_scan"]],
+    }
+
+@router.get("/llm")
+async def llm_metrics():
+    return {"executor": llm_executor.stats(), "cache": llm_cache.stats(), "router": llm_router.stats()}
+
+@router.get("/classifier")
+async def classifier_metrics():
+    return {"serving": local_classifier.stats(), "last_training": await stored_report()}
+
+@router.get("/enrichment")
+async def enrichment_metrics():
+    return enrichment_pipeline.stats()
+
+@router.get("/rag")
+async def rag_metrics():
+    return {"vector": rag.stats(), "lexical": lexical_indexes.stats()}
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Query, Body
 from app.services.email_composition import build_user_profile
-from app.services.llm_client import generate_personalized_email
+from app.services.llm_client import generate_personalized_email, stream_personalized_email
+from app.core.sse import stream_completion
 from app.models.email_model import DraftRequest
 import asyncio
 
@@ -11,7 +12,7 @@ async def reply_draft(
     user_id: str = Query(...),
     draft_req: DraftRequest = Body(...)
 ):
-    profile = await build_user_profile(user_id)
+    profile = await build_user_profile(user_id, draft_req.recipient)
 
     draft = await generate_personalized_email(
         profile,
@@ -30,3 +31,25 @@ async def reply_draft(
         "style_profile": profile,
         "draft": draft
     }
+
+
+@router.post("/drafts/reply/stream")
+async def reply_draft_stream(
+    user_id: str = Query(...),
+    draft_req: DraftRequest = Body(...)
+):
+    profile = await build_user_profile(user_id, draft_req.recipient)
+
+    async def done(draft: str):
+        return {"style_profile": profile}
+
+    return await stream_completion(
+        stream_personalized_email(
+            profile,
+            draft_req.recipient,
+            draft_req.subject,
+            draft_req.context,
+            reply_to=draft_req.reply_to
+        ),
+        done,
+    )
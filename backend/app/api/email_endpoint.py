@@ -1,20 +1,22 @@
 import os
+import re
 import json
 import base64
 import uuid
 from datetime import datetime
-from email import message_from_bytes
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from fastapi.responses import JSONResponse, RedirectResponse
 from google_auth_oauthlib.flow import Flow
-from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
 
 from app.core.config import settings
 from app.core.mongo import emails_collection, users_collection
-from typing import Dict, List, Optional
+from app.services.gmail_sync import sync_mailbox
+from app.services.google_credentials import GoogleAuthError, credential_manager
+from app.services.gmail_backfill import start_backfill, get_backfill_status
+from app.services.enrichment import enrichment_pipeline
+from typing import Optional
 
 CLIENT_SECRETS_FILE = settings.CLIENT_SECRETS_FILE
 SCOPES = settings.GMAILSCOPES
@@ -22,88 +24,40 @@ REDIRECT_URI = settings.REDIRECT_URL
 
 router = APIRouter()
 
+# fields the inbox list renders; bodies are served by GET /mails/{email_id}
+LIST_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "thread_id": 1,
+    "subject": 1,
+    "sender": 1,
+    "recipients": 1,
+    "snippet": 1,
+    "date": 1,
+    "labels": 1,
+    "classification": 1,
+    "summaries": 1,
+    "snoozed_until": 1,
+}
+# index bookkeeping stored on each email; never sent to clients
+DETAIL_PROJECTION = {
+    "_id": 0,
+    "lex_terms": 0,
+    "lex_len": 0,
+    "rag_hash": 0,
+    "rag_chunks": 0,
+    "rag_indexed_at": 0,
+}
+
 # ---------------------- Helpers ---------------------- #
 
-def decode_base64_data(data: str) -> str:
-    try:
-        decoded_bytes = base64.urlsafe_b64decode(data + '=' * (4 - len(data) % 4))
-        return decoded_bytes.decode('utf-8', errors='ignore')
-    except Exception as e:
-        print(f"Error decoding base64 data: {e}")
-        return ""
-
-def extract_body_from_parts(parts: List[Dict]) -> Dict[str, str]:
-    plain_text = ""
-    html_content = ""
-    
-    for part in parts:
-        mime_type = part.get('mimeType', '')
-        
-        if 'parts' in part:
-            nested_result = extract_body_from_parts(part['parts'])
-            if not plain_text and nested_result['plain']:
-                plain_text = nested_result['plain']
-            if not html_content and nested_result['html']:
-                html_content = nested_result['html']
-        
-        elif 'body' in part and 'data' in part['body']:
-            content = decode_base64_data(part['body']['data'])
-            
-            if mime_type == 'text/plain' and not plain_text:
-                plain_text = content
-            elif mime_type == 'text/html' and not html_content:
-                html_content = content
-    
-    return {'plain': plain_text, 'html': html_content}
-
-def extract_body_from_payload(payload: Dict) -> Dict[str, str]:
-    mime_type = payload.get('mimeType', '')
-    
-    if 'body' in payload and 'data' in payload['body']:
-        content = decode_base64_data(payload['body']['data'])
-        if mime_type == 'text/plain':
-            return {'plain': content, 'html': ''}
-        elif mime_type == 'text/html':
-            return {'plain': '', 'html': content}
-    
-    if 'parts' in payload:
-        return extract_body_from_parts(payload['parts'])
-    
-    return {'plain': '', 'html': ''}
-
-def parse_email(msg_data: Dict) -> Dict:
-    payload = msg_data.get("payload", {})
-    headers = payload.get("headers", [])
-
-    subject = next((h["value"] for h in headers if h["name"] == "Subject"), "")
-    sender = next((h["value"] for h in headers if h["name"] == "From"), "")
-    to = [h["value"] for h in headers if h["name"] == "To"]
-    
-    date_str = next((h["value"] for h in headers if h["name"] == "Date"), "")
-    try:
-        date = datetime.strptime(date_str.split(' (')[0], "%a, %d %b %Y %H:%M:%S %z")
-    except Exception as e:
-        print(f"Error parsing date '{date_str}': {e}")
-        date = datetime.utcnow()
+def encode_cursor(date: datetime, email_id: str) -> str:
+    raw = json.dumps({"date": date.isoformat(), "id": email_id})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
 
-    body_data = extract_body_from_payload(payload)
-    
-    body = body_data['plain'] or body_data['html'] or msg_data.get("snippet", "")
-    
-    return {
-        "id": msg_data["id"],
-        "thread_id": msg_data["threadId"],
-        "subject": subject,
-        "sender": sender,
-        "recipients": to,
-        "snippet": msg_data.get("snippet", ""),
-        "body": body,
-        "plain_body": body_data['plain'],
-        "html_body": body_data['html'],
-        "date": date,
-        "labels": msg_data.get("labelIds", []),
-        "size_estimate": msg_data.get("sizeEstimate", 0)
-    }
+def decode_cursor(cursor: str):
+    data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return datetime.fromisoformat(data["date"]), data["id"]
 
 # ---------------------- Routes ---------------------- #
 
@@ -159,71 +113,112 @@ async def google_callback(code: str):
         }
         await users_collection.insert_one(user_doc)
 
+    credential_manager.invalidate(user_id)
+
     frontend_url = f"{settings.FRONTEND_URL}/auth/callback?user_id={user_id}"
     return RedirectResponse(url=frontend_url)
 
 
 @router.get("/mails/fetch")
-async def fetch_emails(user_id: str):
-    user_doc = await users_collection.find_one({"id": user_id})
-    if not user_doc or "google_credentials" not in user_doc:
-        raise HTTPException(status_code=401, detail="User not authenticated with Google")
+async def fetch_emails(user_id: str, full: bool = False):
+    try:
+        service, creds = await credential_manager.get_client(user_id, "gmail", "v1")
+    except GoogleAuthError as e:
+        raise HTTPException(status_code=401, detail=str(e))
 
-    creds = Credentials.from_authorized_user_info(
-        json.loads(user_doc["google_credentials"]), SCOPES
-    )
-
-    if not creds.valid and creds.refresh_token:
-        try:
-            creds.refresh(Request())
-            await users_collection.update_one(
-                {"id": user_id},
-                {"$set": {
-                    "google_credentials": creds.to_json(),
-                    "updated_at": datetime.utcnow()
-                }}
-            )
-        except Exception as e:
-            raise HTTPException(status_code=401, detail=f"Failed to refresh token: {e}")
-
-    service = build("gmail", "v1", credentials=creds)
+    user_doc = await users_collection.find_one({"id": user_id}, projection={"gmail_history_id": 1})
 
     try:
-        results = service.users().messages().list(userId="me", maxResults=20).execute()
+        result = await sync_mailbox(
+            service, creds, user_id,
+            history_id=user_doc.get("gmail_history_id"),
+            full=full,
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gmail API error: {e}")
 
-    messages = results.get("messages", [])
-    stored_emails = []
-
-    for msg in messages:
-        try:
-            msg_data = service.users().messages().get(
-                userId="me", id=msg["id"], format="full"
-            ).execute()
+    enrichment_pipeline.submit(user_id, result["emails"])
+    return {
+        "status": "success",
+        "mode": result["mode"],
+        "emails": result["emails"],
+        "count": len(result["emails"]),
+        "deleted": result["deleted"],
+        "relabeled": result["relabeled"],
+    }
 
-            email_doc = parse_email(msg_data)
-            email_doc["user_id"] = user_id
 
-            await emails_collection.update_one(
-                {"id": email_doc["id"], "user_id": user_id},
-                {"$set": email_doc},
-                upsert=True,
-            )
-            stored_emails.append(email_doc)
-        except Exception as e:
-            print(f"Error processing message {msg['id']}: {e}")
-            continue
+@router.post("/mails/backfill/start")
+async def backfill_start(user_id: str, restart: bool = False):
+    user_doc = await users_collection.find_one({"id": user_id})
+    if not user_doc or "google_credentials" not in user_doc:
+        raise HTTPException(status_code=401, detail="User not authenticated with Google")
 
-    return {"status": "success", "emails": stored_emails, "count": len(stored_emails)}
+    job = await start_backfill(user_id, restart=restart)
+    return {"status": "success", "job": job}
 
 
-@router.get("/mails")
-async def get_emails(user_id: str):
-    emails_cursor = emails_collection.find({"user_id": user_id}).sort("date", -1)
-    emails = await emails_cursor.to_list(length=50)
+@router.get("/mails/backfill/status")
+async def backfill_status(user_id: str):
+    job = await get_backfill_status(user_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="No backfill job for this user")
+    return {"job": job}
 
-    for email in emails:
-        email["_id"] = str(email["_id"])
 
-    return {"emails": emails}
+@router.get("/mails")
+async def get_emails(
+    user_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    classification: Optional[str] = None,
+    label: Optional[str] = None,
+    sender: Optional[str] = None,
+    snoozed: Optional[bool] = None,
+):
+    query = {"user_id": user_id}
+    if classification:
+        query["classification"] = classification.upper()
+    if label:
+        query["labels"] = label
+    if sender:
+        query["sender"] = {"$regex": re.escape(sender), "$options": "i"}
+    if snoozed is True:
+        query["snoozed_until"] = {"$gt": datetime.utcnow()}
+    elif snoozed is False:
+        query["$or"] = [
+            {"snoozed_until": {"$exists": False}},
+            {"snoozed_until": {"$lte": datetime.utcnow()}},
+        ]
+
+    if cursor:
+        try:
+            after_date, after_id = decode_cursor(cursor)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = {"$and": [query, {"$or": [
+            {"date": {"$lt": after_date}},
+            {"date": after_date, "id": {"$lt": after_id}},
+        ]}]}
+
+    emails_cursor = emails_collection.find(query, projection=LIST_PROJECTION).sort(
+        [("date", -1), ("id", -1)]
+    ).limit(limit + 1)
+    emails = await emails_cursor.to_list(length=limit + 1)
+
+    next_cursor = None
+    if len(emails) > limit:
+        emails = emails[:limit]
+        next_cursor = encode_cursor(emails[-1]["date"], emails[-1]["id"])
+
+    return {"emails": emails, "next_cursor": next_cursor}
+
+
+@router.get("/mails/{email_id}")
+async def get_email(email_id: str, user_id: str):
+    email = await emails_collection.find_one(
+        {"id": email_id, "user_id": user_id}, projection=DETAIL_PROJECTION
+    )
+    if not email:
+        raise HTTPException(status_code=404, detail="Email not found")
+    return {"email": email}
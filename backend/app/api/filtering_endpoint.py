@@ -1,5 +1,9 @@
+import json
 from fastapi import APIRouter, HTTPException
-from app.services.llm_client import classify_email
+from fastapi.responses import StreamingResponse
+from app.services.llm_client import CLASSIFIER_VERSION
+from app.services.local_classifier import local_classifier
+from app.services.classification_pipeline import classify_mailbox
 from app.core.mongo import emails_collection
 
 router = APIRouter()
@@ -10,30 +14,37 @@ async def filter_email(email_id: str, user_id: str):
     if not email_doc:
         raise HTTPException(status_code=404, detail="Email not found")
 
-    body_text = email_doc.get("body", "") or email_doc.get("snippet", "")
-    classification = await classify_email(body_text)
+    [(classification, source)] = await local_classifier.classify([email_doc])
 
     await emails_collection.update_one(
         {"id": email_id, "user_id": user_id},
-        {"$set": {"classification": classification}}
+        {"$set": {"classification": classification,
+                  "classification_version": CLASSIFIER_VERSION,
+                  "classification_source": source}}
     )
 
-    return {"email_id": email_id, "classification": classification}
+    return {"email_id": email_id, "classification": classification, "source": source}
 
 
 @router.post("/emails/filter-all")
-async def filter_all_emails(user_id: str):
-    cursor = emails_collection.find({"user_id": user_id})
-    emails = await cursor.to_list(length=100)
-
-    classified = []
-    for e in emails:
-        body_text = e.get("body", "") or e.get("snippet", "")
-        classification = await classify_email(body_text)
-        await emails_collection.update_one(
-            {"id": e["id"], "user_id": user_id},
-            {"$set": {"classification": classification}}
-        )
-        classified.append({"id": e["id"], "classification": classification})
-
-    return {"classified_emails": classified}
+async def filter_all_emails(user_id: str, stream: bool = False, force: bool = False):
+    events = classify_mailbox(user_id, force=force)
+
+    if stream:
+        async def ndjson():
+            async for event in events:
+                yield json.dumps(event) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    classified, failed = [], []
+    write_failures = 0
+    async for event in events:
+        if event["type"] == "classified":
+            classified.append({"id": event["id"], "classification": event["classification"]})
+        elif event["type"] == "error":
+            failed.append(event["id"])
+        elif event["type"] == "complete":
+            write_failures = event["write_failures"]
+
+    # failed covers emails whose classification could not be written as well
+    return {"classified_emails": classified, "failed": failed, "write_failures": write_failures}
@@ -1,17 +1,38 @@
+import json
 from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from typing import Optional
-from app.services.llm_client import index_user_emails, semantic_search
+from app.services.rag_indexing import index_mailbox
+from app.services.retrieval import SEARCH_MODES, semantic_search
 
 router = APIRouter()
 
 @router.post("/rag/index")
-async def rag_index(user_id: str):
-    res = await index_user_emails(user_id)
-    return res
+async def rag_index(user_id: str, stream: bool = False, force: bool = False):
+    events = index_mailbox(user_id, force=force)
+
+    if stream:
+        async def ndjson():
+            async for event in events:
+                yield json.dumps(event) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    failed = []
+    async for event in events:
+        if event["type"] == "error":
+            failed.extend(event["ids"])
+        elif event["type"] == "complete":
+            result = event
+
+    return {"status": "indexed", "chunks": result["chunks"], "indexed": result["indexed"],
+            "skipped": result["skipped"], "failed": failed}
 
 @router.get("/rag/search")
-async def rag_search(user_id: str, q: str = Query(..., alias="q"), k: Optional[int] = 5):
+async def rag_search(user_id: str, q: str = Query(..., alias="q"), k: Optional[int] = 5,
+                     mode: str = "hybrid", answer: bool = True):
     if not q:
         raise HTTPException(status_code=400, detail="Missing query parameter 'q'")
-    res = await semantic_search(user_id, q, top_k=k)
+    if mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(SEARCH_MODES)}")
+    res = await semantic_search(user_id, q, top_k=k, mode=mode, answer=answer)
     return res
@@ -1,6 +1,11 @@
 from fastapi import APIRouter, HTTPException, Query, Body
-from app.services.llm_client import summarize_text, generate_draft
+from pymongo import UpdateOne
+from app.core.bulk_writer import get_bulk_writer
+from app.core.sse import sse_event, sse_response, stream_completion
+from app.services.llm_client import summarize_text, generate_draft, stream_summary, stream_draft
 from app.core.mongo import emails_collection
+from app.services.text_cleaning import email_text
+from app.services.thread_summaries import summarize_thread
 from app.models.email_model import DraftRequest
 
 router = APIRouter()
@@ -19,49 +24,54 @@ async def summarize_email(email_id: str, user_id: str, mode: str = "short"):
             "cached": True
         }
 
-    body_text = email_doc.get("body", "") or email_doc.get("snippet", "")
-    summary = await summarize_text(body_text, mode)
+    summary = await summarize_text(email_text(email_doc), mode)
 
-    await emails_collection.update_one(
+    await get_bulk_writer(emails_collection).add(UpdateOne(
         {"id": email_id, "user_id": user_id},
         {"$set": {f"summaries.{mode}": summary}}
-    )
+    ))
 
     return {"email_id": email_id, "mode": mode, "summary": summary}
 
 
-@router.post("/threads/{thread_id}/summarize")
-async def summarize_thread(thread_id: str, user_id: str, mode: str = "short"):
-    existing = await emails_collection.find_one(
-        {"thread_id": thread_id, "user_id": user_id, f"thread_summaries.{mode}": {"$exists": True}},
-        projection={f"thread_summaries.{mode}": 1}
-    )
-    if existing and "thread_summaries" in existing and mode in existing["thread_summaries"]:
-        return {
-            "thread_id": thread_id,
-            "mode": mode,
-            "summary": existing["thread_summaries"][mode],
-            "cached": True
-        }
+@router.post("/emails/{email_id}/summarize/stream")
+async def summarize_email_stream(email_id: str, user_id: str, mode: str = "short"):
+    email_doc = await emails_collection.find_one({"id": email_id, "user_id": user_id})
+    if not email_doc:
+        raise HTTPException(status_code=404, detail="Email not found")
 
-    cursor = emails_collection.find({"thread_id": thread_id, "user_id": user_id}).sort("date", 1)
-    emails = await cursor.to_list(length=50)
+    if "summaries" in email_doc and mode in email_doc["summaries"]:
+        summary = email_doc["summaries"][mode]
 
-    if not emails:
-        raise HTTPException(status_code=404, detail="Thread not found")
+        async def replay():
+            yield sse_event("done", {"text": summary, "email_id": email_id, "mode": mode, "cached": True})
+        return sse_response(replay())
 
-    combined_text = "\n\n".join(
-        [f"From: {e['sender']}\nSubject: {e['subject']}\n{e.get('body','')}" for e in emails]
-    )
+    async def save(summary: str):
+        await get_bulk_writer(emails_collection).add(UpdateOne(
+            {"id": email_id, "user_id": user_id},
+            {"$set": {f"summaries.{mode}": summary}}
+        ))
+        return {"email_id": email_id, "mode": mode, "cached": False}
 
-    summary = await summarize_text(combined_text, mode)
+    return await stream_completion(stream_summary(email_text(email_doc), mode), save)
 
-    await emails_collection.update_many(
-        {"thread_id": thread_id, "user_id": user_id},
-        {"$set": {f"thread_summaries.{mode}": summary}}
-    )
 
-    return {"thread_id": thread_id, "mode": mode, "summary": summary}
+@router.post("/threads/{thread_id}/summarize")
+async def summarize_thread_endpoint(thread_id: str, user_id: str, mode: str = "short"):
+    result = await summarize_thread(user_id, thread_id, mode)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Thread not found")
+
+    return {
+        "thread_id": thread_id,
+        "mode": mode,
+        "summary": result["summary"],
+        "cached": result["status"] == "cached",
+        "status": result["status"],
+        "message_count": result["message_count"],
+        "last_message_date": result["last_message_date"],
+    }
 
 @router.post("/drafts/generate")
 async def generate_draft_email(
@@ -69,4 +79,11 @@ async def generate_draft_email(
     draft: DraftRequest = Body(...) 
 ):
     draft_text = await generate_draft(draft.recipient, draft.subject, draft.context)
-    return {"draft": draft_text}
\ No newline at end of file
+    return {"draft": draft_text}
+
+@router.post("/drafts/generate/stream")
+async def generate_draft_email_stream(
+    user_id: str = Query(...),
+    draft: DraftRequest = Body(...)
+):
+    return await stream_completion(stream_draft(draft.recipient, draft.subject, draft.context))
@@ -0,0 +1,123 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import BulkWriteError
+
+from app.core.config import settings
+
+
+def _empty_report() -> Dict[str, Any]:
+    return {"ops": 0, "matched": 0, "modified": 0, "upserted": 0, "deleted": 0, "errors": []}
+
+
+class BulkWriter:
+    """Buffers write operations for one collection and sends them with ``bulk_write(ordered=False)``.
+
+    A flush happens when ``max_ops`` operations are buffered, ``flush_interval``
+    seconds after the first buffered operation, or on ``flush()``/``close()``.
+    ``add`` returns a future that resolves to ``None`` once the operation is
+    written, or to the error dict reported by MongoDB for that operation.
+    """
+
+    def __init__(self, collection, max_ops: Optional[int] = None, flush_interval: Optional[float] = None):
+        self.collection = collection
+        self.max_ops = max_ops or settings.MONGO_BULK_MAX_OPS
+        self.flush_interval = flush_interval if flush_interval is not None else settings.MONGO_BULK_FLUSH_SECONDS
+        self.totals = {"ops": 0, "matched": 0, "modified": 0, "upserted": 0, "deleted": 0, "failed": 0}
+        self.flushes = 0
+        self._ops: List = []
+        self._futures: List[asyncio.Future] = []
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def add(self, op) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._ops.append(op)
+        self._futures.append(future)
+
+        if len(self._ops) >= self.max_ops:
+            await self.flush()
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+        return future
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self) -> Dict[str, Any]:
+        """Write everything buffered so far and return a report for this flush."""
+        async with self._lock:
+            ops, futures = self._ops, self._futures
+            self._ops, self._futures = [], []
+            if not ops:
+                return _empty_report()
+
+            report = _empty_report()
+            report["ops"] = len(ops)
+            item_errors: Dict[int, Dict] = {}
+
+            try:
+                result = await self.collection.bulk_write(ops, ordered=False)
+                report["matched"] = result.matched_count
+                report["modified"] = result.modified_count
+                report["upserted"] = result.upserted_count
+                report["deleted"] = result.deleted_count
+            except BulkWriteError as e:
+                details = e.details
+                report["matched"] = details.get("nMatched", 0)
+                report["modified"] = details.get("nModified", 0)
+                report["upserted"] = details.get("nUpserted", 0)
+                report["deleted"] = details.get("nRemoved", 0)
+                for error in details.get("writeErrors", []):
+                    item_errors[error["index"]] = {
+                        "index": error["index"],
+                        "code": error.get("code"),
+                        "message": error.get("errmsg", ""),
+                    }
+            except Exception as e:
+                print(f"Bulk write to {self.collection.name} failed: {e}")
+                for index in range(len(ops)):
+                    item_errors[index] = {"index": index, "code": None, "message": str(e)}
+
+            report["errors"] = list(item_errors.values())
+            for index, future in enumerate(futures):
+                if not future.done():
+                    future.set_result(item_errors.get(index))
+
+            self.flushes += 1
+            for key in ("ops", "matched", "modified", "upserted", "deleted"):
+                self.totals[key] += report[key]
+            self.totals["failed"] += len(report["errors"])
+
+            if report["errors"]:
+                print(f"Bulk write to {self.collection.name}: {len(report['errors'])} of {len(ops)} operations failed")
+            return report
+
+    async def close(self) -> Dict[str, Any]:
+        # a pending timer finds the buffer empty and returns, so it is left to run out
+        await self.flush()
+        return self.totals
+
+
+# process-wide writers for fire-and-forget writes such as cached summaries
+_shared_writers: Dict[str, BulkWriter] = {}
+
+
+def get_bulk_writer(collection) -> BulkWriter:
+    writer = _shared_writers.get(collection.name)
+    if writer is None:
+        writer = BulkWriter(collection)
+        _shared_writers[collection.name] = writer
+    return writer
+
+
+async def close_bulk_writers():
+    for writer in _shared_writers.values():
+        await writer.close()
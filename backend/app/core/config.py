@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings
 from pydantic import Field
-from typing import List
+from typing import Dict, List
 import os
 from typing import ClassVar
 
@@ -12,6 +12,10 @@ class Settings(BaseSettings):
     
     # Database
     DATABASE_URL: str = Field(..., alias="DATABASE_URL")
+    MONGO_BULK_MAX_OPS: int = 500
+    MONGO_BULK_FLUSH_SECONDS: float = 0.5
+    # log Mongo commands slower than this many ms (0 disables the listener)
+    MONGO_SLOW_QUERY_MS: int = 0
     
     # Clerk Authentication
     CLERK_SECRET_KEY: str = ""
@@ -27,10 +31,84 @@ class Settings(BaseSettings):
     GEMINI_API_KEY: str = ""
     GEMINI_API_KEY_2: str = ""
     NEBIUS_API_KEY: str = ""
+    GEMINI_EXTRA_API_KEYS: List[str] = []
+    NEBIUS_BASE_URL: str = "https://api.studio.nebius.com/v1"
+    # app model name -> Nebius model name; only these models fail over to Nebius
+    NEBIUS_MODEL_MAP: Dict[str, str] = {"gemma-3-27b-it": "google/gemma-3-27b-it"}
+    # requests per minute per key, as "provider:model" or "provider:*"
+    LLM_RATE_LIMITS_RPM: Dict[str, float] = {
+        "gemini:gemma-3-27b-it": 30,
+        "gemini:gemini-2.5-flash": 10,
+        "nebius:*": 60,
+    }
+    LLM_DEFAULT_RPM: float = 15
+    LLM_ROUTER_MAX_WAIT_SECONDS: float = 20
+    # hedged calls race a second key after this long (0 disables hedging)
+    LLM_HEDGE_DELAY_SECONDS: float = 4
+    # a key rejected with 401/403 (revoked or lacking access) is skipped for this long
+    LLM_AUTH_COOLDOWN_SECONDS: float = 600
+
+    # LLM execution; concurrency limits are per key and scale with the number of keys
+    LLM_CONCURRENCY_LIMITS: Dict[str, int] = {"gemma-3-27b-it": 8, "gemini-2.5-flash": 4}
+    LLM_DEFAULT_CONCURRENCY: int = 4
+    LLM_TIMEOUT_SECONDS: float = 60
+    LLM_MAX_QUEUE: int = 200
+    AGENT_TIMEOUT_SECONDS: float = 180
+    LLM_CACHE_MAX_ENTRIES: int = 2048
+    LLM_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    CLASSIFY_BATCH_SIZE: int = 25
+    CLASSIFY_CONCURRENCY: int = 4
+    CLASSIFY_EMAIL_TOKEN_BUDGET: int = 300
+    LOCAL_CLASSIFIER_ENABLED: bool = True
+    LOCAL_CLASSIFIER_THRESHOLD: float = 0.85
+    LOCAL_CLASSIFIER_FEATURES: int = 1 << 17
+    LOCAL_CLASSIFIER_MIN_SAMPLES: int = 200
+    LOCAL_CLASSIFIER_RELOAD_SECONDS: float = 600
+    # longer inputs are summarized map-reduce style in chunks of SUMMARY_CHUNK_TOKENS
+    SUMMARY_DIRECT_MAX_TOKENS: int = 3000
+    SUMMARY_CHUNK_TOKENS: int = 1500
+    THREAD_SUMMARY_MAX_MESSAGES: int = 50
+    # a thread summary grown past this by folding in replies is recomputed from the messages
+    THREAD_SUMMARY_MAX_TOKENS: int = 600
+    STYLE_PROFILE_SAMPLES: int = 10
+    STYLE_SAMPLE_TOKEN_BUDGET: int = 200
+    # refresh a stored profile once this many new sent emails exist, or once it is this old
+    STYLE_PROFILE_REFRESH_MIN_NEW: int = 5
+    STYLE_PROFILE_MAX_AGE_DAYS: int = 30
+    # fewer sent emails than this to a recipient falls back to the user's general profile
+    STYLE_PROFILE_MIN_RECIPIENT_SAMPLES: int = 3
+    # background classification, short summary and RAG indexing of newly synced mail
+    ENRICHMENT_ENABLED: bool = True
+    ENRICH_SUMMARY_WORKERS: int = 2
+    ENRICH_EMBED_WORKERS: int = 1
+    ENRICH_MAX_QUEUE: int = 5000
+    # gemini | local (ONNX MiniLM on CPU) | hashing; changing it re-embeds every mailbox
+    EMBEDDING_PROVIDER: str = "gemini"
+    EMBEDDING_BATCH_SIZE: int = 64
+    EMBEDDING_QUERY_CACHE_SIZE: int = 1024
+    # chunks embedded per request when (re)indexing mail for RAG
+    RAG_EMBED_BATCH_SIZE: int = 256
+    # chroma (HNSW) | numpy (exact, memory-mapped); changing either re-embeds every mailbox
+    VECTOR_BACKEND: str = "chroma"
+    VECTOR_QUANTIZE_INT8: bool = False
+    # per-user vector store handles kept open
+    RAG_MAX_OPEN_STORES: int = 64
+    # BM25 index: body tokens indexed per email, and users whose index stays in memory
+    LEXICAL_MAX_BODY_TOKENS: int = 500
+    LEXICAL_MAX_USERS: int = 16
     
     # Email Providers
     GOOGLE_CLIENT_ID: str = ""
     GOOGLE_CLIENT_SECRET: str = ""
+    GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS: int = 300
+    GOOGLE_CLIENT_IDLE_TTL_SECONDS: int = 1800
+
+    # Gmail sync
+    GMAIL_FETCH_BATCH_SIZE: int = 50
+    GMAIL_FETCH_CONCURRENCY: int = 3
+    GMAIL_FETCH_MAX_RETRIES: int = 3
+    GMAIL_BACKFILL_PAGE_SIZE: int = 200
+    GMAIL_BACKFILL_LEASE_SECONDS: int = 300
 
     CLIENT_SECRETS_FILE: str = Field(
         default=os.path.join(BASE_DIR, "client_secret.json"),
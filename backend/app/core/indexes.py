@@ -0,0 +1,169 @@
+"""Declarative MongoDB index set and query-plan diagnostics.
+
+Run ``python -m app.core.indexes [user_id]`` to create/verify the indexes
+and print the plan of every hot query.
+"""
+import asyncio
+import json
+import sys
+from typing import Any, Dict, List, Optional
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from app.core.mongo import db
+
+# collection name -> indexes the app's queries rely on
+INDEXES: Dict[str, List[IndexModel]] = {
+    "emails": [
+        # inbox listing: find({"user_id"}).sort(date desc, id desc), keyset paging
+        IndexModel([("user_id", ASCENDING), ("date", DESCENDING), ("id", DESCENDING)], name="user_date_id"),
+        # single-email lookups; the id prefix also serves {"id": ...} alone (snooze)
+        IndexModel([("id", ASCENDING), ("user_id", ASCENDING)], name="id_user", unique=True),
+        # thread views: find({"thread_id", "user_id"}).sort(date asc)
+        IndexModel([("user_id", ASCENDING), ("thread_id", ASCENDING), ("date", ASCENDING)], name="user_thread_date"),
+        # inbox filtered by category
+        IndexModel([("user_id", ASCENDING), ("classification", ASCENDING), ("date", DESCENDING)], name="user_classification_date"),
+        # inbox filtered by Gmail label; sent mail ("SENT") for style profiles
+        IndexModel([("user_id", ASCENDING), ("labels", ASCENDING), ("date", DESCENDING)], name="user_labels_date"),
+    ],
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id", unique=True),
+        IndexModel([("email", ASCENDING)], name="email", unique=True),
+    ],
+    "sync_jobs": [
+        IndexModel([("user_id", ASCENDING), ("type", ASCENDING)], name="user_type", unique=True),
+    ],
+    "llm_cache": [
+        # TTL: Mongo drops entries once expires_at has passed
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "thread_summaries": [
+        IndexModel([("user_id", ASCENDING), ("thread_id", ASCENDING), ("mode", ASCENDING)], name="user_thread_mode", unique=True),
+    ],
+    "style_profiles": [
+        IndexModel([("user_id", ASCENDING), ("recipient", ASCENDING)], name="user_recipient", unique=True),
+    ],
+    "meetings": [
+        IndexModel([("user_id", ASCENDING), ("start_time", DESCENDING)], name="user_start_time"),
+    ],
+}
+
+# queries on the request path; values are placeholders replaced by a real user's data when available
+HOT_QUERIES: List[Dict[str, Any]] = [
+    {"name": "inbox_list", "collection": "emails",
+     "filter": {"user_id": "$user_id"}, "sort": [("date", DESCENDING), ("id", DESCENDING)], "limit": 50},
+    {"name": "inbox_by_classification", "collection": "emails",
+     "filter": {"user_id": "$user_id", "classification": "WORK"}, "sort": [("date", DESCENDING), ("id", DESCENDING)], "limit": 50},
+    {"name": "email_lookup", "collection": "emails",
+     "filter": {"id": "$email_id", "user_id": "$user_id"}, "limit": 1},
+    {"name": "thread_messages", "collection": "emails",
+     "filter": {"thread_id": "$thread_id", "user_id": "$user_id"}, "sort": [("date", ASCENDING)], "limit": 50},
+    {"name": "sent_mail", "collection": "emails",
+     "filter": {"user_id": "$user_id", "labels": "SENT"}, "sort": [("date", DESCENDING)], "limit": 10},
+    {"name": "user_by_id", "collection": "users", "filter": {"id": "$user_id"}, "limit": 1},
+    {"name": "user_by_email", "collection": "users", "filter": {"email": "$email"}, "limit": 1},
+]
+
+
+def _key_spec(index: IndexModel) -> List:
+    return list(index.document["key"].items())
+
+
+async def verify_indexes() -> List[str]:
+    """Report every registered index that is missing or differs, without creating any."""
+    problems = []
+    for collection_name, indexes in INDEXES.items():
+        existing = await db[collection_name].index_information()
+        for index in indexes:
+            name = index.document["name"]
+            info = existing.get(name)
+            if info is None:
+                problems.append(f"{collection_name}.{name}: missing")
+            elif list(info["key"]) != _key_spec(index):
+                problems.append(f"{collection_name}.{name}: keys {info['key']} differ from registry")
+    return problems
+
+
+async def ensure_indexes() -> Dict[str, Any]:
+    """Create every registered index and report any that are missing or differ afterwards."""
+    report = {"created": [], "problems": []}
+    for collection_name, indexes in INDEXES.items():
+        try:
+            report["created"] += [
+                f"{collection_name}.{name}" for name in await db[collection_name].create_indexes(indexes)
+            ]
+        except OperationFailure as e:
+            report["problems"].append(f"{collection_name}: {e}")
+    report["problems"] += await verify_indexes()
+    return report
+
+
+def _substitute(value, samples: Dict[str, Any]):
+    if isinstance(value, dict):
+        return {k: _substitute(v, samples) for k, v in value.items()}
+    if isinstance(value, str) and value.startswith("$"):
+        return samples.get(value[1:], value)
+    return value
+
+
+def _plan_stages(plan: Dict) -> List[str]:
+    stages = []
+    while plan:
+        stage = plan.get("stage", "")
+        if plan.get("indexName"):
+            stage = f"{stage}({plan['indexName']})"
+        stages.append(stage)
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return stages
+
+
+async def _sample_values(user_id: Optional[str]) -> Dict[str, Any]:
+    samples = {"user_id": user_id or "", "email_id": "", "thread_id": "", "email": ""}
+    if not user_id:
+        return samples
+    user = await db["users"].find_one({"id": user_id}, projection={"email": 1})
+    email = await db["emails"].find_one({"user_id": user_id}, projection={"id": 1, "thread_id": 1})
+    if user:
+        samples["email"] = user.get("email", "")
+    if email:
+        samples["email_id"] = email["id"]
+        samples["thread_id"] = email.get("thread_id", "")
+    return samples
+
+
+async def explain_hot_queries(user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """``explain()`` every hot query and flag the ones that scan a whole collection."""
+    samples = await _sample_values(user_id)
+    results = []
+    for query in HOT_QUERIES:
+        filter_ = _substitute(query["filter"], samples)
+        cursor = db[query["collection"]].find(filter_)
+        if query.get("sort"):
+            cursor = cursor.sort(query["sort"])
+        cursor = cursor.limit(query.get("limit", 0))
+
+        explained = await cursor.explain()
+        stages = _plan_stages(explained.get("queryPlanner", {}).get("winningPlan", {}))
+        stats = explained.get("executionStats", {})
+        results.append({
+            "name": query["name"],
+            "collection": query["collection"],
+            "plan": stages,
+            "collection_scan": any(s.startswith("COLLSCAN") for s in stages),
+            "in_memory_sort": any(s.startswith("SORT") for s in stages),
+            "docs_examined": stats.get("totalDocsExamined"),
+            "keys_examined": stats.get("totalKeysExamined"),
+            "returned": stats.get("nReturned"),
+            "millis": stats.get("executionTimeMillis"),
+        })
+    return results
+
+
+async def _main(user_id: Optional[str]):
+    print(json.dumps(await ensure_indexes(), indent=2))
+    print(json.dumps(await explain_hot_queries(user_id), indent=2, default=str))
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else None))
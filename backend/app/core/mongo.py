@@ -1,9 +1,19 @@
 import motor.motor_asyncio
 import os
 from app.core.config import settings
+from app.core.query_monitor import SlowQueryListener
 
 MONGO_URL = settings.DATABASE_URL
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
+event_listeners = []
+if settings.MONGO_SLOW_QUERY_MS > 0:
+    event_listeners.append(SlowQueryListener(settings.MONGO_SLOW_QUERY_MS))
+
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL, event_listeners=event_listeners)
 db = client["email_assistant"]
 emails_collection = db["emails"]
-users_collection = db["users"]
\ No newline at end of file
+users_collection = db["users"]
+sync_jobs_collection = db["sync_jobs"]
+llm_cache_collection = db["llm_cache"]
+classifier_models_collection = db["classifier_models"]
+style_profiles_collection = db["style_profiles"]
+thread_summaries_collection = db["thread_summaries"]
@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+
+from pymongo import monitoring
+
+# commands that carry a user-facing query; admin/handshake traffic is ignored
+WATCHED_COMMANDS = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+
+
+def _redact(value):
+    """The shape of a filter or update: keys and operators, with every value replaced by "?"."""
+    if isinstance(value, dict):
+        return {key: _redact(v) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return []
+        # bulk writes and $in lists can be long; the first element shows the shape
+        return [_redact(value[0])] + ([f"... {len(value)} total"] if len(value) > 1 else [])
+    return "?"
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    """Logs commands slower than ``threshold_ms`` together with the shape of
+    their filter; values are redacted since they hold addresses and bodies.
+
+    pymongo only attaches the command document to the started event, so the
+    documents of in-flight commands are kept (bounded) until they finish.
+    pymongo calls listeners from its pool threads, so that map is locked.
+    """
+
+    def __init__(self, threshold_ms: int, max_pending: int = 1000):
+        self.threshold_ms = threshold_ms
+        self.max_pending = max_pending
+        self._pending: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name not in WATCHED_COMMANDS:
+            return
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = event.command
+            while len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        with self._lock:
+            command = self._pending.pop((event.connection_id, event.request_id), None)
+        if command is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        if duration_ms < self.threshold_ms:
+            return
+
+        collection = command.get(event.command_name)
+        shape = {
+            key: command[key] if key == "sort" else _redact(command[key])
+            for key in ("filter", "sort", "pipeline", "query", "update", "updates", "deletes")
+            if key in command
+        }
+        print(f"🐢 Slow Mongo {event.command_name} on {event.database_name}.{collection}: "
+              f"{duration_ms:.1f} ms {shape}")
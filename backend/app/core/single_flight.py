@@ -0,0 +1,73 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into one execution.
+
+    The first caller for a key runs the work in its own task; callers that
+    arrive while it is in flight await the same result instead of repeating
+    it. The task is shielded from its callers, so one of them disconnecting
+    does not cancel the work the others are waiting for.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, group: str, field: str):
+        stats = self._stats.setdefault(group, {"executed": 0, "collapsed": 0})
+        stats[field] += 1
+
+    def _track(self, key: str, future: asyncio.Future, group: str):
+        self._count(group, "executed")
+        self._inflight[key] = future
+
+        def done(f: asyncio.Future):
+            if self._inflight.get(key) is f:
+                del self._inflight[key]
+            if not f.cancelled():
+                # mark the exception retrieved; the callers that are still waiting re-raise it
+                f.exception()
+
+        future.add_done_callback(done)
+
+    async def follow(self, key: str, group: str) -> Tuple[bool, Any]:
+        """Wait for an in-flight execution of ``key``: ``(True, result)``, or
+        ``(False, None)`` if there is none or its producer gave up."""
+        future = self._inflight.get(key)
+        if future is None:
+            return False, None
+        self._count(group, "collapsed")
+        await asyncio.wait({future})
+        if future.cancelled():
+            return False, None
+        return True, future.result()
+
+    def start(self, key: str, group: str) -> asyncio.Future:
+        """Register a caller that produces the result itself, e.g. while streaming it.
+
+        The caller must resolve the returned future; cancelling it sends
+        followers back to computing the result on their own.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._track(key, future, group)
+        return future
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]], group: str = "default") -> Any:
+        joined, result = await self.follow(key, group)
+        if joined:
+            return result
+        future = asyncio.ensure_future(fn())
+        self._track(key, future, group)
+        return await asyncio.shield(future)
+
+    def stats(self) -> Dict[str, Any]:
+        collapsed = sum(s["collapsed"] for s in self._stats.values())
+        total = collapsed + sum(s["executed"] for s in self._stats.values())
+        return {
+            "in_flight": len(self._inflight),
+            "collapsed": collapsed,
+            "collapse_rate": round(collapsed / total, 3) if total else 0.0,
+            "by_group": self._stats,
+        }
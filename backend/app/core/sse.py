@@ -0,0 +1,56 @@
+"""Server-Sent Events responses for endpoints that stream model output."""
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from fastapi.responses import StreamingResponse
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        # proxies must pass tokens through as they come instead of buffering the body
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def stream_completion(
+    chunks: AsyncIterator[str],
+    on_complete: Optional[Callable[[str], Awaitable[Dict[str, Any]]]] = None,
+) -> StreamingResponse:
+    """Relay model output as ``token`` events, then one ``done`` event with the full text.
+
+    The first chunk is awaited before responding, so failures to start
+    (overload, no quota) still reach the client as HTTP errors. Later
+    failures end the stream with an ``error`` event. ``on_complete`` runs
+    only if the stream finished, and its result is merged into ``done``.
+    """
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def events():
+        parts = []
+        try:
+            if first is not None:
+                parts.append(first)
+                yield sse_event("token", {"text": first})
+                async for chunk in chunks:
+                    parts.append(chunk)
+                    yield sse_event("token", {"text": chunk})
+        except Exception as e:
+            yield sse_event("error", {"detail": str(e)})
+            return
+        finally:
+            # on client disconnect, release the model slot and connection now rather than at GC
+            await chunks.aclose()
+        text = "".join(parts).strip()
+        extra = await on_complete(text) if on_complete else {}
+        yield sse_event("done", {"text": text, **extra})
+
+    return sse_response(events())
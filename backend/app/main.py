@@ -1,8 +1,15 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.core.config import settings
-from app.api import email_endpoint, summarise_endpoint, filtering_endpoint, email_composition_endpoint, search_rag_endpoint, agent_endpoint
+from app.api import email_endpoint, summarise_endpoint, filtering_endpoint, email_composition_endpoint, search_rag_endpoint, agent_endpoint, diagnostics_endpoint
 from app.core import mongo 
+from app.core.indexes import ensure_indexes
+from app.services.llm_executor import LLMTimeoutError, LLMOverloadedError
+from app.services.llm_router import LLMProviderError, llm_router
+from app.core.bulk_writer import close_bulk_writers
+from app.services.gmail_backfill import resume_backfills, stop_backfills
+from app.services.enrichment import enrichment_pipeline
 
 app = FastAPI(title=settings.PROJECT_NAME, version=settings.VERSION)
 
@@ -21,6 +28,19 @@ app.include_router(filtering_endpoint.router, prefix="/filtering", tags=["filter
 app.include_router(email_composition_endpoint.router, prefix="/personalized", tags=["personalized"])
 app.include_router(search_rag_endpoint.router, prefix="/search", tags=["search"])
 app.include_router(agent_endpoint.router, prefix="/think", tags=["agent"])
+app.include_router(diagnostics_endpoint.router, prefix="/diagnostics", tags=["diagnostics"])
+
+@app.exception_handler(LLMTimeoutError)
+async def llm_timeout_handler(request: Request, exc: LLMTimeoutError):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+@app.exception_handler(LLMOverloadedError)
+async def llm_overloaded_handler(request: Request, exc: LLMOverloadedError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+@app.exception_handler(LLMProviderError)
+async def llm_provider_handler(request: Request, exc: LLMProviderError):
+    return JSONResponse(status_code=502, content={"detail": str(exc)})
 
 @app.on_event("startup")
 async def startup_db_client():
@@ -31,9 +51,23 @@ async def startup_db_client():
         print("✅ MongoDB connected successfully")
     except Exception as e:
         print("❌ MongoDB connection failed:", e)
+        return
+
+    report = await ensure_indexes()
+    if report["problems"]:
+        print("⚠️ MongoDB index problems:", report["problems"])
+    else:
+        print("✅ MongoDB indexes verified")
+
+    enrichment_pipeline.start()
+    await resume_backfills()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await stop_backfills()
+    await enrichment_pipeline.stop()
+    await close_bulk_writers()
+    await llm_router.aclose()
     mongo.client.close()
     print("🔌 MongoDB connection closed")
 
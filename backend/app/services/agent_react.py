@@ -7,9 +7,17 @@ from app.services.agent_tools import (
     sync_filtering_tool, 
     sync_draft_tool, 
     sync_schedule_tool, 
-    sync_snooze_tool
+    sync_snooze_tool,
+    summarization_tool,
+    filtering_tool,
+    draft_tool,
+    schedule_tool,
+    snooze_tool,
 )
+from app.services.llm_executor import llm_executor
+from app.services.llm_router import llm_router, Endpoint
 from app.core.config import settings
+from app.services.text_cleaning import email_text
 import asyncio
 import time
 import threading
@@ -85,13 +93,36 @@ def extract_email(sender: str) -> str:
         return match.group(1)
     return sender.strip()
 
-gemini_model = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash",
-    api_key=settings.GEMINI_API_KEY_2,
-    temperature=0,
-)
+AGENT_MODEL = "gemini-2.5-flash"
+
+llm_executor.scale_limit(AGENT_MODEL, llm_router.endpoint_count(AGENT_MODEL, "gemini"))
+
+# one chat model per Gemini key; the router picks the key for each run
+_agent_models: Dict[str, ChatGoogleGenerativeAI] = {}
+
+def get_agent_model(endpoint: Endpoint) -> ChatGoogleGenerativeAI:
+    if endpoint.name not in _agent_models:
+        _agent_models[endpoint.name] = ChatGoogleGenerativeAI(
+            model=AGENT_MODEL,
+            api_key=endpoint.api_key,
+            temperature=0,
+        )
+    return _agent_models[endpoint.name]
+
+class RouterUsageHandler(BaseCallbackHandler):
+    """Charges each agent LLM call after the first against the leased key's rate limit."""
+    def __init__(self, endpoint: Endpoint):
+        self.bucket = endpoint.bucket(AGENT_MODEL)
+        self.calls = 0
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.calls += 1
+        if self.calls > 1:
+            self.bucket.charge()
 
 def get_tools(user_id: str, email_id: str, email_doc: dict):    
+    target_email = extract_email(email_doc.get("sender", ""))
+
     def summarize_wrapper(text: str):
         return sync_summarization_tool(text)
     
@@ -102,48 +133,61 @@ def get_tools(user_id: str, email_id: str, email_doc: dict):
         return sync_draft_tool(f"{user_id}|{input_data}")
     
     def schedule_wrapper(input_str: str):
-        target_email = extract_email(email_doc.get("sender", ""))
         return sync_schedule_tool(f"{user_id}|{email_id}|{input_str}|{target_email}")
     
     def snooze_wrapper(days: str):
         return sync_snooze_tool(f"{email_id}|{days}")
+
+    async def async_draft_wrapper(input_data: str):
+        return await draft_tool(f"{user_id}|{input_data}")
+
+    async def async_schedule_wrapper(input_str: str):
+        return await schedule_tool(f"{user_id}|{email_id}|{input_str}|{target_email}")
+
+    async def async_snooze_wrapper(days: str):
+        return await snooze_tool(f"{email_id}|{days}")
     
     return [
         Tool(
             name="summarize_email", 
             func=summarize_wrapper, 
+            coroutine=summarization_tool,
             description="Summarize an email. Input: email_text (or email_text|mode where mode is 'short' or 'long')"
         ),
         Tool(
             name="filter_email", 
             func=filter_wrapper, 
+            coroutine=filtering_tool,
             description="Classify an email category. Input: email_text"
         ),
         Tool(
             name="draft_email", 
             func=draft_wrapper, 
+            coroutine=async_draft_wrapper,
             description="Generate a reply draft using RAG + user style. Input: recipient|subject|context|original_email_body"
         ),
         Tool(
             name="schedule_meeting", 
             func=schedule_wrapper, 
+            coroutine=async_schedule_wrapper,
             description="Schedule a meeting in Google Calendar. Input: meeting_details|target_user_email (target email auto-extracted from sender)"
         ),
         Tool(
             name="snooze_email", 
             func=snooze_wrapper, 
+            coroutine=async_snooze_wrapper,
             description="Snooze an email for X days. Input: number_of_days"
         )
     ]
 
-def get_agent_executor(user_id, email_id, email_doc):
-    handler = EnhancedThoughtCaptureHandler()
+def get_agent_executor(user_id, email_id, email_doc, endpoint: Endpoint, handler=None):
+    handler = handler or EnhancedThoughtCaptureHandler()
     agent = initialize_agent(
         tools=get_tools(user_id, email_id, email_doc),
-        llm=gemini_model,
+        llm=get_agent_model(endpoint),
         agent="zero-shot-react-description",
         verbose=True,
-        callbacks=[handler],
+        callbacks=[handler, RouterUsageHandler(endpoint)],
         max_iterations=5,
         early_stopping_method="generate"
     )
@@ -151,11 +195,11 @@ def get_agent_executor(user_id, email_id, email_doc):
 
 async def run_agent_on_email(email: dict, user_id: str, user_input: str | None = None):
     email_id = email.get("id")
-    email_body = email.get("body") or email.get("plain_body") or email.get("snippet", "")
+    email_body = email_text(email)
     email_subject = email.get("subject", "No subject")
     email_sender = email.get("sender", "Unknown sender")
 
-    agent, handler = get_agent_executor(user_id, email_id, email)
+    handler = EnhancedThoughtCaptureHandler()
 
     if not user_input:  
         query = f"""
@@ -188,7 +232,13 @@ Think step by step and use the tools available to you.
     print(f"Starting agent execution at {time.strftime('%H:%M:%S')}")
     
     try:
-        result = agent.invoke({"input": query})
+        async with llm_router.lease(AGENT_MODEL, "gemini") as endpoint:
+            agent, _ = get_agent_executor(user_id, email_id, email, endpoint, handler)
+            result = await llm_executor.run(
+                AGENT_MODEL,
+                lambda: agent.ainvoke({"input": query}),
+                timeout=settings.AGENT_TIMEOUT_SECONDS,
+            )
         print(f"Agent execution completed at {time.strftime('%H:%M:%S')}")
 
         output = result.get("output", "")
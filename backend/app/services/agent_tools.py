@@ -1,7 +1,10 @@
 import asyncio
 from datetime import datetime, timedelta
-from app.services.llm_client import summarize_text, classify_email, generate_personalized_email
+from app.services.llm_client import summarize_text, generate_personalized_email
+from app.services.local_classifier import local_classifier
 from app.core.mongo import emails_collection
+from app.core.bulk_writer import BulkWriter
+from pymongo import UpdateOne
 from app.services.email_composition import build_user_profile
 from app.services.meeting_scheduling import sched_service
 import nest_asyncio
@@ -16,42 +19,46 @@ def run_sync(coro):
     except RuntimeError:
         return asyncio.run(coro)
 
-def sync_summarization_tool(input_str: str):
+# The agent awaits the async tools on the event loop; the sync_* wrappers
+# are kept for callers outside a running loop (e.g. app/debug.py).
+
+async def summarization_tool(input_str: str):
     try:
         if "|" in input_str:
             text, mode = input_str.split("|", 1)
         else:
             text, mode = input_str, "short"
-        
+
         text = text.strip()
         mode = mode.strip()
-        
+
         if not text:
             return "Error: No text provided for summarization"
-        
+
         if mode not in ["short", "long"]:
             mode = "short"
-        
-        return run_sync(summarize_text(text, mode))
-        
+
+        return await summarize_text(text, mode)
+
     except Exception as e:
         return f"Error summarizing email: {str(e)}"
 
 
-def sync_filtering_tool(email_text: str):
+async def filtering_tool(email_text: str):
     try:
         if not email_text or not email_text.strip():
             return "Error: No email text provided for classification"
-        
+
         email_text = email_text.strip()
-        
-        return run_sync(classify_email(email_text))
-        
+
+        [(category, _)] = await local_classifier.classify([{"body": email_text}])
+        return category
+
     except Exception as e:
         return f"Error classifying email: {str(e)}"
 
 
-def sync_draft_tool(input_str: str):
+async def draft_tool(input_str: str):
     try:
         parts = input_str.split("|")
         if len(parts) < 4:
@@ -69,18 +76,15 @@ def sync_draft_tool(input_str: str):
         if not all([user_id, recipient, subject, context]):
             return "Error: Missing required fields (user_id, recipient, subject, context)"
 
-        async def draft_coro():
-            profile = await build_user_profile(user_id)
-            return await generate_personalized_email(
-                profile,
-                recipient,
-                subject,
-                context,
-                reply_to=reply_to
-            )
-
-        return run_sync(draft_coro())
-        
+        profile = await build_user_profile(user_id, recipient)
+        return await generate_personalized_email(
+            profile,
+            recipient,
+            subject,
+            context,
+            reply_to=reply_to
+        )
+
     except ValueError as e:
         return f"Error parsing input: {str(e)}"
     except Exception as e:
@@ -92,7 +96,7 @@ def extract_email(sender: str) -> str:
         return match.group(1)
     return sender.strip()
 
-def sync_schedule_tool(input_str: str):
+async def schedule_tool(input_str: str):
     try:
         parts = input_str.split("|")
         if len(parts) < 3:
@@ -106,21 +110,18 @@ def sync_schedule_tool(input_str: str):
 
         target_user_email = extract_email(target_user_email)
 
-        async def schedule_coro():
-            return await sched_service.schedule_meeting_from_email(
-                user_id=user_id,
-                email_id=email_id,
-                details=details,
-                target_user_email=target_user_email
-            )
-
-        return run_sync(schedule_coro())
+        return await sched_service.schedule_meeting_from_email(
+            user_id=user_id,
+            email_id=email_id,
+            details=details,
+            target_user_email=target_user_email
+        )
 
     except Exception as e:
         return f"Error scheduling meeting: {str(e)}"
 
 
-def sync_snooze_tool(input_str: str):
+async def snooze_tool(input_str: str):
     try:
         parts = input_str.split("|")
         if len(parts) != 2:
@@ -128,32 +129,49 @@ def sync_snooze_tool(input_str: str):
 
         email_id, days_str = parts
         email_id = email_id.strip()
-        
+
         if not email_id:
             return "Error: No email_id provided"
-        
+
         try:
             days = int(days_str.strip())
         except ValueError:
             return "Error: Days must be a valid integer"
-        
+
         if days < 0:
             return "Error: Days cannot be negative"
-        
+
         snooze_time = datetime.utcnow() + timedelta(days=days)
 
-        async def snooze_coro():
-            result = await emails_collection.update_one(
+        async with BulkWriter(emails_collection) as writer:
+            written = await writer.add(UpdateOne(
                 {"id": email_id},
                 {"$set": {"snoozed_until": snooze_time}}
-            )
-            
-            if result.matched_count == 0:
-                return f"Warning: No email found with id {email_id}"
-            
-            return f"Email {email_id} snoozed until {snooze_time.strftime('%Y-%m-%d %H:%M:%S')} UTC"
-
-        return run_sync(snooze_coro())
-        
+            ))
+
+        error = written.result()
+        if error:
+            return f"Error snoozing email: {error['message']}"
+        if writer.totals["matched"] == 0:
+            return f"Warning: No email found with id {email_id}"
+
+        return f"Email {email_id} snoozed until {snooze_time.strftime('%Y-%m-%d %H:%M:%S')} UTC"
+
     except Exception as e:
-        return f"Error snoozing email: {str(e)}"
\ No newline at end of file
+        return f"Error snoozing email: {str(e)}"
+
+
+def sync_summarization_tool(input_str: str):
+    return run_sync(summarization_tool(input_str))
+
+def sync_filtering_tool(email_text: str):
+    return run_sync(filtering_tool(email_text))
+
+def sync_draft_tool(input_str: str):
+    return run_sync(draft_tool(input_str))
+
+def sync_schedule_tool(input_str: str):
+    return run_sync(schedule_tool(input_str))
+
+def sync_snooze_tool(input_str: str):
+    return run_sync(snooze_tool(input_str))
@@ -0,0 +1,116 @@
+import asyncio
+from typing import AsyncIterator, Dict, List
+
+from pymongo import UpdateOne
+
+from app.core.bulk_writer import BulkWriter
+from app.core.config import settings
+from app.core.mongo import emails_collection
+from app.services.llm_client import CLASSIFIER_VERSION
+from app.services.local_classifier import local_classifier
+from app.services.text_cleaning import TEXT_FIELDS
+
+_DONE = object()
+
+
+async def classify_mailbox(user_id: str, force: bool = False) -> AsyncIterator[Dict]:
+    """Classify every email of ``user_id`` and yield a progress event per email.
+
+    Emails already classified by ``CLASSIFIER_VERSION`` are skipped unless
+    ``force``. The mailbox is read with a cursor in batches of
+    ``CLASSIFY_BATCH_SIZE``; at most ``CLASSIFY_CONCURRENCY`` batches are
+    being classified at once and only a few more are held in memory, so
+    events start flowing after the first batch whatever the mailbox size.
+    Confident cases are answered by the local classifier; the rest go to
+    the LLM, and each event says which one answered. An email is reported
+    ``classified`` only once its result is written; a failed write is an
+    ``error`` event.
+    """
+    query = {"user_id": user_id}
+    if not force:
+        query["classification_version"] = {"$ne": CLASSIFIER_VERSION}
+
+    total = await emails_collection.count_documents(query)
+    yield {"type": "start", "total": total, "classifier_version": CLASSIFIER_VERSION}
+
+    concurrency = max(1, settings.CLASSIFY_CONCURRENCY)
+    semaphore = asyncio.Semaphore(concurrency)
+    # bounds batches read from Mongo but not yet reported
+    window = asyncio.Semaphore(concurrency * 2)
+    results: asyncio.Queue = asyncio.Queue()
+    tasks: List[asyncio.Task] = []
+
+    async def classify_batch(batch: List[Dict]):
+        async with semaphore:
+            try:
+                answers = await local_classifier.classify(batch)
+                await results.put((batch, answers, None))
+            except Exception as e:
+                await results.put((batch, None, e))
+
+    async def produce():
+        try:
+            cursor = emails_collection.find(
+                query, projection={**TEXT_FIELDS, "id": 1, "subject": 1, "sender": 1, "labels": 1}
+            ).batch_size(settings.CLASSIFY_BATCH_SIZE * concurrency)
+            batch: List[Dict] = []
+            async for email in cursor:
+                batch.append(email)
+                if len(batch) >= settings.CLASSIFY_BATCH_SIZE:
+                    await window.acquire()
+                    tasks.append(asyncio.create_task(classify_batch(batch)))
+                    batch = []
+            if batch:
+                await window.acquire()
+                tasks.append(asyncio.create_task(classify_batch(batch)))
+            await asyncio.gather(*tasks)
+        finally:
+            # a cursor error surfaces when the consumer awaits the producer
+            results.put_nowait(_DONE)
+
+    producer = asyncio.create_task(produce())
+    done = failed = 0
+
+    try:
+        async with BulkWriter(emails_collection) as writer:
+            while True:
+                item = await results.get()
+                if item is _DONE:
+                    break
+                batch, answers, error = item
+                window.release()
+
+                if error is not None:
+                    for email in batch:
+                        failed += 1
+                        yield {"type": "error", "id": email["id"], "error": str(error)}
+                    continue
+
+                writes = []
+                for email, (category, source) in zip(batch, answers):
+                    writes.append(await writer.add(UpdateOne(
+                        {"id": email["id"], "user_id": user_id},
+                        {"$set": {"classification": category,
+                                  "classification_version": CLASSIFIER_VERSION,
+                                  "classification_source": source}}
+                    )))
+                # one write per batch, so its events go out as soon as the batch is classified
+                await writer.flush()
+                for email, (category, source), future in zip(batch, answers, writes):
+                    write_error = await future
+                    if write_error:
+                        failed += 1
+                        yield {"type": "error", "id": email["id"], "error": f"write failed: {write_error['message']}"}
+                    else:
+                        done += 1
+                        yield {"type": "classified", "id": email["id"], "classification": category,
+                               "source": source, "done": done, "total": total}
+
+        await producer
+        yield {"type": "complete", "classified": done, "failed": failed,
+               "write_failures": writer.totals["failed"]}
+    finally:
+        # the client may disconnect mid-stream; don't leave model calls running
+        producer.cancel()
+        for task in tasks:
+            task.cancel()
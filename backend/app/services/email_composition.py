@@ -1,19 +1,139 @@
-from app.core.mongo import emails_collection
-from app.services.llm_client import analyze_writing_style
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
 
-async def get_user_writing_samples(user_id: str, limit: int = 20) -> list[str]:
+from app.core.config import settings
+from app.core.mongo import emails_collection, style_profiles_collection
+from app.core.single_flight import SingleFlight
+from app.services.llm_client import analyze_writing_style, update_writing_style, PROMPT_VERSIONS
+from app.services.text_cleaning import TEXT_FIELDS, email_text, truncate_to_tokens
+
+DEFAULT_PROFILE = "Neutral, professional, concise writing style."
+# ``recipient`` value of a user's general profile
+ALL_RECIPIENTS = "*"
+PROFILE_VERSION = f"{PROMPT_VERSIONS['writing_style']}.{PROMPT_VERSIONS['writing_style_update']}"
+
+_ADDRESS_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+_refreshes = SingleFlight()
+
+
+def _address(recipient: str) -> Optional[str]:
+    match = _ADDRESS_RE.search(recipient or "")
+    return match.group(0).lower() if match else None
+
+
+def _sent_query(user_id: str, address: Optional[str] = None, since: Optional[datetime] = None) -> Dict[str, Any]:
+    query: Dict[str, Any] = {"user_id": user_id, "labels": "SENT"}
+    if address:
+        query["recipients"] = {"$regex": re.escape(address), "$options": "i"}
+    if since:
+        query["date"] = {"$gt": since}
+    return query
+
+
+async def get_user_writing_samples(
+    user_id: str,
+    limit: Optional[int] = None,
+    address: Optional[str] = None,
+    since: Optional[datetime] = None,
+) -> List[Dict[str, Any]]:
+    """The user's latest sent emails, newest first, each cut to ``STYLE_SAMPLE_TOKEN_BUDGET``."""
+    limit = limit or settings.STYLE_PROFILE_SAMPLES
     cursor = emails_collection.find(
-        {"user_id": user_id},
-        projection={"body": 1},
+        _sent_query(user_id, address, since),
+        projection={**TEXT_FIELDS, "date": 1},
     ).sort("date", -1).limit(limit)
-    emails = await cursor.to_list(length=limit)
-    return [e["body"] for e in emails if e.get("body")]
 
-async def build_user_profile(user_id: str) -> str:
-    samples = await get_user_writing_samples(user_id)
-    if not samples:
-        return "Neutral, professional, concise writing style."
+    samples = []
+    async for e in cursor:
+        text = email_text(e)
+        if text:
+            samples.append({"text": truncate_to_tokens(text, settings.STYLE_SAMPLE_TOKEN_BUDGET), "date": e["date"]})
+    return samples
+
+
+def _join(samples: List[Dict[str, Any]]) -> str:
+    return "\n\n---\n\n".join(s["text"] for s in samples)
+
+
+async def _load_or_refresh(user_id: str, address: Optional[str]) -> Optional[Dict[str, Any]]:
+    """The stored profile, refreshed first if enough new sent mail arrived or it aged out.
+
+    A refresh folds only the new emails into the existing profile; an aged
+    out profile (or one from older prompts) is rebuilt from scratch.
+    """
+    key = address or ALL_RECIPIENTS
+    stored = await style_profiles_collection.find_one({"user_id": user_id, "recipient": key})
+    now = datetime.utcnow()
+
+    rebuild = (
+        stored is None
+        or stored.get("version") != PROFILE_VERSION
+        or now - stored["built_at"] > timedelta(days=settings.STYLE_PROFILE_MAX_AGE_DAYS)
+    )
+    if not rebuild:
+        new_count = await emails_collection.count_documents(
+            _sent_query(user_id, address, stored["last_sent_at"]),
+            limit=settings.STYLE_PROFILE_REFRESH_MIN_NEW,
+        )
+        if new_count < settings.STYLE_PROFILE_REFRESH_MIN_NEW:
+            return stored
+
+        samples = await get_user_writing_samples(user_id, address=address, since=stored["last_sent_at"])
+        if samples:
+            profile = await update_writing_style(stored["profile"], _join(samples))
+        else:
+            # the new sent mail has no text (attachment-only sends); nothing to learn from
+            profile = stored["profile"]
+        sample_count = stored["sample_count"] + len(samples)
+        # age counts from the last full rebuild, so incremental drift is bounded
+        built_at = stored["built_at"]
+        newest = await emails_collection.find_one(
+            _sent_query(user_id, address, stored["last_sent_at"]), projection={"date": 1}, sort=[("date", -1)]
+        )
+        last_sent_at = newest["date"] if newest else stored["last_sent_at"]
+    else:
+        samples = await get_user_writing_samples(user_id, address=address)
+        if len(samples) < (settings.STYLE_PROFILE_MIN_RECIPIENT_SAMPLES if address else 1):
+            return None
+        profile = await analyze_writing_style(_join(samples))
+        sample_count = len(samples)
+        built_at = now
+        last_sent_at = max(s["date"] for s in samples)
+
+    doc = {
+        "user_id": user_id,
+        "recipient": key,
+        "profile": profile,
+        "version": PROFILE_VERSION,
+        "sample_count": sample_count,
+        "last_sent_at": last_sent_at,
+        "built_at": built_at,
+        "updated_at": now,
+    }
+    await style_profiles_collection.replace_one({"user_id": user_id, "recipient": key}, doc, upsert=True)
+    return doc
+
+
+async def get_style_profile(user_id: str, address: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    # concurrent drafts for the same user share one check/refresh
+    return await _refreshes.do(
+        f"{user_id}:{address or ALL_RECIPIENTS}",
+        lambda: _load_or_refresh(user_id, address),
+        group="style_profile",
+    )
+
+
+async def build_user_profile(user_id: str, recipient: Optional[str] = None) -> str:
+    """The user's writing-style profile from their sent mail.
 
-    combined = "\n\n".join(samples[:10]) 
-    profile = await analyze_writing_style(combined)
-    return profile
\ No newline at end of file
+    Uses the profile for ``recipient`` when the user has written to them
+    often enough, and the user's general profile otherwise.
+    """
+    address = _address(recipient) if recipient else None
+    if address:
+        doc = await get_style_profile(user_id, address)
+        if doc:
+            return doc["profile"]
+    doc = await get_style_profile(user_id)
+    return doc["profile"] if doc else DEFAULT_PROFILE
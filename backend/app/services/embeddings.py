@@ -0,0 +1,154 @@
+"""Embedding providers for the RAG store.
+
+``EMBEDDING_PROVIDER`` picks one of ``PROVIDERS``:
+
+* ``gemini``: Gemini's embedding API, one network call per batch.
+* ``local``: all-MiniLM-L6-v2 run on the CPU through ONNX Runtime (the
+  model Chroma ships; downloaded once, then works offline).
+* ``hashing``: signed feature hashing of words and bigrams. It needs no
+  model at all and is meant for offline development and tests.
+
+Whatever the provider, query embeddings go through an LRU so repeated and
+paginated searches are embedded once.
+"""
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.core.config import settings
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+class EmbeddingProvider(Embeddings):
+    """An embedding model; ``model`` and ``dimension`` are recorded with every index built with it."""
+
+    model: str = ""
+    dimension: int = 0
+
+
+class GeminiEmbeddingProvider(EmbeddingProvider):
+    model = "models/embedding-001"
+    dimension = 768
+
+    def __init__(self):
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+        self._client = GoogleGenerativeAIEmbeddings(model=self.model, google_api_key=settings.GEMINI_API_KEY)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._client.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._client.embed_query(text)
+
+
+class OnnxEmbeddingProvider(EmbeddingProvider):
+    model = "onnx/all-MiniLM-L6-v2"
+    dimension = 384
+
+    def __init__(self):
+        from chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2 import ONNXMiniLM_L6_V2
+
+        self._model = ONNXMiniLM_L6_V2(preferred_providers=["CPUExecutionProvider"])
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        size = settings.EMBEDDING_BATCH_SIZE
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), size):
+            batch = np.asarray(self._model(texts[start:start + size]), dtype=np.float32)
+            vectors.extend(batch.tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    model = "hashing/words+bigrams"
+    dimension = 512
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        rows: List[int] = []
+        hashes: List[int] = []
+        for row, text in enumerate(texts):
+            tokens = _TOKEN_RE.findall(text.lower())
+            for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+                rows.append(row)
+                hashes.append(zlib.crc32(feature.encode("utf-8")))
+
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        if hashes:
+            codes = np.asarray(hashes, dtype=np.uint32)
+            # the top bit picks the sign, so colliding features tend to cancel out
+            signs = np.where(codes >> 31, -1.0, 1.0).astype(np.float32)
+            np.add.at(matrix, (np.asarray(rows), codes % self.dimension), signs)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1.0, norms)
+        return matrix.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+PROVIDERS = {
+    "gemini": GeminiEmbeddingProvider,
+    "local": OnnxEmbeddingProvider,
+    "hashing": HashingEmbeddingProvider,
+}
+
+
+def provider_class(name: str = None) -> type:
+    name = name or settings.EMBEDDING_PROVIDER
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown embedding provider {name!r}; expected one of {', '.join(PROVIDERS)}")
+    return PROVIDERS[name]
+
+
+class CachedEmbeddings(Embeddings):
+    """A provider with an LRU of query embeddings in front of it."""
+
+    def __init__(self, provider: EmbeddingProvider, max_queries: int):
+        self.provider = provider
+        self.max_queries = max_queries
+        self._queries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.provider.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._lock:
+            vector = self._queries.get(text)
+            if vector is not None:
+                self._queries.move_to_end(text)
+                self.hits += 1
+                return vector
+            self.misses += 1
+        vector = self.provider.embed_query(text)
+        with self._lock:
+            self._queries[text] = vector
+            while len(self._queries) > self.max_queries:
+                self._queries.popitem(last=False)
+        return vector
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "model": self.provider.model,
+                "dimension": self.provider.dimension,
+                "cached_queries": len(self._queries),
+                "query_hits": self.hits,
+                "query_misses": self.misses,
+            }
+
+
+def get_embeddings() -> CachedEmbeddings:
+    return CachedEmbeddings(provider_class()(), settings.EMBEDDING_QUERY_CACHE_SIZE)
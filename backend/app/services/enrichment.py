@@ -0,0 +1,237 @@
+import asyncio
+import itertools
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from app.core.bulk_writer import get_bulk_writer
+from app.core.config import settings
+from app.core.mongo import emails_collection
+from app.services.llm_client import CLASSIFIER_VERSION, summarize_text
+from app.services.local_classifier import local_classifier
+from app.services.rag_indexing import index_emails
+from app.services.text_cleaning import email_text
+
+STAGES = ("classify", "summarize", "embed")
+# lower runs first; categories not listed sit in the middle
+CATEGORY_PRIORITY = {"IMPORTANT": 0, "WORK": 1, "PERSONAL": 2, "PROMOTIONS": 6, "NEWSLETTER": 6, "SPAM": 9}
+DEFAULT_PRIORITY = 4
+# spam is classified but neither summarized nor indexed
+SKIP_CATEGORIES = {"SPAM"}
+# emails per embedding batch; indexing cost is dominated by per-request overhead
+EMBED_BATCH_EMAILS = 32
+# times a job whose write failed is queued again before it is left to the on-demand paths
+MAX_ATTEMPTS = 3
+
+
+def _job(user_id: str, email: Dict[str, Any]) -> Dict[str, Any]:
+    """The fields the workers need, so queued jobs don't pin whole email documents."""
+    return {
+        "id": email["id"],
+        "user_id": user_id,
+        "thread_id": email.get("thread_id"),
+        "subject": email.get("subject", ""),
+        "sender": email.get("sender", ""),
+        "date": email.get("date"),
+        "labels": email.get("labels", []),
+        "clean_text": email_text(email),
+    }
+
+
+def _priority(category: Optional[str]) -> int:
+    return CATEGORY_PRIORITY.get(category, DEFAULT_PRIORITY)
+
+
+class EnrichmentPipeline:
+    """Classifies, summarizes and indexes newly synced emails in the background.
+
+    ``submit`` queues each new email for classification; once classified
+    it is queued for a short summary and for RAG indexing, ordered by its
+    category so IMPORTANT and WORK mail is enriched first. Each stage runs
+    on its own fixed pool of workers and writes into the same places as the
+    on-demand endpoints (``classification``, ``summaries.short`` and the
+    Chroma store), so work already done either way is skipped.
+
+    Queues live in memory: pending work is lost on restart and is picked up
+    again by the on-demand paths. A job counts as done once its write has
+    landed; one whose write failed counts as failed and is queued again,
+    up to ``MAX_ATTEMPTS`` times.
+    """
+
+    def __init__(self):
+        self._queues: Dict[str, asyncio.PriorityQueue] = {}
+        self._workers: List[asyncio.Task] = []
+        self._seq = itertools.count()
+        self._stats = {stage: {"queued": 0, "done": 0, "skipped": 0, "failed": 0, "dropped": 0}
+                       for stage in STAGES}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    def start(self):
+        if self._workers or not settings.ENRICHMENT_ENABLED:
+            return
+        self._queues = {stage: asyncio.PriorityQueue(maxsize=settings.ENRICH_MAX_QUEUE) for stage in STAGES}
+        pools = {
+            "classify": (1, self._classify_worker),
+            "summarize": (settings.ENRICH_SUMMARY_WORKERS, self._summary_worker),
+            "embed": (settings.ENRICH_EMBED_WORKERS, self._embed_worker),
+        }
+        for stage, (count, worker) in pools.items():
+            for _ in range(max(1, count)):
+                self._workers.append(asyncio.create_task(worker()))
+
+    async def stop(self):
+        workers, self._workers = self._workers, []
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    def _put(self, stage: str, priority: int, job: Dict[str, Any]):
+        try:
+            self._queues[stage].put_nowait((priority, next(self._seq), job))
+            self._stats[stage]["queued"] += 1
+        except asyncio.QueueFull:
+            self._stats[stage]["dropped"] += 1
+
+    def _retry(self, stage: str, jobs: List[Dict[str, Any]]):
+        """Count jobs whose write failed and queue them again if they have attempts left."""
+        self._stats[stage]["failed"] += len(jobs)
+        for job in jobs:
+            attempts = job.get("attempts", {})
+            if attempts.get(stage, 1) < MAX_ATTEMPTS:
+                self._put(stage, job["priority"], {**job, "attempts": {**attempts, stage: attempts.get(stage, 1) + 1}})
+
+    def submit(self, user_id: str, emails: List[Dict[str, Any]]) -> int:
+        """Queue freshly stored emails for enrichment; returns how many were queued."""
+        if not self.running:
+            return 0
+        before = self._stats["classify"]["queued"]
+        for email in emails:
+            # Gmail's own IMPORTANT label is the only signal before classification
+            priority = 0 if "IMPORTANT" in email.get("labels", []) else 1
+            self._put("classify", priority, {**_job(user_id, email), "priority": priority})
+        return self._stats["classify"]["queued"] - before
+
+    async def _take(self, stage: str, limit: int) -> List[Tuple[int, int, Dict[str, Any]]]:
+        queue = self._queues[stage]
+        items = [await queue.get()]
+        while len(items) < limit:
+            try:
+                items.append(queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return items
+
+    async def _worker(self, stage: str, limit: int, handle):
+        queue = self._queues[stage]
+        while True:
+            items = await self._take(stage, limit)
+            try:
+                await handle([job for _, _, job in items])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats[stage]["failed"] += len(items)
+                print(f"⚠️ Enrichment {stage} failed for {len(items)} emails: {e}")
+            finally:
+                for _ in items:
+                    queue.task_done()
+
+    async def _classify_worker(self):
+        await self._worker("classify", settings.CLASSIFY_BATCH_SIZE, self._classify)
+
+    async def _summary_worker(self):
+        await self._worker("summarize", 1, self._summarize)
+
+    async def _embed_worker(self):
+        await self._worker("embed", EMBED_BATCH_EMAILS, self._embed)
+
+    async def _classify(self, jobs: List[Dict[str, Any]]):
+        cursor = emails_collection.find(
+            {"id": {"$in": [j["id"] for j in jobs]}},
+            projection={"id": 1, "user_id": 1, "classification": 1, "classification_version": 1,
+                        "summaries.short": 1, "rag_hash": 1},
+        )
+        state = {(d["user_id"], d["id"]): d async for d in cursor}
+        # emails deleted again before their turn
+        jobs = [j for j in jobs if (j["user_id"], j["id"]) in state]
+
+        pending = [j for j in jobs if state[(j["user_id"], j["id"])].get("classification_version") != CLASSIFIER_VERSION]
+        categories = {(j["user_id"], j["id"]): state[(j["user_id"], j["id"])].get("classification") for j in jobs}
+        stats = self._stats["classify"]
+        stats["skipped"] += len(jobs) - len(pending)
+
+        failed = []
+        if pending:
+            writer = get_bulk_writer(emails_collection)
+            writes = []
+            for job, (category, source) in zip(pending, await local_classifier.classify(pending)):
+                writes.append(await writer.add(UpdateOne(
+                    {"id": job["id"], "user_id": job["user_id"]},
+                    {"$set": {"classification": category,
+                              "classification_version": CLASSIFIER_VERSION,
+                              "classification_source": source}}
+                )))
+                categories[(job["user_id"], job["id"])] = category
+            await writer.flush()
+            errors = await asyncio.gather(*writes)
+            failed = [job for job, error in zip(pending, errors) if error]
+            stats["done"] += len(pending) - len(failed)
+            # classified again on retry, which queues the later stages then
+            self._retry("classify", failed)
+
+        unwritten = {(j["user_id"], j["id"]) for j in failed}
+        for job in jobs:
+            key = (job["user_id"], job["id"])
+            if key in unwritten:
+                continue
+            category = categories[key]
+            if category in SKIP_CATEGORIES or not job["clean_text"]:
+                continue
+            doc = state[key]
+            priority = _priority(category)
+            job = {**job, "priority": priority}
+            if not (doc.get("summaries") or {}).get("short"):
+                self._put("summarize", priority, job)
+            if not doc.get("rag_hash"):
+                self._put("embed", priority, job)
+
+    async def _summarize(self, jobs: List[Dict[str, Any]]):
+        writer = get_bulk_writer(emails_collection)
+        for job in jobs:
+            # a retried job keeps the summary whose write failed rather than generating another
+            summary = job.get("summary") or await summarize_text(job["clean_text"], "short")
+            written = await writer.add(UpdateOne(
+                {"id": job["id"], "user_id": job["user_id"]},
+                {"$set": {"summaries.short": summary}}
+            ))
+            await writer.flush()
+            if await written:
+                self._retry("summarize", [{**job, "summary": summary}])
+            else:
+                self._stats["summarize"]["done"] += 1
+
+    async def _embed(self, jobs: List[Dict[str, Any]]):
+        by_user: Dict[str, List[Dict[str, Any]]] = {}
+        for job in jobs:
+            by_user.setdefault(job["user_id"], []).append(job)
+        writer = get_bulk_writer(emails_collection)
+        for user_id, emails in by_user.items():
+            counts = await index_emails(user_id, emails, writer)
+            self._stats["embed"]["done"] += counts["indexed"]
+            self._stats["embed"]["skipped"] += counts["skipped"]
+            failed = set(counts["failed_ids"])
+            self._retry("embed", [job for job in emails if job["id"] in failed])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "workers": len(self._workers),
+            "backlog": {stage: q.qsize() for stage, q in self._queues.items()},
+            "stages": self._stats,
+        }
+
+
+enrichment_pipeline = EnrichmentPipeline()
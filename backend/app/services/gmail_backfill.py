@@ -0,0 +1,208 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.core.config import settings
+from app.core.mongo import users_collection, sync_jobs_collection
+from app.services.google_credentials import credential_manager
+from app.services.gmail_sync import (
+    get_history_id,
+    list_message_ids,
+    fetch_messages,
+    store_messages,
+    queue_retry_ids,
+    retryable_ids,
+    save_history_checkpoint,
+)
+
+JOB_TYPE = "backfill"
+
+# backfill tasks owned by this process, keyed by user_id
+_running: Dict[str, asyncio.Task] = {}
+
+
+def _public(job: Optional[Dict]) -> Optional[Dict]:
+    if not job:
+        return None
+    job = dict(job)
+    job.pop("_id", None)
+    job["active"] = job["user_id"] in _running and not _running[job["user_id"]].done()
+    return job
+
+
+async def _update_job(user_id: str, fields: Dict):
+    fields["updated_at"] = datetime.utcnow()
+    await sync_jobs_collection.update_one(
+        {"user_id": user_id, "type": JOB_TYPE},
+        {"$set": fields}
+    )
+
+
+def _lease_expiry() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=settings.GMAIL_BACKFILL_LEASE_SECONDS)
+
+
+async def get_backfill_status(user_id: str) -> Optional[Dict]:
+    job = await sync_jobs_collection.find_one({"user_id": user_id, "type": JOB_TYPE})
+    return _public(job)
+
+
+async def start_backfill(user_id: str, restart: bool = False) -> Dict:
+    """Start, or resume from its saved page cursor, the full-mailbox backfill for ``user_id``.
+
+    The job's lease is taken with one atomic update, so only one process
+    runs a given job even when several try at once; a live lease held by
+    another process is respected even with ``restart``.
+    """
+    task = _running.get(user_id)
+    if task and not task.done():
+        return await get_backfill_status(user_id)
+
+    now = datetime.utcnow()
+    fresh = {
+        "page_token": None,
+        "history_id": None,
+        "pages": 0,
+        "fetched": 0,
+        "failed": 0,
+        "retry_ids": [],
+        "elapsed_seconds": 0.0,
+        "messages_per_second": 0.0,
+        "started_at": now,
+        "completed_at": None,
+    }
+    claim = {"status": "running", "error": None, "updated_at": now, "lease_until": _lease_expiry()}
+    query = {
+        "user_id": user_id,
+        "type": JOB_TYPE,
+        "$or": [{"status": {"$ne": "running"}}, {"lease_until": None}, {"lease_until": {"$lte": now}}],
+    }
+    if restart:
+        update = {"$set": {**fresh, **claim}}
+    else:
+        query["status"] = {"$ne": "completed"}
+        update = {"$set": claim, "$setOnInsert": fresh}
+
+    try:
+        job = await sync_jobs_collection.find_one_and_update(
+            query, update, upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # the job exists but is completed or leased by another worker process
+        job = None
+    if job is None:
+        return await get_backfill_status(user_id)
+
+    _running[user_id] = asyncio.create_task(_run_backfill(user_id))
+    return _public(job)
+
+
+async def _run_backfill(user_id: str):
+    job = await sync_jobs_collection.find_one({"user_id": user_id, "type": JOB_TYPE})
+    page_token = job.get("page_token")
+    fetched = job.get("fetched", 0)
+    failed = job.get("failed", 0)
+    # messages whose download failed with a transient error, fetched again before completing
+    retry_ids = list(job.get("retry_ids", []))
+    pages = job.get("pages", 0)
+    prior_elapsed = job.get("elapsed_seconds", 0.0)
+
+    run_started = time.monotonic()
+    run_fetched = 0
+
+    try:
+        service, creds = await credential_manager.get_client(user_id, "gmail", "v1")
+
+        history_id = job.get("history_id")
+        if not history_id:
+            # anything that changes after this point is picked up by delta sync
+            history_id = await get_history_id(service, creds)
+            await _update_job(user_id, {"history_id": history_id})
+
+        while True:
+            message_ids, next_page_token = await list_message_ids(
+                service,
+                creds,
+                max_results=settings.GMAIL_BACKFILL_PAGE_SIZE,
+                page_token=page_token,
+            )
+            messages, errors = await fetch_messages(service, creds, message_ids, fmt="full")
+            stored = await store_messages(user_id, messages)
+
+            pages += 1
+            fetched += len(stored)
+            run_fetched += len(stored)
+            failed += len(errors)
+            retry_ids += retryable_ids(errors)
+            page_token = next_page_token
+
+            run_elapsed = time.monotonic() - run_started
+            fields = {
+                "page_token": page_token,
+                "pages": pages,
+                "fetched": fetched,
+                "failed": failed,
+                "retry_ids": retry_ids,
+                "elapsed_seconds": round(prior_elapsed + run_elapsed, 2),
+                "messages_per_second": round(run_fetched / run_elapsed, 2) if run_elapsed else 0.0,
+                "lease_until": _lease_expiry(),
+            }
+            await _update_job(user_id, fields)
+            if not page_token:
+                break
+
+        if retry_ids:
+            messages, errors = await fetch_messages(service, creds, retry_ids, fmt="full")
+            stored = await store_messages(user_id, messages)
+            fetched += len(stored)
+            failed -= len(retry_ids) - len(errors)
+            retry_ids = retryable_ids(errors)
+            # still failing: delta sync keeps trying them, so the mailbox has no silent gaps
+            await queue_retry_ids(user_id, retry_ids)
+        await _update_job(user_id, {"fetched": fetched, "failed": failed, "retry_ids": [],
+                                    "handed_to_sync": len(retry_ids),
+                                    "status": "completed", "completed_at": datetime.utcnow()})
+
+        user_doc = await users_collection.find_one({"id": user_id}, projection={"gmail_history_id": 1})
+        if user_doc and not user_doc.get("gmail_history_id"):
+            await save_history_checkpoint(user_id, history_id)
+
+        print(f"Backfill for user {user_id} completed: {fetched} messages in {pages} pages")
+
+    except asyncio.CancelledError:
+        await _update_job(user_id, {"status": "interrupted", "lease_until": None})
+        raise
+    except Exception as e:
+        print(f"Backfill for user {user_id} failed: {e}")
+        await _update_job(user_id, {"status": "failed", "error": str(e), "lease_until": None})
+    finally:
+        _running.pop(user_id, None)
+
+
+async def resume_backfills():
+    """Restart jobs left running by a crashed or redeployed process.
+
+    Several processes may find the same job here; ``start_backfill`` claims
+    its lease atomically, so only one of them resumes it.
+    """
+    now = datetime.utcnow()
+    cursor = sync_jobs_collection.find({
+        "type": JOB_TYPE,
+        "status": {"$in": ["running", "interrupted"]},
+        "$or": [{"lease_until": None}, {"lease_until": {"$lte": now}}],
+    })
+    async for job in cursor:
+        print(f"Resuming backfill for user {job['user_id']} from page {job.get('pages', 0)}")
+        await start_backfill(job["user_id"])
+
+
+async def stop_backfills():
+    """Cancel this process's backfills; their cursors stay saved for the next start."""
+    tasks = list(_running.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,384 @@
+import asyncio
+import base64
+import http.client
+import socket
+import ssl
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import httplib2
+from googleapiclient.errors import HttpError
+from pymongo import UpdateOne
+
+from app.core.bulk_writer import BulkWriter
+from app.core.config import settings
+from app.core.mongo import emails_collection, users_collection
+from app.services.google_credentials import authorized_http
+from app.services.text_cleaning import clean_fields
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# dropped connections, timeouts and TLS failures; anything else is a bug
+TRANSPORT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    socket.timeout,
+    socket.gaierror,
+    ssl.SSLError,
+    http.client.HTTPException,
+    httplib2.HttpLib2Error,
+)
+HISTORY_TYPES = ["messageAdded", "messageDeleted", "labelAdded", "labelRemoved"]
+
+
+# ---------------------- Parsing ---------------------- #
+
+def decode_base64_data(data: str) -> str:
+    try:
+        decoded_bytes = base64.urlsafe_b64decode(data + '=' * (4 - len(data) % 4))
+        return decoded_bytes.decode('utf-8', errors='ignore')
+    except Exception as e:
+        print(f"Error decoding base64 data: {e}")
+        return ""
+
+def extract_body_from_parts(parts: List[Dict]) -> Dict[str, str]:
+    plain_text = ""
+    html_content = ""
+
+    for part in parts:
+        mime_type = part.get('mimeType', '')
+
+        if 'parts' in part:
+            nested_result = extract_body_from_parts(part['parts'])
+            if not plain_text and nested_result['plain']:
+                plain_text = nested_result['plain']
+            if not html_content and nested_result['html']:
+                html_content = nested_result['html']
+
+        elif 'body' in part and 'data' in part['body']:
+            content = decode_base64_data(part['body']['data'])
+
+            if mime_type == 'text/plain' and not plain_text:
+                plain_text = content
+            elif mime_type == 'text/html' and not html_content:
+                html_content = content
+
+    return {'plain': plain_text, 'html': html_content}
+
+def extract_body_from_payload(payload: Dict) -> Dict[str, str]:
+    mime_type = payload.get('mimeType', '')
+
+    if 'body' in payload and 'data' in payload['body']:
+        content = decode_base64_data(payload['body']['data'])
+        if mime_type == 'text/plain':
+            return {'plain': content, 'html': ''}
+        elif mime_type == 'text/html':
+            return {'plain': '', 'html': content}
+
+    if 'parts' in payload:
+        return extract_body_from_parts(payload['parts'])
+
+    return {'plain': '', 'html': ''}
+
+def parse_email(msg_data: Dict) -> Dict:
+    payload = msg_data.get("payload", {})
+    headers = payload.get("headers", [])
+
+    subject = next((h["value"] for h in headers if h["name"] == "Subject"), "")
+    sender = next((h["value"] for h in headers if h["name"] == "From"), "")
+    to = [h["value"] for h in headers if h["name"] == "To"]
+
+    date_str = next((h["value"] for h in headers if h["name"] == "Date"), "")
+    try:
+        date = datetime.strptime(date_str.split(' (')[0], "%a, %d %b %Y %H:%M:%S %z")
+    except Exception as e:
+        print(f"Error parsing date '{date_str}': {e}")
+        date = datetime.utcnow()
+
+    body_data = extract_body_from_payload(payload)
+
+    body = body_data['plain'] or body_data['html'] or msg_data.get("snippet", "")
+
+    return {
+        "id": msg_data["id"],
+        "thread_id": msg_data["threadId"],
+        "subject": subject,
+        "sender": sender,
+        "recipients": to,
+        "snippet": msg_data.get("snippet", ""),
+        "body": body,
+        "plain_body": body_data['plain'],
+        "html_body": body_data['html'],
+        "date": date,
+        "labels": msg_data.get("labelIds", []),
+        "size_estimate": msg_data.get("sizeEstimate", 0),
+        **clean_fields(body_data['plain'], body_data['html'], msg_data.get("snippet", "")),
+    }
+
+# ---------------------- Fetching ---------------------- #
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUSES
+    return isinstance(error, TRANSPORT_ERRORS)
+
+def _execute_batch(service, creds, message_ids: List[str], fmt: str) -> Tuple[Dict[str, Dict], Dict[str, Exception]]:
+    """Fetch up to one Gmail batch of messages in a single HTTP round-trip."""
+    results: Dict[str, Dict] = {}
+    errors: Dict[str, Exception] = {}
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            errors[request_id] = exception
+        else:
+            results[request_id] = response
+
+    batch = service.new_batch_http_request(callback=callback)
+    for message_id in message_ids:
+        batch.add(
+            service.users().messages().get(userId="me", id=message_id, format=fmt),
+            request_id=message_id,
+        )
+    batch.execute(http=authorized_http(creds))
+    return results, errors
+
+async def list_message_ids(
+    service,
+    creds,
+    max_results: int = 20,
+    page_token: Optional[str] = None,
+    query: Optional[str] = None,
+) -> Tuple[List[str], Optional[str]]:
+    """List one page of message IDs without blocking the event loop."""
+    params = {"userId": "me", "maxResults": max_results}
+    if page_token:
+        params["pageToken"] = page_token
+    if query:
+        params["q"] = query
+
+    results = await asyncio.to_thread(
+        lambda: service.users().messages().list(**params).execute(http=authorized_http(creds))
+    )
+    ids = [m["id"] for m in results.get("messages", [])]
+    return ids, results.get("nextPageToken")
+
+async def fetch_messages(
+    service,
+    creds,
+    message_ids: List[str],
+    fmt: str = "full",
+    batch_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+) -> Tuple[List[Dict], Dict[str, Exception]]:
+    """Download messages using Gmail batch requests.
+
+    IDs are split into batches of ``batch_size`` and at most ``concurrency``
+    batches are in flight at once, each on a worker thread. Items that fail
+    with a rate-limit or server error are retried with backoff. Returns the
+    fetched messages in the order of ``message_ids`` and a map of the IDs
+    that could not be fetched to their last error.
+    """
+    batch_size = max(1, min(batch_size or settings.GMAIL_FETCH_BATCH_SIZE, 100))
+    semaphore = asyncio.Semaphore(concurrency or settings.GMAIL_FETCH_CONCURRENCY)
+    fetched: Dict[str, Dict] = {}
+    failed: Dict[str, Exception] = {}
+
+    async def run_batch(ids: List[str]):
+        pending = ids
+        for attempt in range(settings.GMAIL_FETCH_MAX_RETRIES + 1):
+            async with semaphore:
+                try:
+                    results, errors = await asyncio.to_thread(
+                        _execute_batch, service, creds, pending, fmt
+                    )
+                except Exception as e:
+                    results, errors = {}, {message_id: e for message_id in pending}
+
+            fetched.update(results)
+            pending = []
+            for message_id, error in errors.items():
+                if _is_retryable(error) and attempt < settings.GMAIL_FETCH_MAX_RETRIES:
+                    pending.append(message_id)
+                else:
+                    failed[message_id] = error
+
+            if not pending:
+                return
+            await asyncio.sleep(0.5 * 2 ** attempt)
+
+    await asyncio.gather(*(
+        run_batch(message_ids[i:i + batch_size])
+        for i in range(0, len(message_ids), batch_size)
+    ))
+
+    for message_id, error in failed.items():
+        print(f"Error fetching message {message_id}: {error}")
+
+    return [fetched[m] for m in message_ids if m in fetched], failed
+
+# ---------------------- Sync ---------------------- #
+
+async def get_history_id(service, creds) -> str:
+    """Current mailbox historyId, used as the checkpoint for the next delta sync."""
+    profile = await asyncio.to_thread(
+        lambda: service.users().getProfile(userId="me").execute(http=authorized_http(creds))
+    )
+    return profile["historyId"]
+
+async def list_history(service, creds, start_history_id: str) -> Tuple[Dict, str]:
+    """Collapse every history record since ``start_history_id`` into per-message changes.
+
+    Returns ``({"added": [...], "deleted": [...], "labels": {id: labelIds}}, latest_history_id)``.
+    Raises ``HttpError`` 404 when the checkpoint is too old for Gmail to serve.
+    """
+    added: Dict[str, None] = {}
+    deleted = set()
+    labels: Dict[str, List[str]] = {}
+    latest = start_history_id
+    page_token = None
+
+    while True:
+        params = {
+            "userId": "me",
+            "startHistoryId": start_history_id,
+            "historyTypes": HISTORY_TYPES,
+        }
+        if page_token:
+            params["pageToken"] = page_token
+        response = await asyncio.to_thread(
+            lambda: service.users().history().list(**params).execute(http=authorized_http(creds))
+        )
+
+        for record in response.get("history", []):
+            for item in record.get("messagesAdded", []):
+                message_id = item["message"]["id"]
+                added[message_id] = None
+                deleted.discard(message_id)
+            for item in record.get("messagesDeleted", []):
+                message_id = item["message"]["id"]
+                deleted.add(message_id)
+                added.pop(message_id, None)
+                labels.pop(message_id, None)
+            for item in record.get("labelsAdded", []) + record.get("labelsRemoved", []):
+                message = item["message"]
+                if message["id"] not in deleted:
+                    labels[message["id"]] = message.get("labelIds", [])
+
+        latest = response.get("historyId", latest)
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            break
+
+    # new messages are downloaded in full, so their labels come with them
+    for message_id in added:
+        labels.pop(message_id, None)
+
+    return {"added": list(added), "deleted": list(deleted), "labels": labels}, latest
+
+async def store_messages(user_id: str, messages: List[Dict]) -> List[Dict]:
+    """Parse raw Gmail messages and bulk-upsert them for ``user_id``."""
+    pending = []
+    async with BulkWriter(emails_collection) as writer:
+        for msg_data in messages:
+            try:
+                email_doc = parse_email(msg_data)
+                email_doc["user_id"] = user_id
+            except Exception as e:
+                print(f"Error processing message {msg_data.get('id')}: {e}")
+                continue
+
+            written = await writer.add(UpdateOne(
+                {"id": email_doc["id"], "user_id": user_id},
+                {"$set": email_doc},
+                upsert=True,
+            ))
+            pending.append((email_doc, written))
+
+    stored_emails = []
+    for email_doc, written in pending:
+        error = written.result()
+        if error:
+            print(f"Error storing message {email_doc['id']}: {error['message']}")
+            continue
+        stored_emails.append(email_doc)
+    return stored_emails
+
+def retryable_ids(failed: Dict[str, Exception]) -> List[str]:
+    """IDs worth fetching again next sync; a message that is gone (404) is not."""
+    return [message_id for message_id, error in failed.items() if _is_retryable(error)]
+
+async def queue_retry_ids(user_id: str, message_ids: List[str]):
+    """Hand messages that failed to download to the next delta sync, which fetches them first."""
+    if message_ids:
+        await users_collection.update_one(
+            {"id": user_id}, {"$addToSet": {"gmail_retry_ids": {"$each": message_ids}}}
+        )
+
+async def save_history_checkpoint(user_id: str, history_id: str, retry_ids: Optional[List[str]] = None):
+    """Advance the checkpoint. ``retry_ids`` replaces the messages still to be
+    downloaded: history before the checkpoint is never listed again, so they
+    are carried over to the next sync instead."""
+    fields = {"gmail_history_id": str(history_id), "gmail_synced_at": datetime.utcnow()}
+    if retry_ids is not None:
+        fields["gmail_retry_ids"] = retry_ids
+    await users_collection.update_one({"id": user_id}, {"$set": fields})
+
+async def full_sync(service, creds, user_id: str, max_results: int = 20) -> Dict:
+    """Download the latest ``max_results`` messages and reset the history checkpoint."""
+    # read the checkpoint first so changes made while we list are replayed next time
+    history_id = await get_history_id(service, creds)
+    message_ids, _ = await list_message_ids(service, creds, max_results=max_results)
+    messages, failed = await fetch_messages(service, creds, message_ids, fmt="full")
+    stored_emails = await store_messages(user_id, messages)
+    await save_history_checkpoint(user_id, history_id, retryable_ids(failed))
+    return {"mode": "full", "emails": stored_emails, "deleted": 0, "relabeled": 0}
+
+async def incremental_sync(service, creds, user_id: str, start_history_id: str) -> Dict:
+    """Apply only the changes recorded since ``start_history_id``.
+
+    New messages are downloaded in full, deletions are removed locally and
+    label-only changes are written without fetching the message again.
+    Messages that failed to download last time are fetched again first;
+    ones failing now are kept for the next sync.
+    """
+    changes, latest = await list_history(service, creds, start_history_id)
+
+    user_doc = await users_collection.find_one({"id": user_id}, projection={"gmail_retry_ids": 1}) or {}
+    gone = set(changes["deleted"])
+    retry = [m for m in user_doc.get("gmail_retry_ids", []) if m not in gone]
+    to_fetch = list(dict.fromkeys(retry + changes["added"]))
+
+    messages, failed = await fetch_messages(service, creds, to_fetch, fmt="full")
+    stored_emails = await store_messages(user_id, messages)
+
+    deleted = 0
+    if changes["deleted"]:
+        result = await emails_collection.delete_many(
+            {"user_id": user_id, "id": {"$in": changes["deleted"]}}
+        )
+        deleted = result.deleted_count
+
+    async with BulkWriter(emails_collection) as writer:
+        for message_id, label_ids in changes["labels"].items():
+            await writer.add(UpdateOne(
+                {"id": message_id, "user_id": user_id},
+                {"$set": {"labels": label_ids}}
+            ))
+
+    await save_history_checkpoint(user_id, latest, retryable_ids(failed))
+    return {
+        "mode": "incremental",
+        "emails": stored_emails,
+        "deleted": deleted,
+        "relabeled": len(changes["labels"]),
+    }
+
+async def sync_mailbox(service, creds, user_id: str, history_id: Optional[str] = None, full: bool = False) -> Dict:
+    """Delta-sync from the stored checkpoint, falling back to a full sync when there is none."""
+    if history_id and not full:
+        try:
+            return await incremental_sync(service, creds, user_id, history_id)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            print(f"History checkpoint {history_id} expired for user {user_id}, running full sync")
+    return await full_sync(service, creds, user_id)
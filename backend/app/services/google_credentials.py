@@ -0,0 +1,133 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+import google_auth_httplib2
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+from googleapiclient.http import build_http
+
+from app.core.config import settings
+from app.core.mongo import users_collection
+
+SCOPES = settings.GMAILSCOPES
+
+
+class GoogleAuthError(Exception):
+    """The user has no usable Google credentials."""
+
+
+def authorized_http(creds: Credentials):
+    """A fresh authorized http object for one call.
+
+    Cached service objects are shared between requests and worker threads,
+    but httplib2 connections are not thread-safe, so every ``execute`` gets
+    its own transport: ``request.execute(http=authorized_http(creds))``.
+    """
+    return google_auth_httplib2.AuthorizedHttp(creds, http=build_http())
+
+
+class CredentialManager:
+    """Per-user cache of Google credentials and the API clients built from them.
+
+    Tokens close to expiry are refreshed in the background while the
+    current one is still served; expired tokens are refreshed inline.
+    Concurrent refreshes for one user share a single task. Users idle for
+    longer than ``idle_ttl`` are evicted.
+    """
+
+    def __init__(self, refresh_margin: Optional[int] = None, idle_ttl: Optional[int] = None):
+        self.refresh_margin = timedelta(seconds=refresh_margin or settings.GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS)
+        self.idle_ttl = idle_ttl or settings.GOOGLE_CLIENT_IDLE_TTL_SECONDS
+        self._creds: Dict[str, Credentials] = {}
+        self._services: Dict[Tuple[str, str, str], object] = {}
+        self._last_used: Dict[str, float] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._last_sweep = time.monotonic()
+
+    async def get_credentials(self, user_id: str) -> Credentials:
+        self._evict_idle()
+        creds = self._creds.get(user_id)
+        if creds is None:
+            creds = self._creds.setdefault(user_id, await self._load(user_id))
+        self._last_used[user_id] = time.monotonic()
+
+        if not creds.valid:
+            if not creds.refresh_token:
+                self.invalidate(user_id)
+                raise GoogleAuthError("Google credentials expired. Please re-authenticate.")
+            await asyncio.shield(self._refresh(user_id, creds))
+        elif creds.expiry and creds.refresh_token and creds.expiry - datetime.utcnow() < self.refresh_margin:
+            # still valid: serve it and refresh off the request path
+            self._refresh(user_id, creds)
+        return creds
+
+    async def get_client(self, user_id: str, api: str, version: str):
+        """Return ``(service, creds)`` for ``api``/``version``, building the service once per user."""
+        creds = await self.get_credentials(user_id)
+        key = (user_id, api, version)
+        service = self._services.get(key)
+        if service is None:
+            # refreshes update ``creds`` in place, so the service never needs rebuilding
+            service = await asyncio.to_thread(
+                build, api, version, credentials=creds, cache_discovery=False
+            )
+            service = self._services.setdefault(key, service)
+        return service, creds
+
+    def invalidate(self, user_id: str):
+        self._creds.pop(user_id, None)
+        self._last_used.pop(user_id, None)
+        for key in [k for k in self._services if k[0] == user_id]:
+            del self._services[key]
+
+    async def _load(self, user_id: str) -> Credentials:
+        user_doc = await users_collection.find_one(
+            {"id": user_id}, projection={"google_credentials": 1}
+        )
+        if not user_doc or "google_credentials" not in user_doc:
+            raise GoogleAuthError("User not authenticated with Google")
+        return Credentials.from_authorized_user_info(
+            json.loads(user_doc["google_credentials"]), SCOPES
+        )
+
+    def _refresh(self, user_id: str, creds: Credentials) -> asyncio.Task:
+        task = self._refreshing.get(user_id)
+        if task is None:
+            task = asyncio.create_task(self._do_refresh(user_id, creds))
+            self._refreshing[user_id] = task
+            task.add_done_callback(lambda t: self._refresh_done(user_id, t))
+        return task
+
+    def _refresh_done(self, user_id: str, task: asyncio.Task):
+        self._refreshing.pop(user_id, None)
+        if not task.cancelled() and task.exception():
+            print(f"Token refresh for user {user_id} failed: {task.exception()}")
+
+    async def _do_refresh(self, user_id: str, creds: Credentials):
+        try:
+            await asyncio.to_thread(creds.refresh, Request())
+        except Exception as e:
+            self.invalidate(user_id)
+            raise GoogleAuthError(f"Failed to refresh token: {e}")
+
+        await users_collection.update_one(
+            {"id": user_id},
+            {"$set": {"google_credentials": creds.to_json(),
+                      "updated_at": datetime.utcnow()}}
+        )
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        for user_id, last_used in list(self._last_used.items()):
+            if now - last_used > self.idle_ttl and user_id not in self._refreshing:
+                self.invalidate(user_id)
+
+
+credential_manager = CredentialManager()
@@ -0,0 +1,154 @@
+import heapq
+import math
+import re
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from app.core.config import settings
+from app.core.mongo import emails_collection
+from app.core.single_flight import SingleFlight
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have i in is it its of on or re fw fwd "
+    "that the this to was were will with you your".split()
+)
+# subject and sender matches count this many times a body match
+FIELD_WEIGHT = 2
+K1 = 1.2
+B = 0.75
+# email fields kept in memory so lexical hits need no lookup to be displayed
+META_FIELDS = ("thread_id", "subject", "sender", "date")
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if t not in STOPWORDS]
+
+
+def lexical_terms(e: Dict[str, Any], text: str) -> Tuple[Dict[str, int], int]:
+    """Term frequencies and length of an email, as stored in ``lex_terms``/``lex_len``."""
+    tokens = tokenize(text)[:settings.LEXICAL_MAX_BODY_TOKENS]
+    fields = tokenize(e.get("subject", "")) + tokenize(e.get("sender", ""))
+    terms = Counter(tokens)
+    for t in fields:
+        terms[t] += FIELD_WEIGHT
+    return dict(terms), len(tokens) + FIELD_WEIGHT * len(fields)
+
+
+class UserIndex:
+    """In-memory BM25 inverted index over one user's emails."""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_terms: Dict[str, Tuple[str, ...]] = {}
+        self.lengths: Dict[str, int] = {}
+        self.meta: Dict[str, Dict[str, Any]] = {}
+        self.total_length = 0
+
+    def remove(self, email_id: str):
+        length = self.lengths.pop(email_id, None)
+        if length is None:
+            return
+        self.total_length -= length
+        self.meta.pop(email_id, None)
+        for term in self.doc_terms.pop(email_id):
+            docs = self.postings[term]
+            del docs[email_id]
+            if not docs:
+                del self.postings[term]
+
+    def add(self, email_id: str, terms: Dict[str, int], length: int, meta: Dict[str, Any]):
+        if email_id in self.lengths:
+            self.remove(email_id)
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[email_id] = tf
+        self.doc_terms[email_id] = tuple(terms)
+        self.lengths[email_id] = length
+        self.meta[email_id] = meta
+        self.total_length += length
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """The ``k`` best ``(email_id, score)`` pairs by BM25."""
+        n = len(self.lengths)
+        if not n:
+            return []
+        avg_length = self.total_length / n or 1
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for email_id, tf in docs.items():
+                norm = K1 * (1 - B + B * self.lengths[email_id] / avg_length)
+                scores[email_id] = scores.get(email_id, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+class LexicalIndexes:
+    """Per-user BM25 indexes, loaded from Mongo on first use and kept in an LRU.
+
+    The terms of each email are computed once at RAG index time and stored
+    on the email (``lex_terms``, ``lex_len``); loading a user's index is a
+    single projection scan and later index runs patch loaded indexes in
+    place. At most ``LEXICAL_MAX_USERS`` indexes stay in memory.
+    """
+
+    def __init__(self):
+        self._indexes: "OrderedDict[str, UserIndex]" = OrderedDict()
+        self._loads = SingleFlight()
+        # entries applied while the user's index is loading; the scan may have missed them
+        self._buffered: Dict[str, List[Tuple[Dict[str, Any], Dict[str, int], int]]] = {}
+
+    async def _load(self, user_id: str) -> UserIndex:
+        index = UserIndex()
+        self._buffered[user_id] = []
+        try:
+            cursor = emails_collection.find(
+                {"user_id": user_id, "lex_len": {"$exists": True}},
+                projection={"id": 1, "lex_terms": 1, "lex_len": 1, **{f: 1 for f in META_FIELDS}},
+            )
+            async for e in cursor:
+                index.add(e["id"], e["lex_terms"], e["lex_len"], {f: e.get(f) for f in META_FIELDS})
+        finally:
+            buffered = self._buffered.pop(user_id)
+        # replayed after the scan, so they win over the older stored terms
+        for e, terms, length in buffered:
+            index.add(e["id"], terms, length, {f: e.get(f) for f in META_FIELDS})
+        self._indexes[user_id] = index
+        while len(self._indexes) > settings.LEXICAL_MAX_USERS:
+            self._indexes.popitem(last=False)
+        return index
+
+    async def get(self, user_id: str) -> UserIndex:
+        index = self._indexes.get(user_id)
+        if index is not None:
+            self._indexes.move_to_end(user_id)
+            return index
+        return await self._loads.do(user_id, lambda: self._load(user_id), group="lexical_load")
+
+    def apply(self, user_id: str, entries: List[Tuple[Dict[str, Any], Dict[str, int], int]]):
+        """Patch a loaded index with ``(email, terms, length)`` entries; unloaded
+        users pick the stored terms up when they are next loaded."""
+        if user_id in self._buffered:
+            self._buffered[user_id].extend(entries)
+            return
+        index = self._indexes.get(user_id)
+        if index is None:
+            return
+        for e, terms, length in entries:
+            index.add(e["id"], terms, length, {f: e.get(f) for f in META_FIELDS})
+
+    async def search(self, user_id: str, query: str, k: int) -> List[Tuple[str, float, Dict[str, Any]]]:
+        index = await self.get(user_id)
+        return [(email_id, score, index.meta[email_id]) for email_id, score in index.search(query, k)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded_users": len(self._indexes),
+            "documents": sum(len(i.lengths) for i in self._indexes.values()),
+            "terms": sum(len(i.postings) for i in self._indexes.values()),
+        }
+
+
+lexical_indexes = LexicalIndexes()
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import re
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from pymongo import UpdateOne
+
+from app.core.bulk_writer import get_bulk_writer
+from app.core.config import settings
+from app.core.mongo import llm_cache_collection
+from app.core.single_flight import SingleFlight
+
+
+def normalize(value: Any) -> Any:
+    """Canonical form of a cache input: whitespace-collapsed strings, sorted dict keys."""
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip()
+    if isinstance(value, dict):
+        return {k: normalize(value[k]) for k in sorted(value)}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    return value
+
+
+def make_key(model: str, task: str, payload: Any, version: int) -> str:
+    raw = json.dumps(
+        {"model": model, "task": task, "input": normalize(payload), "version": version},
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Two-tier cache for model outputs: an in-process LRU in front of a Mongo collection.
+
+    Entries are keyed by a hash of (model, task, normalized input, prompt
+    version), so bumping a prompt's version orphans its old entries, which
+    the collection's TTL index then removes. Misses for the same key that
+    overlap in time share one model call. A Mongo error is logged and
+    treated as a miss (or an unsaved entry), so a cache outage never fails
+    the model call.
+    """
+
+    def __init__(self, collection, max_entries: Optional[int] = None, ttl_seconds: Optional[int] = None):
+        self.collection = collection
+        self.max_entries = max_entries or settings.LLM_CACHE_MAX_ENTRIES
+        self.ttl_seconds = ttl_seconds or settings.LLM_CACHE_TTL_SECONDS
+        self._lru: "OrderedDict[str, tuple]" = OrderedDict()
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._flights = SingleFlight()
+        self.store_errors = 0
+
+    def _count(self, task: str, field: str):
+        stats = self._stats.setdefault(
+            task, {"memory_hits": 0, "persistent_hits": 0, "misses": 0}
+        )
+        stats[field] += 1
+
+    def _remember(self, key: str, value: Any, expires_at: datetime):
+        self._lru[key] = (value, expires_at)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    async def get(self, key: str, task: str) -> Optional[Any]:
+        now = datetime.utcnow()
+        entry = self._lru.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at > now:
+                self._lru.move_to_end(key)
+                self._count(task, "memory_hits")
+                return value
+            del self._lru[key]
+
+        try:
+            doc = await self.collection.find_one({"_id": key, "expires_at": {"$gt": now}})
+        except Exception as e:
+            self.store_errors += 1
+            print(f"LLM cache lookup failed, computing instead: {e}")
+            return None
+        if doc is not None:
+            self._remember(key, doc["value"], doc["expires_at"])
+            self._count(task, "persistent_hits")
+            return doc["value"]
+        return None
+
+    async def set(self, key: str, task: str, model: str, value: Any, ttl_seconds: Optional[int] = None):
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=ttl_seconds or self.ttl_seconds)
+        self._remember(key, value, expires_at)
+        try:
+            await get_bulk_writer(self.collection).add(UpdateOne(
+                {"_id": key},
+                {"$set": {"task": task, "model": model, "value": value,
+                          "created_at": now, "expires_at": expires_at}},
+                upsert=True,
+            ))
+        except Exception as e:
+            self.store_errors += 1
+            print(f"LLM cache write failed, result kept in memory only: {e}")
+
+    async def get_or_compute(
+        self,
+        model: str,
+        task: str,
+        payload: Any,
+        version: int,
+        compute: Callable[[], Awaitable[Any]],
+        ttl_seconds: Optional[int] = None,
+    ) -> Any:
+        """Return the cached output for this input, or compute and store it.
+
+        Exceptions from ``compute`` propagate and nothing is cached.
+        """
+        key = make_key(model, task, payload, version)
+        cached = await self.get(key, task)
+        if cached is not None:
+            return cached
+
+        async def fill():
+            self._count(task, "misses")
+            value = await compute()
+            await self.set(key, task, model, value, ttl_seconds)
+            return value
+
+        return await self._flights.do(key, fill, group=task)
+
+    async def stream_or_compute(
+        self,
+        model: str,
+        task: str,
+        payload: Any,
+        version: int,
+        stream: Callable[[], AsyncIterator[str]],
+        ttl_seconds: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """``get_or_compute`` for streamed text: a hit is replayed as a single chunk,
+        a miss is relayed chunk by chunk and stored once the stream finishes.
+
+        Shares keys with ``get_or_compute``, so streamed and non-streamed calls
+        for the same input reuse each other's output.
+        """
+        key = make_key(model, task, payload, version)
+        cached = await self.get(key, task)
+        if cached is not None:
+            yield cached
+            return
+
+        # an identical call already running: wait for it rather than streaming a second copy
+        joined, value = await self._flights.follow(key, task)
+        if joined:
+            yield value
+            return
+
+        self._count(task, "misses")
+        flight = self._flights.start(key, task)
+        chunks = []
+        try:
+            async for chunk in stream():
+                chunks.append(chunk)
+                yield chunk
+            value = "".join(chunks)
+            await self.set(key, task, model, value, ttl_seconds)
+            flight.set_result(value)
+        except Exception as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            # client went away mid-stream: followers compute the result themselves
+            if not flight.done():
+                flight.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        totals = {"memory_hits": 0, "persistent_hits": 0, "misses": 0}
+        for stats in self._stats.values():
+            for field in totals:
+                totals[field] += stats[field]
+        lookups = sum(totals.values())
+        hits = totals["memory_hits"] + totals["persistent_hits"]
+        return {
+            "entries_in_memory": len(self._lru),
+            "store_errors": self.store_errors,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            **totals,
+            "by_task": self._stats,
+            "single_flight": self._flights.stats(),
+        }
+
+
+llm_cache = LLMCache(llm_cache_collection)
@@ -1,40 +1,188 @@
 import os
 import json
-import google.generativeai as genai
+import asyncio
 from app.core.config import settings
 from app.services.rag_system import RAGSystem
-from app.core.mongo import emails_collection
-from typing import Dict, Any
+from app.services.llm_executor import llm_executor, LLMTimeoutError, LLMOverloadedError
+from app.services.llm_cache import llm_cache
+from app.services.llm_router import llm_router
+from app.services.text_cleaning import chunk_text, estimate_tokens, truncate_to_tokens
+from typing import Dict, Any, AsyncIterator, List, Optional
 from datetime import datetime, timedelta
 
-genai.configure(api_key=settings.GEMINI_API_KEY)
 rag = RAGSystem()
 
-gemini_model = genai.GenerativeModel("gemma-3-27b-it")
+MODEL_NAME = "gemma-3-27b-it"
+llm_executor.scale_limit(MODEL_NAME, llm_router.endpoint_count(MODEL_NAME))
+
+# bump a task's version whenever its prompt changes so cached outputs are not reused
+PROMPT_VERSIONS = {
+    "summarize": 1,
+    "summarize_update": 1,
+    "summarize_chunk": 1,
+    "summarize_reduce": 1,
+    "draft": 1,
+    "classify": 1,
+    "classify_batch": 1,
+    "writing_style": 1,
+    "writing_style_update": 1,
+    "personalized_draft": 1,
+    "rag_answer": 1,
+    "meeting_details": 1,
+}
+
+# stored with each classification so re-runs can skip emails the current prompts already labeled
+CLASSIFIER_VERSION = f"{MODEL_NAME}:{PROMPT_VERSIONS['classify']}.{PROMPT_VERSIONS['classify_batch']}"
+
+# drafts are regenerated on purpose more often than analyses are
+TASK_TTLS = {
+    "draft": 3600,
+    "personalized_draft": 3600,
+    "rag_answer": 3600,
+}
+
+async def _generate(prompt: str, task: str, cache_input: Any, hedge: bool = False) -> str:
+    """Run ``prompt`` through the executor, memoized on ``(task, cache_input)``.
+
+    ``hedge`` is for calls a user is waiting on: see ``LLMRouter.generate``.
+    """
+    async def compute():
+        return await llm_executor.run(
+            MODEL_NAME, lambda: llm_router.generate(MODEL_NAME, prompt, hedge=hedge)
+        )
+
+    return await llm_cache.get_or_compute(
+        MODEL_NAME, task, cache_input, PROMPT_VERSIONS[task], compute,
+        ttl_seconds=TASK_TTLS.get(task),
+    )
 
-async def summarize_text(text: str, mode: str = "short") -> str:
-    prompt = f"""
+async def _stream(prompt: str, task: str, cache_input: Any) -> AsyncIterator[str]:
+    """Streaming ``_generate``: yields text chunks as the model produces them."""
+    async def stream():
+        async with llm_executor.slot(MODEL_NAME):
+            async for chunk in llm_router.stream(MODEL_NAME, prompt):
+                yield chunk
+
+    async for chunk in llm_cache.stream_or_compute(
+        MODEL_NAME, task, cache_input, PROMPT_VERSIONS[task], stream,
+        ttl_seconds=TASK_TTLS.get(task),
+    ):
+        yield chunk
+
+def _summary_prompt(text: str, mode: str) -> str:
+    return f"""
     You are an email assistant. Summarize the following email in {mode} form:
     Email:
     {text}
     """
-    response = gemini_model.generate_content(prompt)
-    return response.text.strip()
 
-async def generate_draft(recipient: str, subject: str, context: str = "") -> str:
+# ---- map-reduce for inputs too long for one prompt ----
+#
+# Long text is split into SUMMARY_CHUNK_TOKENS chunks that are summarized in
+# parallel, and the partial summaries are then reduced into one summary in
+# the requested mode. Chunk summaries do not depend on the mode, so asking
+# for a longer mode of the same email reuses them from the cache. Partials
+# that are themselves too long are condensed again before the reduce.
+
+async def _summarize_chunk(chunk: str) -> str:
     prompt = f"""
+    You are an email assistant. The text below is one part of a longer email
+    or email thread. Summarize this part, keeping every fact, name, date,
+    number, request and decision it contains. Return only the summary.
+
+    Part:
+    {chunk}
+    """
+    response = await _generate(prompt, "summarize_chunk", chunk)
+    return response.strip()
+
+async def _condense(text: str) -> str:
+    """Shrink ``text`` below ``SUMMARY_DIRECT_MAX_TOKENS`` by summarizing its chunks."""
+    while estimate_tokens(text) > settings.SUMMARY_DIRECT_MAX_TOKENS:
+        chunks = chunk_text(text, settings.SUMMARY_CHUNK_TOKENS)
+        partials = await asyncio.gather(*(_summarize_chunk(chunk) for chunk in chunks))
+        condensed = "\n\n".join(f"[Part {i}]\n{p}" for i, p in enumerate(partials, start=1))
+        if len(condensed) >= len(text):
+            # the model is not shrinking this input; cut rather than loop
+            return truncate_to_tokens(condensed, settings.SUMMARY_DIRECT_MAX_TOKENS)
+        text = condensed
+    return text
+
+def _reduce_prompt(partials: str, mode: str) -> str:
+    return f"""
+    You are an email assistant. Below are summaries of consecutive parts of
+    one long email or email thread. Combine them into a single {mode} summary
+    of the whole, without repeating points:
+
+    {partials}
+    """
+
+async def summarize_text(text: str, mode: str = "short") -> str:
+    if estimate_tokens(text) <= settings.SUMMARY_DIRECT_MAX_TOKENS:
+        response = await _generate(
+            _summary_prompt(text, mode), "summarize", {"text": text, "mode": mode}, hedge=True
+        )
+    else:
+        partials = await _condense(text)
+        response = await _generate(
+            _reduce_prompt(partials, mode), "summarize_reduce", {"partials": partials, "mode": mode}, hedge=True
+        )
+    return response.strip()
+
+async def stream_summary(text: str, mode: str = "short") -> AsyncIterator[str]:
+    """Streaming ``summarize_text``; for long text only the reduce step is streamed."""
+    if estimate_tokens(text) <= settings.SUMMARY_DIRECT_MAX_TOKENS:
+        chunks = _stream(_summary_prompt(text, mode), "summarize", {"text": text, "mode": mode})
+    else:
+        partials = await _condense(text)
+        chunks = _stream(_reduce_prompt(partials, mode), "summarize_reduce", {"partials": partials, "mode": mode})
+    async for chunk in chunks:
+        yield chunk
+
+async def update_summary(summary: str, new_text: str, mode: str = "short") -> str:
+    if estimate_tokens(new_text) > settings.SUMMARY_DIRECT_MAX_TOKENS:
+        new_text = await _condense(new_text)
+    prompt = f"""
+    You are an email assistant. Below is a {mode} summary of an email thread,
+    followed by new messages that were added to the thread since. Rewrite the
+    summary so it also covers the new messages, in {mode} form. Return only
+    the updated summary.
+
+    Current summary:
+    {summary}
+
+    New messages:
+    {new_text}
+    """
+    response = await _generate(
+        prompt, "summarize_update", {"summary": summary, "text": new_text, "mode": mode}, hedge=True
+    )
+    return response.strip()
+
+def _draft_prompt(recipient: str, subject: str, context: str) -> str:
+    return f"""
     Write a professional email draft to {recipient}.
     Subject: {subject}
     Context: {context}
     Tone: polite, clear, concise, Proffesional.
     """
-    response = await gemini_model.generate_content_async(prompt)
-    return response.text.strip()
 
-async def classify_email(text: str) -> str:
-    prompt = f"""
-    Classify this email into exactly ONE category. Respond with ONLY the category name.
+async def generate_draft(recipient: str, subject: str, context: str = "") -> str:
+    response = await _generate(
+        _draft_prompt(recipient, subject, context), "draft",
+        {"recipient": recipient, "subject": subject, "context": context}, hedge=True
+    )
+    return response.strip()
+
+def stream_draft(recipient: str, subject: str, context: str = "") -> AsyncIterator[str]:
+    return _stream(
+        _draft_prompt(recipient, subject, context), "draft",
+        {"recipient": recipient, "subject": subject, "context": context}
+    )
 
+VALID_CATEGORIES = ["IMPORTANT", "WORK", "PERSONAL", "SOCIAL", "PROMOTIONS", "NEWSLETTER", "SPAM"]
+
+CLASSIFICATION_RUBRIC = """
     **IMPORTANT (urgent, time-sensitive):**
     - Contains: "urgent", "deadline", "asap", "immediate action required"
     - Examples: Password reset, security alerts, urgent work requests
@@ -68,24 +216,103 @@ async def classify_email(text: str) -> str:
     - Suspicious sender, poor grammar, too-good-to-be-true offers
     - Contains: "claim your prize", suspicious links, phishing attempts
     - Examples: Fake lottery wins, phishing emails, obvious scams
+"""
+
+def _match_category(text: str) -> Optional[str]:
+    text_upper = text.upper()
+    for category in VALID_CATEGORIES:
+        if category in text_upper:
+            return category
+    return None
+
+async def classify_email(text: str) -> str:
+    prompt = f"""
+    Classify this email into exactly ONE category. Respond with ONLY the category name.
 
+    {CLASSIFICATION_RUBRIC}
     Email to classify:
     {text}
 
     Category:
     """
-    response = await gemini_model.generate_content_async(prompt)
-    
-    classification = response.text.strip()
-    
-    valid_categories = ["IMPORTANT", "WORK", "PERSONAL", "SOCIAL", "PROMOTIONS", "NEWSLETTER", "SPAM"]
+    response = await _generate(prompt, "classify", text)
     
-    classification_upper = classification.upper()
-    for category in valid_categories:
-        if category in classification_upper:
-            return category
+    classification = response.strip()
     
-    return "PERSONAL"
+    return _match_category(classification) or "PERSONAL"
+
+
+def _parse_batch_response(response: str, size: int) -> Dict[int, str]:
+    """Map 1-based positions to categories, dropping anything malformed or unknown."""
+    cleaned = response.strip().strip("```json").strip("```").strip()
+    start, end = cleaned.find("["), cleaned.rfind("]")
+    if start == -1 or end == -1:
+        return {}
+    try:
+        items = json.loads(cleaned[start:end + 1])
+    except Exception:
+        return {}
+
+    results = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            position = int(item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        category = str(item.get("category", "")).strip().upper()
+        if 1 <= position <= size and category in VALID_CATEGORIES:
+            results[position] = category
+    return results
+
+async def _classify_batch(texts: List[str]) -> Dict[int, str]:
+    texts = [truncate_to_tokens(text, settings.CLASSIFY_EMAIL_TOKEN_BUDGET) for text in texts]
+    blocks = "\n\n".join(f"[{i}]\n{text}" for i, text in enumerate(texts, start=1))
+    prompt = f"""
+    Classify each of the {len(texts)} emails below into exactly ONE category.
+
+    {CLASSIFICATION_RUBRIC}
+
+    Respond with ONLY a JSON array, one object per email, in this form:
+    [{{"id": 1, "category": "WORK"}}, {{"id": 2, "category": "SPAM"}}]
+
+    Emails to classify:
+    {blocks}
+    """
+    try:
+        response = await _generate(prompt, "classify_batch", texts)
+    except (LLMTimeoutError, LLMOverloadedError):
+        raise
+    except Exception as e:
+        print(f"Batch classification failed: {e}")
+        return {}
+    return _parse_batch_response(response, len(texts))
+
+async def classify_emails_batch(texts: List[str]) -> List[str]:
+    """Classify many emails with one prompt per batch instead of one per email.
+
+    Emails are truncated to ``CLASSIFY_EMAIL_TOKEN_BUDGET`` tokens and packed
+    into batches of at most ``CLASSIFY_BATCH_SIZE``; batches run concurrently.
+    Items missing from a batch answer, or given an unknown category, are
+    retried individually with ``classify_email``. Returns categories in input order.
+    """
+    size = max(1, settings.CLASSIFY_BATCH_SIZE)
+    batches = [texts[i:i + size] for i in range(0, len(texts), size)]
+    answers = await asyncio.gather(*(_classify_batch(batch) for batch in batches))
+
+    results: List[Optional[str]] = []
+    for batch, answer in zip(batches, answers):
+        results += [answer.get(position) for position in range(1, len(batch) + 1)]
+
+    retry = [i for i, category in enumerate(results) if category is None]
+    if retry:
+        print(f"Retrying {len(retry)} of {len(texts)} emails individually")
+        retried = await asyncio.gather(*(classify_email(texts[i]) for i in retry))
+        for i, category in zip(retry, retried):
+            results[i] = category
+
+    return results
 
 
 async def analyze_writing_style(text: str) -> str:
@@ -96,16 +323,26 @@ async def analyze_writing_style(text: str) -> str:
 
     {text}
     """
-    response = await gemini_model.generate_content_async(prompt)
-    return response.text.strip()
+    response = await _generate(prompt, "writing_style", text)
+    return response.strip()
 
-async def generate_personalized_email(
-    profile: str,
-    recipient: str,
-    subject: str,
-    context: str,
-    reply_to: str = ""
-) -> str:
+async def update_writing_style(profile: str, text: str) -> str:
+    prompt = f"""
+    Below is a profile of the user's writing style, followed by emails they
+    have sent since it was written. Update the profile so it also reflects
+    the new emails, keeping what still holds. Return only the updated
+    profile, as short as the original:
+
+    Current profile:
+    {profile}
+
+    New emails:
+    {text}
+    """
+    response = await _generate(prompt, "writing_style_update", {"profile": profile, "text": text})
+    return response.strip()
+
+def _personalized_prompt(profile: str, recipient: str, subject: str, context: str, reply_to: str) -> str:
     if reply_to:
         prompt = f"""
         You are replying to the following email:
@@ -129,38 +366,38 @@ async def generate_personalized_email(
         Write in the following style profile:
         {profile}
         """
+    return prompt
 
-    response = await gemini_model.generate_content_async(prompt)
-    return response.text.strip()
-
+async def generate_personalized_email(
+    profile: str,
+    recipient: str,
+    subject: str,
+    context: str,
+    reply_to: str = ""
+) -> str:
+    response = await _generate(
+        _personalized_prompt(profile, recipient, subject, context, reply_to), "personalized_draft", {
+            "profile": profile, "recipient": recipient, "subject": subject,
+            "context": context, "reply_to": reply_to,
+        }, hedge=True)
+    return response.strip()
+
+def stream_personalized_email(
+    profile: str,
+    recipient: str,
+    subject: str,
+    context: str,
+    reply_to: str = ""
+) -> AsyncIterator[str]:
+    return _stream(
+        _personalized_prompt(profile, recipient, subject, context, reply_to), "personalized_draft", {
+            "profile": profile, "recipient": recipient, "subject": subject,
+            "context": context, "reply_to": reply_to,
+        })
 
-async def index_user_emails(user_id: str):
-    cursor = emails_collection.find({"user_id": user_id})
-    count = 0
-    async for e in cursor:
-        body = e.get("body") or e.get("snippet") or ""
-        if not body:
-            continue
-        meta = {
-            "email_id": e["id"],
-            "thread_id": e.get("thread_id"),
-            "user_id": user_id,
-            "subject": e.get("subject", ""),
-            "sender": e.get("sender", ""),
-            "date": str(e.get("date"))
-        }
-        count += rag.add_document(doc_id=e["id"], text=body, metadata=meta)
-    return {"status": "indexed", "chunks": count}
-
-async def semantic_search(user_id: str, query: str, top_k: int = 5) -> Dict[str, Any]:
-    results = rag.search(query, n_results=top_k)
-    if not results:
-        return {
-            "answer": "No relevant results found.",
-            "sources": [],
-            "raw_matches": []
-        }
 
+async def answer_search(query: str, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """An answer to ``query`` from retrieved email excerpts, with the sources it used."""
     context_text = "\n\n".join(
         [f"From: {r['metadata'].get('sender')}\nSubject: {r['metadata'].get('subject')}\n{r['content']}"
          for r in results]
@@ -178,15 +415,14 @@ Task:
 - Then list the most relevant sources with subject, sender, and a one-line excerpt.
 Return JSON with keys: answer, sources.
 """
-    resp = gemini_model.generate_content(prompt)
+    resp_text = await _generate(prompt, "rag_answer", {"query": query, "context": context_text}, hedge=True)
 
-    import json
     try:
-        parsed = json.loads(resp.text)
-        answer = parsed.get("answer", resp.text)
+        parsed = json.loads(resp_text)
+        answer = parsed.get("answer", resp_text)
         sources = parsed.get("sources", [])
     except Exception:
-        answer = resp.text
+        answer = resp_text
         sources = [
             {
                 "email_id": r["metadata"].get("email_id"),
@@ -197,23 +433,7 @@ Return JSON with keys: answer, sources.
             } for r in results
         ]
 
-    raw_matches = [
-        {
-            "email_id": r["metadata"].get("email_id"),
-            "thread_id": r["metadata"].get("thread_id"),
-            "subject": r["metadata"].get("subject"),
-            "sender": r["metadata"].get("sender"),
-            "date": r["metadata"].get("date"),
-            "excerpt": r["content"][:200], 
-            "score": r["score"]
-        } for r in results
-    ]
-
-    return {
-        "answer": answer,
-        "sources": sources,
-        "raw_matches": raw_matches
-    }
+    return {"answer": answer, "sources": sources}
 
 async def extract_meeting_details(details: str) -> Dict[str, Any]:
         now = datetime.utcnow()
@@ -241,9 +461,12 @@ async def extract_meeting_details(details: str) -> Dict[str, Any]:
         """
 
         try:
-            response = await gemini_model.generate_content_async(prompt)
+            # relative dates resolve against today, so the day is part of the key
+            response = await _generate(
+                prompt, "meeting_details", {"details": details, "day": now.date().isoformat()}
+            )
 
-            cleaned = response.text.strip().strip("```json").strip("```")
+            cleaned = response.strip().strip("```json").strip("```")
 
             data = json.loads(cleaned)
 
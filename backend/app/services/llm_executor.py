@@ -0,0 +1,120 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, TypeVar
+
+from app.core.config import settings
+
+T = TypeVar("T")
+
+
+class LLMTimeoutError(Exception):
+    """An LLM call did not finish within its timeout."""
+
+
+class LLMOverloadedError(Exception):
+    """Too many LLM calls are already waiting for this model."""
+
+
+class LLMExecutor:
+    """Runs every model call with a per-model concurrency limit, a timeout and metrics.
+
+    Calls beyond the limit wait in a queue; once ``max_queue`` are waiting,
+    new calls fail fast with ``LLMOverloadedError`` instead of piling up.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, int]] = None,
+        default_limit: Optional[int] = None,
+        timeout: Optional[float] = None,
+        max_queue: Optional[int] = None,
+    ):
+        self.limits = dict(limits if limits is not None else settings.LLM_CONCURRENCY_LIMITS)
+        self.default_limit = default_limit or settings.LLM_DEFAULT_CONCURRENCY
+        self.timeout = timeout or settings.LLM_TIMEOUT_SECONDS
+        self.max_queue = max_queue or settings.LLM_MAX_QUEUE
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def _model_state(self, model: str):
+        if model not in self._semaphores:
+            self._semaphores[model] = asyncio.Semaphore(self.limits.get(model, self.default_limit))
+            self._stats[model] = {
+                "limit": self.limits.get(model, self.default_limit),
+                "in_flight": 0,
+                "queued": 0,
+                "max_queued": 0,
+                "completed": 0,
+                "failed": 0,
+                "timeouts": 0,
+                "rejected": 0,
+                "total_seconds": 0.0,
+                "total_wait_seconds": 0.0,
+            }
+        return self._semaphores[model], self._stats[model]
+
+    def scale_limit(self, model: str, factor: int):
+        """Multiply ``model``'s limit, e.g. by the number of API keys serving it.
+
+        Only takes effect before the model's first call.
+        """
+        if model not in self._semaphores:
+            self.limits[model] = self.limits.get(model, self.default_limit) * max(1, factor)
+
+    @asynccontextmanager
+    async def slot(self, model: str) -> AsyncIterator[None]:
+        """Hold one of ``model``'s slots for the body, e.g. for a streamed response.
+
+        No timeout is applied here; ``run`` applies one to single calls.
+        """
+        semaphore, stats = self._model_state(model)
+        if stats["queued"] >= self.max_queue:
+            stats["rejected"] += 1
+            raise LLMOverloadedError(f"{stats['queued']} calls already queued for {model}")
+
+        queued_at = time.monotonic()
+        stats["queued"] += 1
+        stats["max_queued"] = max(stats["max_queued"], stats["queued"])
+        try:
+            await semaphore.acquire()
+        finally:
+            stats["queued"] -= 1
+
+        started = time.monotonic()
+        stats["total_wait_seconds"] += started - queued_at
+        stats["in_flight"] += 1
+        try:
+            yield
+            stats["completed"] += 1
+        except LLMTimeoutError:
+            stats["timeouts"] += 1
+            raise
+        except Exception:
+            stats["failed"] += 1
+            raise
+        finally:
+            stats["in_flight"] -= 1
+            stats["total_seconds"] += time.monotonic() - started
+            semaphore.release()
+
+    async def run(self, model: str, call: Callable[[], Awaitable[T]], timeout: Optional[float] = None) -> T:
+        async with self.slot(model):
+            try:
+                return await asyncio.wait_for(call(), timeout or self.timeout)
+            except asyncio.TimeoutError:
+                raise LLMTimeoutError(f"{model} call timed out after {timeout or self.timeout}s")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        report = {}
+        for model, stats in self._stats.items():
+            finished = stats["completed"] + stats["failed"] + stats["timeouts"]
+            report[model] = {
+                **stats,
+                "avg_seconds": round(stats["total_seconds"] / finished, 3) if finished else 0.0,
+                "avg_wait_seconds": round(stats["total_wait_seconds"] / finished, 3) if finished else 0.0,
+            }
+        return report
+
+
+llm_executor = LLMExecutor()
@@ -0,0 +1,436 @@
+"""Spreads model calls across every configured API key and provider.
+
+Each key is an ``Endpoint`` with a token bucket per model (sized from
+``LLM_RATE_LIMITS_RPM``) and health tracking: a 429 cools the key down
+for its Retry-After, 5xx and transport errors back it off exponentially,
+a 401/403 takes it out for ``LLM_AUTH_COOLDOWN_SECONDS``, and the call
+fails over to the next key. Only errors caused by the prompt itself
+(e.g. a 400) are raised without trying another key. Latency-critical callers can ask
+for a hedged request, which races a second key if the first has not
+answered within ``LLM_HEDGE_DELAY_SECONDS``. ``stream`` relays a
+completion chunk by chunk and fails over only before the first chunk.
+
+Gemini keys are called through the Generative Language REST API because
+the SDK's ``genai.configure`` holds a single process-wide key; Nebius is
+called through its OpenAI-compatible API.
+"""
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+import httpx
+
+from app.core.config import settings
+from app.services.llm_executor import LLMOverloadedError
+
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# the key itself is refused (revoked, disabled, lacking access); other keys may work
+KEY_STATUSES = {401, 403}
+
+
+class LLMProviderError(Exception):
+    """A provider rejected the call, or every key failed."""
+
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        """Whether another key (or this one, later) may succeed with the same prompt."""
+        return self.status is None or self.status in RETRYABLE_STATUSES or self.status in KEY_STATUSES
+
+
+class TokenBucket:
+    """``rate_per_minute`` requests per minute, with bursts of up to ten seconds' worth."""
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, self.rate * 10)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available (0 when one is available now)."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def charge(self):
+        """Consume a token even if none is available, for calls made outside the router."""
+        self._refill()
+        self.tokens -= 1
+
+    def drain(self):
+        self.tokens = min(self.tokens, 0.0)
+
+
+class Endpoint:
+    """One API key of one provider, with its rate limits and health."""
+
+    def __init__(self, name: str, provider: str, api_key: str, models: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.provider = provider
+        self.api_key = api_key
+        # app model name -> provider model name; None passes any model through
+        self.models = models
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.cooldown_until = 0.0
+        self.failures = 0
+        self.in_flight = 0
+        self.ewma_seconds: Optional[float] = None
+        self.stats = {"calls": 0, "errors": 0, "rate_limited": 0}
+
+    def serves(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+    def remote_model(self, model: str) -> str:
+        return model if self.models is None else self.models[model]
+
+    def bucket(self, model: str) -> TokenBucket:
+        if model not in self.buckets:
+            limits = settings.LLM_RATE_LIMITS_RPM
+            rpm = limits.get(f"{self.provider}:{model}",
+                             limits.get(f"{self.provider}:*", settings.LLM_DEFAULT_RPM))
+            self.buckets[model] = TokenBucket(rpm)
+        return self.buckets[model]
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+    def record_success(self, seconds: float):
+        self.failures = 0
+        self.ewma_seconds = seconds if self.ewma_seconds is None else 0.8 * self.ewma_seconds + 0.2 * seconds
+
+    def record_failure(self, model: str, error: LLMProviderError):
+        self.stats["errors"] += 1
+        if error.status == 429:
+            self.stats["rate_limited"] += 1
+            self.bucket(model).drain()
+            self.failures += 1
+            cooldown = error.retry_after or min(60.0, 2.0 ** self.failures)
+        elif error.status in KEY_STATUSES:
+            self.failures += 1
+            cooldown = settings.LLM_AUTH_COOLDOWN_SECONDS
+        else:
+            self.failures += 1
+            cooldown = min(30.0, 0.5 * 2.0 ** self.failures)
+        self.cooldown_until = time.monotonic() + cooldown
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "provider": self.provider,
+            **self.stats,
+            "in_flight": self.in_flight,
+            "healthy": self.healthy(),
+            "cooldown_seconds": round(max(0.0, self.cooldown_until - time.monotonic()), 1),
+            "avg_seconds": round(self.ewma_seconds, 3) if self.ewma_seconds is not None else None,
+            "tokens": {m: round(b.tokens, 2) for m, b in self.buckets.items()},
+        }
+
+
+def _endpoints_from_settings() -> List[Endpoint]:
+    endpoints = []
+    gemini_keys = [settings.GEMINI_API_KEY, settings.GEMINI_API_KEY_2, *settings.GEMINI_EXTRA_API_KEYS]
+    for key in dict.fromkeys(k for k in gemini_keys if k):
+        endpoints.append(Endpoint(f"gemini#{len(endpoints) + 1}", "gemini", key))
+    if settings.NEBIUS_API_KEY:
+        endpoints.append(Endpoint("nebius#1", "nebius", settings.NEBIUS_API_KEY, settings.NEBIUS_MODEL_MAP))
+    return endpoints
+
+
+def _sse_data(endpoint: Endpoint, line: str) -> Dict[str, Any]:
+    try:
+        return json.loads(line[5:])
+    except ValueError:
+        raise LLMProviderError(f"{endpoint.name}: malformed stream event {line[:200]!r}")
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    try:
+        return float(response.headers.get("retry-after", ""))
+    except ValueError:
+        return None
+
+
+class LLMRouter:
+    def __init__(self, endpoints: Optional[List[Endpoint]] = None):
+        self.endpoints = endpoints if endpoints is not None else _endpoints_from_settings()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._hedges = {"launched": 0, "won": 0}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=settings.LLM_TIMEOUT_SECONDS)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def endpoint_count(self, model: str, provider: Optional[str] = None) -> int:
+        return len(self._candidates(model, provider, set()))
+
+    def _candidates(self, model: str, provider: Optional[str], exclude: Set[str]) -> List[Endpoint]:
+        return [e for e in self.endpoints
+                if e.serves(model) and e.name not in exclude and (provider is None or e.provider == provider)]
+
+    async def _acquire(self, model: str, provider: Optional[str], exclude: Set[str]) -> Optional[Endpoint]:
+        """Take a token from the best available key, waiting up to ``LLM_ROUTER_MAX_WAIT_SECONDS``."""
+        deadline = time.monotonic() + settings.LLM_ROUTER_MAX_WAIT_SECONDS
+        while True:
+            candidates = self._candidates(model, provider, exclude)
+            if not candidates:
+                return None
+            healthy = [e for e in candidates if e.healthy()]
+            ready = [e for e in healthy if e.bucket(model).wait_time() == 0]
+            if ready:
+                # least loaded first, then fastest recently
+                endpoint = min(ready, key=lambda e: (e.in_flight, e.ewma_seconds or 0.0))
+                endpoint.bucket(model).take()
+                return endpoint
+
+            now = time.monotonic()
+            waits = [e.bucket(model).wait_time() for e in healthy]
+            waits += [e.cooldown_until - now for e in candidates if not e.healthy()]
+            wait = max(0.01, min(waits))
+            if now + wait > deadline:
+                return None
+            await asyncio.sleep(wait)
+
+    async def _call_gemini(self, endpoint: Endpoint, model: str, prompt: str) -> str:
+        response = await self.client.post(
+            f"{GEMINI_BASE_URL}/models/{endpoint.remote_model(model)}:generateContent",
+            headers={"x-goog-api-key": endpoint.api_key},
+            json={"contents": [{"role": "user", "parts": [{"text": prompt}]}]},
+        )
+        if response.status_code != 200:
+            raise LLMProviderError(f"{endpoint.name}: {response.status_code} {response.text[:200]}",
+                                   response.status_code, _retry_after(response))
+        candidates = response.json().get("candidates") or []
+        parts = (candidates[0].get("content") or {}).get("parts", []) if candidates else []
+        if not parts:
+            # blocked or empty: another key would answer the same way
+            raise LLMProviderError(f"{endpoint.name}: empty response", status=400)
+        return "".join(part.get("text", "") for part in parts)
+
+    async def _call_openai_compatible(self, endpoint: Endpoint, model: str, prompt: str) -> str:
+        response = await self.client.post(
+            f"{settings.NEBIUS_BASE_URL}/chat/completions",
+            headers={"Authorization": f"Bearer {endpoint.api_key}"},
+            json={"model": endpoint.remote_model(model),
+                  "messages": [{"role": "user", "content": prompt}]},
+        )
+        if response.status_code != 200:
+            raise LLMProviderError(f"{endpoint.name}: {response.status_code} {response.text[:200]}",
+                                   response.status_code, _retry_after(response))
+        return response.json()["choices"][0]["message"]["content"] or ""
+
+    async def _stream_gemini(self, endpoint: Endpoint, model: str, prompt: str) -> AsyncIterator[str]:
+        async with self.client.stream(
+            "POST",
+            f"{GEMINI_BASE_URL}/models/{endpoint.remote_model(model)}:streamGenerateContent",
+            params={"alt": "sse"},
+            headers={"x-goog-api-key": endpoint.api_key},
+            json={"contents": [{"role": "user", "parts": [{"text": prompt}]}]},
+        ) as response:
+            if response.status_code != 200:
+                body = (await response.aread()).decode("utf-8", errors="ignore")
+                raise LLMProviderError(f"{endpoint.name}: {response.status_code} {body[:200]}",
+                                       response.status_code, _retry_after(response))
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                candidates = _sse_data(endpoint, line).get("candidates") or []
+                for part in (candidates[0].get("content") or {}).get("parts", []) if candidates else []:
+                    if part.get("text"):
+                        yield part["text"]
+
+    async def _stream_openai_compatible(self, endpoint: Endpoint, model: str, prompt: str) -> AsyncIterator[str]:
+        async with self.client.stream(
+            "POST",
+            f"{settings.NEBIUS_BASE_URL}/chat/completions",
+            headers={"Authorization": f"Bearer {endpoint.api_key}"},
+            json={"model": endpoint.remote_model(model), "stream": True,
+                  "messages": [{"role": "user", "content": prompt}]},
+        ) as response:
+            if response.status_code != 200:
+                body = (await response.aread()).decode("utf-8", errors="ignore")
+                raise LLMProviderError(f"{endpoint.name}: {response.status_code} {body[:200]}",
+                                       response.status_code, _retry_after(response))
+            async for line in response.aiter_lines():
+                if not line.startswith("data:") or line[5:].strip() == "[DONE]":
+                    continue
+                choices = _sse_data(endpoint, line).get("choices") or []
+                text = (choices[0].get("delta") or {}).get("content") if choices else None
+                if text:
+                    yield text
+
+    async def _call(self, endpoint: Endpoint, model: str, prompt: str) -> str:
+        call = self._call_gemini if endpoint.provider == "gemini" else self._call_openai_compatible
+        endpoint.in_flight += 1
+        endpoint.stats["calls"] += 1
+        started = time.monotonic()
+        try:
+            text = await call(endpoint, model, prompt)
+        except httpx.HTTPError as e:
+            error = LLMProviderError(f"{endpoint.name}: {type(e).__name__}: {e}")
+            endpoint.record_failure(model, error)
+            raise error from e
+        except LLMProviderError as e:
+            if e.retryable:
+                endpoint.record_failure(model, e)
+            raise
+        finally:
+            endpoint.in_flight -= 1
+        endpoint.record_success(time.monotonic() - started)
+        return text
+
+    async def _with_failover(self, model: str, prompt: str, tried: Set[str]) -> str:
+        last_error: Optional[LLMProviderError] = None
+        while True:
+            endpoint = await self._acquire(model, None, tried)
+            if endpoint is None:
+                break
+            tried.add(endpoint.name)
+            try:
+                return await self._call(endpoint, model, prompt)
+            except LLMProviderError as e:
+                if not e.retryable:
+                    raise
+                print(f"LLM call failed on {endpoint.name}, failing over: {e}")
+                last_error = e
+        raise self._exhausted(model, last_error)
+
+    @staticmethod
+    def _exhausted(model: str, last_error: Optional[LLMProviderError]) -> Exception:
+        if last_error is None or last_error.status == 429:
+            return LLMOverloadedError(f"no API key has quota for {model} right now")
+        return LLMProviderError(f"every key failed for {model}: {last_error}", last_error.status)
+
+    async def _hedged(self, model: str, prompt: str) -> str:
+        # both attempts share ``tried`` so the hedge always goes to a different key
+        tried: Set[str] = set()
+        primary = asyncio.create_task(self._with_failover(model, prompt, tried))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=settings.LLM_HEDGE_DELAY_SECONDS)
+            if done:
+                return primary.result()
+
+            self._hedges["launched"] += 1
+            hedge = asyncio.create_task(self._with_failover(model, prompt, tried))
+            tasks.append(hedge)
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._hedges["won"] += 1
+                        return task.result()
+            # both failed: report the primary's error
+            return primary.result()
+        finally:
+            # also reached when the caller is cancelled or times out mid-wait
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def generate(self, model: str, prompt: str, hedge: bool = False) -> str:
+        if hedge and settings.LLM_HEDGE_DELAY_SECONDS > 0 and self.endpoint_count(model) > 1:
+            return await self._hedged(model, prompt)
+        return await self._with_failover(model, prompt, set())
+
+    async def stream(self, model: str, prompt: str) -> AsyncIterator[str]:
+        """Yield the completion in chunks as the provider produces them.
+
+        Fails over to another key only until the first chunk arrives; after
+        that an error ends the stream, since the caller has already relayed
+        partial text.
+        """
+        tried: Set[str] = set()
+        last_error: Optional[LLMProviderError] = None
+        while True:
+            endpoint = await self._acquire(model, None, tried)
+            if endpoint is None:
+                break
+            tried.add(endpoint.name)
+            chunks = (self._stream_gemini if endpoint.provider == "gemini"
+                      else self._stream_openai_compatible)(endpoint, model, prompt)
+            relayed = False
+            endpoint.in_flight += 1
+            endpoint.stats["calls"] += 1
+            started = time.monotonic()
+            try:
+                async for chunk in chunks:
+                    relayed = True
+                    yield chunk
+            except (httpx.HTTPError, LLMProviderError) as e:
+                error = e if isinstance(e, LLMProviderError) else LLMProviderError(
+                    f"{endpoint.name}: {type(e).__name__}: {e}")
+                if error.retryable:
+                    endpoint.record_failure(model, error)
+                if relayed or not error.retryable:
+                    raise error from e
+                print(f"LLM stream failed on {endpoint.name}, failing over: {error}")
+                last_error = error
+                continue
+            finally:
+                endpoint.in_flight -= 1
+            endpoint.record_success(time.monotonic() - started)
+            return
+        raise self._exhausted(model, last_error)
+
+    @asynccontextmanager
+    async def lease(self, model: str, provider: str) -> AsyncIterator[Endpoint]:
+        """Hand a key to a client that makes its own calls (the langchain agent).
+
+        The first call is charged on entry; the holder charges further calls
+        with ``endpoint.bucket(model).charge()``. A failure whose message
+        looks like a quota error cools the key down as a 429 would.
+        """
+        endpoint = await self._acquire(model, provider, set())
+        if endpoint is None:
+            raise LLMOverloadedError(f"no {provider} API key has quota for {model} right now")
+        endpoint.in_flight += 1
+        endpoint.stats["calls"] += 1
+        started = time.monotonic()
+        try:
+            yield endpoint
+        except Exception as e:
+            message = str(e)
+            status = 429 if "429" in message or "ResourceExhausted" in message or "quota" in message.lower() else None
+            if status is not None or isinstance(e, httpx.HTTPError):
+                endpoint.record_failure(model, LLMProviderError(message, status))
+            raise
+        else:
+            endpoint.record_success(time.monotonic() - started)
+        finally:
+            endpoint.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "endpoints": {e.name: e.snapshot() for e in self.endpoints},
+            "hedges": dict(self._hedges),
+        }
+
+
+llm_router = LLMRouter()
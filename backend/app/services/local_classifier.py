@@ -0,0 +1,344 @@
+"""In-process email classifier trained on the labels the LLM already produced.
+
+Emails are turned into hashed n-gram features (subject/body words and
+bigrams, sender address and domain, Gmail label ids) and scored by a
+multinomial logistic regression held in a NumPy matrix. Predictions at or
+above ``LOCAL_CLASSIFIER_THRESHOLD`` are answered locally; everything
+else falls back to the LLM.
+
+Run ``python -m app.services.local_classifier retrain`` to train and
+store a new model, or ``... report`` to print the stored agreement report.
+"""
+import asyncio
+import io
+import json
+import re
+import sys
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from bson import Binary
+
+from app.core.config import settings
+from app.core.mongo import emails_collection, classifier_models_collection
+from app.services.llm_client import VALID_CATEGORIES, classify_emails_batch
+from app.services.text_cleaning import TEXT_FIELDS, email_text
+
+MODEL_ID = "email_classifier"
+SOURCE_LOCAL = "local"
+SOURCE_LLM = "llm"
+
+_TOKEN_RE = re.compile(r"[a-z0-9$%€£]+(?:'[a-z]+)?")
+_ADDRESS_RE = re.compile(r"<([^>]+)>")
+# the tail of long emails is mostly signatures and footers; the head carries the signal
+_MAX_TEXT_CHARS = 3000
+
+
+def _hash(feature: str, n_features: int) -> int:
+    return zlib.crc32(feature.encode("utf-8")) & (n_features - 1)
+
+
+def _sender_features(sender: str) -> List[str]:
+    match = _ADDRESS_RE.search(sender or "")
+    address = (match.group(1) if match else sender or "").strip().lower()
+    if "@" not in address:
+        return []
+    local, domain = address.rsplit("@", 1)
+    features = [f"from:{address}", f"domain:{domain}"]
+    # "noreply", "newsletter", "notifications" ... say a lot on their own
+    features += [f"local:{part}" for part in re.split(r"[._+-]", local) if part]
+    parts = domain.split(".")
+    if len(parts) > 2:
+        features.append(f"domain:{'.'.join(parts[-2:])}")
+    return features
+
+
+def featurize(email: Dict[str, Any], n_features: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Sparse, L2-normalized hashed features of an email document."""
+    text = f"{email.get('subject', '')}\n{email_text(email)}"
+    tokens = _TOKEN_RE.findall(text[:_MAX_TEXT_CHARS].lower())
+
+    features = [f"w:{t}" for t in tokens]
+    features += [f"b:{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    features += [f"s:{t}" for t in _TOKEN_RE.findall((email.get("subject") or "").lower())]
+    features += _sender_features(email.get("sender", ""))
+    features += [f"label:{label}" for label in email.get("labels") or []]
+    features.append("bias")
+
+    counts: Dict[int, float] = {}
+    for feature in features:
+        index = _hash(feature, n_features)
+        counts[index] = counts.get(index, 0.0) + 1.0
+
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.log1p(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+    values /= np.linalg.norm(values)
+    return indices, values
+
+
+def _softmax(scores: np.ndarray) -> np.ndarray:
+    scores = scores - scores.max(axis=-1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class LocalClassifier:
+    """Multinomial logistic regression over hashed features, trained with AdaGrad."""
+
+    def __init__(self, classes: List[str], n_features: int, weights: Optional[np.ndarray] = None):
+        self.classes = list(classes)
+        self.n_features = n_features
+        self.weights = (
+            weights if weights is not None
+            else np.zeros((n_features, len(self.classes)), dtype=np.float32)
+        )
+
+    def predict_proba(self, email: Dict[str, Any]) -> np.ndarray:
+        indices, values = featurize(email, self.n_features)
+        return _softmax(values @ self.weights[indices])
+
+    def predict(self, email: Dict[str, Any]) -> Tuple[str, float]:
+        probs = self.predict_proba(email)
+        best = int(probs.argmax())
+        return self.classes[best], float(probs[best])
+
+    def fit(
+        self,
+        samples: List[Tuple[np.ndarray, np.ndarray]],
+        labels: np.ndarray,
+        epochs: int = 8,
+        batch_size: int = 64,
+        learning_rate: float = 0.5,
+        l2: float = 1e-6,
+        seed: int = 0,
+    ):
+        rng = np.random.default_rng(seed)
+        n_classes = len(self.classes)
+        accumulator = np.full_like(self.weights, 1e-8)
+        onehot = np.eye(n_classes, dtype=np.float32)[labels]
+
+        for _ in range(epochs):
+            order = rng.permutation(len(samples))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                indices = np.concatenate([samples[i][0] for i in batch])
+                values = np.concatenate([samples[i][1] for i in batch])
+                rows = np.repeat(np.arange(len(batch)), [len(samples[i][0]) for i in batch])
+
+                scores = np.zeros((len(batch), n_classes), dtype=np.float32)
+                np.add.at(scores, rows, self.weights[indices] * values[:, None])
+                error = _softmax(scores) - onehot[batch]
+
+                gradient = np.zeros((len(indices), n_classes), dtype=np.float32)
+                gradient[:] = error[rows] * values[:, None]
+                touched, inverse = np.unique(indices, return_inverse=True)
+                grad = np.zeros((len(touched), n_classes), dtype=np.float32)
+                np.add.at(grad, inverse, gradient)
+                grad += l2 * self.weights[touched]
+
+                accumulator[touched] += grad ** 2
+                self.weights[touched] -= learning_rate * grad / np.sqrt(accumulator[touched])
+        return self
+
+    def to_document(self) -> Dict[str, Any]:
+        buffer = io.BytesIO()
+        np.save(buffer, self.weights.astype(np.float32), allow_pickle=False)
+        return {"classes": self.classes, "n_features": self.n_features, "weights": Binary(buffer.getvalue())}
+
+    @classmethod
+    def from_document(cls, doc: Dict[str, Any]) -> "LocalClassifier":
+        weights = np.load(io.BytesIO(bytes(doc["weights"])), allow_pickle=False)
+        return cls(doc["classes"], doc["n_features"], weights)
+
+
+# ---------------------- Training ---------------------- #
+
+# labels written by the local model itself must never be trained on
+TRAINING_QUERY = {
+    "classification": {"$in": VALID_CATEGORIES},
+    "classification_source": {"$ne": SOURCE_LOCAL},
+}
+TRAINING_PROJECTION = {**TEXT_FIELDS, "id": 1, "subject": 1, "sender": 1, "labels": 1,
+                       "classification": 1}
+
+
+def _is_holdout(email_id: str) -> bool:
+    # stable split, so reports from successive retrains are comparable
+    return zlib.crc32(str(email_id).encode("utf-8")) % 5 == 0
+
+
+def evaluate(model: LocalClassifier, emails: List[Dict[str, Any]], threshold: float) -> Dict[str, Any]:
+    """Agreement of ``model`` with the stored LLM labels, overall and above ``threshold``."""
+    if not emails:
+        return {"samples": 0}
+
+    per_class = {c: {"support": 0, "predicted": 0, "agreed": 0} for c in model.classes}
+    agreed = confident = confident_agreed = 0
+    started = time.perf_counter()
+    for email in emails:
+        predicted, confidence = model.predict(email)
+        label = email["classification"]
+        per_class[label]["support"] += 1
+        per_class[predicted]["predicted"] += 1
+        if predicted == label:
+            agreed += 1
+            per_class[label]["agreed"] += 1
+        if confidence >= threshold:
+            confident += 1
+            confident_agreed += predicted == label
+    elapsed = time.perf_counter() - started
+
+    for stats in per_class.values():
+        stats["precision"] = round(stats["agreed"] / stats["predicted"], 3) if stats["predicted"] else None
+        stats["recall"] = round(stats["agreed"] / stats["support"], 3) if stats["support"] else None
+
+    return {
+        "samples": len(emails),
+        "agreement": round(agreed / len(emails), 3),
+        "threshold": threshold,
+        # share of emails the local model would answer without the LLM, and how often it matches it there
+        "coverage": round(confident / len(emails), 3),
+        "confident_agreement": round(confident_agreed / confident, 3) if confident else None,
+        "avg_predict_us": round(elapsed / len(emails) * 1e6, 1),
+        "per_class": per_class,
+    }
+
+
+async def retrain(user_id: Optional[str] = None) -> Dict[str, Any]:
+    """Train on every LLM-labeled email, evaluate on a held-out fifth and store the model."""
+    query = dict(TRAINING_QUERY)
+    if user_id:
+        query["user_id"] = user_id
+
+    n_features = settings.LOCAL_CLASSIFIER_FEATURES
+    train_samples, train_labels, holdout = [], [], []
+    async for email in emails_collection.find(query, projection=TRAINING_PROJECTION):
+        if _is_holdout(email["id"]):
+            holdout.append(email)
+        else:
+            train_samples.append(featurize(email, n_features))
+            train_labels.append(VALID_CATEGORIES.index(email["classification"]))
+
+    if len(train_samples) < settings.LOCAL_CLASSIFIER_MIN_SAMPLES:
+        return {"trained": False,
+                "reason": f"{len(train_samples)} labeled emails, need {settings.LOCAL_CLASSIFIER_MIN_SAMPLES}"}
+
+    started = time.perf_counter()
+    model = await asyncio.to_thread(
+        LocalClassifier(VALID_CATEGORIES, n_features).fit,
+        train_samples, np.array(train_labels),
+    )
+    training_seconds = round(time.perf_counter() - started, 2)
+
+    report = {
+        "trained": True,
+        "trained_at": datetime.utcnow(),
+        "train_samples": len(train_samples),
+        "training_seconds": training_seconds,
+        "holdout": await asyncio.to_thread(
+            evaluate, model, holdout, settings.LOCAL_CLASSIFIER_THRESHOLD
+        ),
+    }
+    await classifier_models_collection.replace_one(
+        {"_id": MODEL_ID},
+        {**model.to_document(), "trained_at": report["trained_at"], "report": report},
+        upsert=True,
+    )
+    local_classifier.invalidate()
+    return report
+
+
+async def stored_report() -> Optional[Dict[str, Any]]:
+    doc = await classifier_models_collection.find_one({"_id": MODEL_ID}, projection={"report": 1})
+    return doc and doc["report"]
+
+
+# ---------------------- Serving ---------------------- #
+
+class ClassifierRouter:
+    """Answers confident cases with the local model and sends the rest to the LLM.
+
+    The stored model is loaded on first use and re-checked every
+    ``LOCAL_CLASSIFIER_RELOAD_SECONDS`` so a retrain from the command line
+    is picked up without a restart.
+    """
+
+    def __init__(self):
+        self.model: Optional[LocalClassifier] = None
+        self.trained_at: Optional[datetime] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+        self._stats = {"local": 0, "llm": 0}
+
+    def invalidate(self):
+        self._checked_at = 0.0
+
+    async def _current_model(self) -> Optional[LocalClassifier]:
+        if time.monotonic() - self._checked_at < settings.LOCAL_CLASSIFIER_RELOAD_SECONDS:
+            return self.model
+        async with self._lock:
+            if time.monotonic() - self._checked_at < settings.LOCAL_CLASSIFIER_RELOAD_SECONDS:
+                return self.model
+            meta = await classifier_models_collection.find_one(
+                {"_id": MODEL_ID}, projection={"trained_at": 1}
+            )
+            if meta is None:
+                self.model, self.trained_at = None, None
+            elif meta["trained_at"] != self.trained_at:
+                doc = await classifier_models_collection.find_one({"_id": MODEL_ID})
+                self.model = LocalClassifier.from_document(doc)
+                self.trained_at = doc["trained_at"]
+            self._checked_at = time.monotonic()
+        return self.model
+
+    async def classify(self, emails: List[Dict[str, Any]]) -> List[Tuple[str, str]]:
+        """``(category, source)`` for each email document, in input order."""
+        results: List[Optional[Tuple[str, str]]] = [None] * len(emails)
+        model = await self._current_model() if settings.LOCAL_CLASSIFIER_ENABLED else None
+        if model is not None:
+            for i, email in enumerate(emails):
+                category, confidence = model.predict(email)
+                if confidence >= settings.LOCAL_CLASSIFIER_THRESHOLD:
+                    results[i] = (category, SOURCE_LOCAL)
+
+        fallback = [i for i, result in enumerate(results) if result is None]
+        if fallback:
+            texts = [email_text(emails[i]) for i in fallback]
+            for i, category in zip(fallback, await classify_emails_batch(texts)):
+                results[i] = (category, SOURCE_LLM)
+
+        self._stats["local"] += len(emails) - len(fallback)
+        self._stats["llm"] += len(fallback)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        total = self._stats["local"] + self._stats["llm"]
+        return {
+            "model_trained_at": self.trained_at,
+            "threshold": settings.LOCAL_CLASSIFIER_THRESHOLD,
+            **self._stats,
+            "local_share": round(self._stats["local"] / total, 3) if total else 0.0,
+        }
+
+
+local_classifier = ClassifierRouter()
+
+
+async def _main(command: str, user_id: Optional[str]):
+    if command == "retrain":
+        report = await retrain(user_id)
+    elif command == "report":
+        report = await stored_report()
+    else:
+        raise SystemExit("usage: python -m app.services.local_classifier retrain|report [user_id]")
+    print(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(
+        sys.argv[1] if len(sys.argv) > 1 else "report",
+        sys.argv[2] if len(sys.argv) > 2 else None,
+    ))
@@ -1,17 +1,15 @@
 from datetime import datetime
 from typing import Dict, Any, List
 import uuid
-import json
+import asyncio
 
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
 
 from app.models.email_model import MeetingCreate, MeetingStatus
 from app.core.mongo import db
 from app.core.config import settings
 from app.services.llm_client import extract_meeting_details
+from app.services.google_credentials import credential_manager, authorized_http
 
 SCOPES = settings.GMAILSCOPES
 
@@ -26,31 +24,10 @@ class SchedulingService:
         return await extract_meeting_details(details=details)
 
     async def _get_google_service(self, user_id: str):
-        user_doc = await self.users_collection.find_one({"id": user_id})
-        if not user_doc or "google_credentials" not in user_doc:
-            raise Exception("User not authenticated with Google")
-
-        creds = Credentials.from_authorized_user_info(
-            json.loads(user_doc["google_credentials"]), SCOPES
-        )
-
-        # TODO: handle refresh if expired
-        if not creds.valid and creds.refresh_token:
-            try:
-                creds.refresh(Request())
-                await self.users_collection.update_one(
-                    {"id": user_id},
-                    {"$set": {"google_credentials": creds.to_json(),
-                              "updated_at": datetime.utcnow()}}
-                )
-            except Exception as e:
-                print(f"Failed to refresh token: {e}")
-                raise Exception("Google credentials expired. Please re-authenticate.")
-
-        return build("calendar", "v3", credentials=creds)
+        return await credential_manager.get_client(user_id, "calendar", "v3")
 
     async def create_google_calendar_event(self, meeting_data: MeetingCreate, user_id: str, target_user_email: str):
-        service = await self._get_google_service(user_id)
+        service, creds = await self._get_google_service(user_id)
 
         current_user = await self.users_collection.find_one({"id": user_id})
         attendees = set(meeting_data.attendees or [])
@@ -77,11 +54,12 @@ class SchedulingService:
             },
         }
 
-        created_event = service.events().insert(
+        request = service.events().insert(
             calendarId="primary",
             body=event,
             conferenceDataVersion=1
-        ).execute()
+        )
+        created_event = await asyncio.to_thread(request.execute, http=authorized_http(creds))
 
         meeting_doc = {
             "id": str(uuid.uuid4()),
@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import json
+import sys
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from pymongo import UpdateOne
+
+from app.core.bulk_writer import BulkWriter
+from app.core.config import settings
+from app.core.mongo import emails_collection
+from app.services.lexical_index import lexical_indexes, lexical_terms
+from app.services.llm_client import rag
+from app.services.rag_system import INDEX_VERSION, chunk_id
+from app.services.text_cleaning import TEXT_FIELDS, email_text
+
+INDEX_FIELDS = {**TEXT_FIELDS, "id": 1, "thread_id": 1, "subject": 1, "sender": 1, "date": 1,
+                "rag_hash": 1, "rag_chunks": 1, "lex_len": 1}
+
+
+def _metadata(user_id: str, e: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "email_id": e["id"],
+        "thread_id": e.get("thread_id"),
+        "user_id": user_id,
+        "subject": e.get("subject", ""),
+        "sender": e.get("sender", ""),
+        "date": str(e.get("date"))
+    }
+
+
+def content_hash(text: str, metadata: Dict[str, Any]) -> str:
+    raw = json.dumps([INDEX_VERSION, text, metadata], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class _Batch:
+    """Chunks of several emails, embedded and written together."""
+
+    def __init__(self):
+        self.emails: List[Dict[str, Any]] = []
+        self.documents = []
+
+    def add(self, e: Dict[str, Any], digest: str, documents: List, lexical: Tuple[Dict[str, int], int]):
+        self.emails.append({"id": e["id"], "hash": digest, "chunks": len(documents),
+                            "previous": e.get("rag_chunks") if e.get("rag_hash") else None,
+                            "email": e, "lexical": lexical})
+        self.documents.extend(documents)
+
+    def __len__(self):
+        return len(self.documents)
+
+
+def _write_batch(user_id: str, batch: _Batch) -> int:
+    # emails indexed before chunk ids were deterministic have to be cleared by doc_id
+    rag.delete_documents(user_id, [e["id"] for e in batch.emails if e["previous"] is None])
+    # chunks left over by emails that got shorter go in the same write as the upsert
+    stale = [chunk_id(e["id"], i) for e in batch.emails if e["previous"] for i in range(e["chunks"], e["previous"])]
+    return rag.upsert_chunks(user_id, batch.documents, stale)
+
+
+def _clear(user_id: str, e: Dict[str, Any]):
+    """Delete the chunks of an email that has no text left."""
+    if e.get("rag_chunks"):
+        rag.delete_chunks(user_id, e["id"], 0, e["rag_chunks"])
+    else:
+        rag.delete_documents(user_id, [e["id"]])
+
+
+async def _save_lexical(user_id: str, entries: List, writer: BulkWriter):
+    for e, terms, length in entries:
+        await writer.add(UpdateOne(
+            {"id": e["id"], "user_id": user_id},
+            {"$set": {"lex_terms": terms, "lex_len": length}}
+        ))
+    lexical_indexes.apply(user_id, entries)
+
+
+async def _flush(user_id: str, batch: _Batch, writer: BulkWriter) -> Tuple[int, List[Tuple[str, asyncio.Future]]]:
+    """Write a batch's chunks; returns the chunk count and the futures of the ``rag_hash`` writes."""
+    # lexical search needs no embeddings, so it mustn't depend on the embedding call succeeding
+    await _save_lexical(user_id, [(e["email"], *e["lexical"]) for e in batch.emails], writer)
+    count = await asyncio.to_thread(_write_batch, user_id, batch)
+    now = datetime.utcnow()
+    written = []
+    for e in batch.emails:
+        written.append((e["id"], await writer.add(UpdateOne(
+            {"id": e["id"], "user_id": user_id},
+            {"$set": {"rag_hash": e["hash"], "rag_chunks": e["chunks"], "rag_indexed_at": now}}
+        ))))
+    return count, written
+
+
+async def _index(user_id: str, emails, writer: BulkWriter, force: bool) -> AsyncIterator[Dict[str, Any]]:
+    """Index ``emails`` (an async iterable of documents with ``INDEX_FIELDS``),
+    yielding a progress event after every batch."""
+    counts = {"processed": 0, "indexed": 0, "skipped": 0, "failed": 0, "chunks": 0}
+    batch = _Batch()
+    writes: List[Tuple[str, asyncio.Future]] = []
+
+    async def flush():
+        nonlocal batch
+        current, batch = batch, _Batch()
+        try:
+            chunks, written = await _flush(user_id, current, writer)
+            counts["chunks"] += chunks
+            counts["indexed"] += len(current.emails)
+            writes.extend(written)
+            return {"type": "progress", **counts}
+        except Exception as e:
+            counts["failed"] += len(current.emails)
+            return {"type": "error", "ids": [m["id"] for m in current.emails], "error": str(e), **counts}
+
+    async for e in emails:
+        counts["processed"] += 1
+        text = email_text(e)
+        metadata = _metadata(user_id, e)
+        digest = content_hash(text, metadata)
+        unchanged = not force and e.get("rag_hash") == digest
+        emptied = not text and bool(e.get("rag_hash"))
+        if emptied:
+            # indexed while it still had text; its old chunks would keep matching searches
+            await asyncio.to_thread(_clear, user_id, e)
+            await writer.add(UpdateOne(
+                {"id": e["id"], "user_id": user_id},
+                {"$unset": {"rag_hash": "", "rag_chunks": "", "rag_indexed_at": ""}}
+            ))
+        if not text or unchanged:
+            counts["skipped"] += 1
+            # the lexical index also covers emails without a body, and ones embedded before it existed
+            if "lex_len" not in e or emptied:
+                await _save_lexical(user_id, [(e, *lexical_terms(e, text))], writer)
+            continue
+        batch.add(e, digest, rag.split_document(e["id"], text, metadata), lexical_terms(e, text))
+        if len(batch) >= settings.RAG_EMBED_BATCH_SIZE:
+            yield await flush()
+
+    if batch.emails:
+        yield await flush()
+    if writes:
+        # an email whose rag_hash didn't land is embedded again by the next run
+        await writer.flush()
+        errors = await asyncio.gather(*(future for _, future in writes))
+        failed = [email_id for (email_id, _), error in zip(writes, errors) if error]
+        if failed:
+            counts["indexed"] -= len(failed)
+            counts["failed"] += len(failed)
+            message = next(error for error in errors if error)["message"]
+            yield {"type": "error", "ids": failed, "error": f"index state not saved: {message}", **counts}
+    yield {"type": "complete", **counts}
+
+
+async def index_mailbox(user_id: str, force: bool = False) -> AsyncIterator[Dict[str, Any]]:
+    """Index every email of ``user_id`` for RAG search and yield progress events.
+
+    Each email's content hash is stored with it and unchanged emails are
+    skipped, so re-indexing an indexed mailbox costs one pass over Mongo
+    and no embedding calls. Changed emails are re-split and their chunks
+    are embedded ``RAG_EMBED_BATCH_SIZE`` at a time across emails, then
+    upserted under deterministic ids. ``force`` re-embeds everything, as
+    does a store built with another embedding model, which is rebuilt first.
+    """
+    rebuilt = await asyncio.to_thread(rag.rebuild_if_stale, user_id)
+    force = force or rebuilt
+    total = await emails_collection.count_documents({"user_id": user_id})
+    yield {"type": "start", "total": total, "index_version": INDEX_VERSION, "rebuilt": rebuilt}
+
+    cursor = emails_collection.find({"user_id": user_id}, projection=INDEX_FIELDS)
+    async with BulkWriter(emails_collection) as writer:
+        async for event in _index(user_id, cursor, writer, force):
+            yield event
+
+
+async def index_emails(user_id: str, emails: List[Dict[str, Any]], writer: BulkWriter,
+                       force: bool = False) -> Dict[str, Any]:
+    """Index a handful of already loaded emails; returns the final counts and
+    the ``failed_ids`` of the emails that weren't indexed.
+
+    While the user's store needs a reindex only the lexical terms are
+    written: the embeddings wouldn't fit the store, and the ``index_mailbox``
+    run that rebuilds it re-embeds every email anyway.
+    """
+    if await asyncio.to_thread(rag.needs_reindex, user_id):
+        await _save_lexical(user_id, [(e, *lexical_terms(e, email_text(e))) for e in emails], writer)
+        return {"type": "complete", "processed": len(emails), "indexed": 0, "skipped": len(emails),
+                "failed": 0, "chunks": 0, "failed_ids": []}
+
+    async def each():
+        for e in emails:
+            yield e
+
+    result, failed = {}, []
+    async for event in _index(user_id, each(), writer, force):
+        if event["type"] == "error":
+            failed.extend(event["ids"])
+        result = event
+    return {**result, "failed_ids": failed}
+
+
+if __name__ == "__main__":
+    # one-time migration after upgrading to per-user stores
+    if sys.argv[1:] == ["drop-legacy"]:
+        print("dropped" if rag.drop_legacy_collection() else "no legacy collection")
+    else:
+        print("usage: python -m app.services.rag_indexing drop-legacy")
@@ -1,95 +1,238 @@
+import hashlib
 import os
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from typing import List, Dict, Optional
 
+import chromadb
+from chromadb.config import Settings as ChromaSettings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_core.documents import Document
 from app.core.config import settings
+from app.services.embeddings import GeminiEmbeddingProvider, get_embeddings, provider_class
+from app.services.vector_stores import ChromaStore, NumpyStore
 
 CHROMA_DB_PATH = "data/chroma_db"
-GEMINI_API_KEY = settings.GEMINI_API_KEY
+NUMPY_INDEX_PATH = "data/vectors"
+EMBEDDING_MODEL = provider_class().model
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+VECTOR_DTYPE = "int8" if settings.VECTOR_QUANTIZE_INT8 else "float16"
+# stored chunks are only reusable while all of these stay the same
+INDEX_VERSION = f"per-user/{EMBEDDING_MODEL}/{CHUNK_SIZE}/{CHUNK_OVERLAP}"
+if settings.VECTOR_BACKEND == "numpy":
+    INDEX_VERSION += f"/numpy-{VECTOR_DTYPE}"
+
+
+def chunk_id(doc_id: str, index: int) -> str:
+    return f"{doc_id}:{index}"
+
+
+# the single collection every user's chunks shared before stores were split per user
+LEGACY_COLLECTION = "langchain"
+# per-user collections created before the model was recorded were all built with Gemini
+LEGACY_EMBEDDING = {"embedding_model": GeminiEmbeddingProvider.model,
+                    "embedding_dimension": GeminiEmbeddingProvider.dimension}
+
+
+def collection_name(user_id: str) -> str:
+    # Chroma names allow only [a-zA-Z0-9._-] and at most 63 characters
+    return "mail_" + hashlib.sha256(user_id.encode()).hexdigest()[:40]
+
 
 class RAGSystem:
     def __init__(self):
-        print("Initializing RAG system with Chroma + Gemini embeddings...")
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/embedding-001",
-            google_api_key=GEMINI_API_KEY,
-        )
+        self.embeddings = get_embeddings()
+        self.backend = settings.VECTOR_BACKEND
+        if self.backend not in ("chroma", "numpy"):
+            raise ValueError(f"Unknown vector backend {self.backend!r}; expected chroma or numpy")
+        print(f"Initializing RAG system with {self.backend} + {self.embeddings.provider.model} embeddings...")
 
         self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
             length_function=len
         )
 
+        self._stores: "OrderedDict[str, ChromaStore | NumpyStore]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.rebuilt_stores = 0
+        if self.backend == "chroma":
+            self._init_chroma()
+
+    def _init_chroma(self):
         try:
-            self.vectorstore = Chroma(
-                persist_directory=CHROMA_DB_PATH,
-                embedding_function=self.embeddings
+            self.client = chromadb.PersistentClient(
+                path=CHROMA_DB_PATH, settings=ChromaSettings(anonymized_telemetry=False)
             )
-            if not hasattr(self.vectorstore, "_collection"):
-                raise Exception("Chroma collection not initialized properly")
         except Exception as e:
             print(f"Failed to initialize Chroma: {str(e)}")
             raise
 
-    def add_document(self, doc_id: str, text: str, metadata: dict = None) -> int:
-        """Split, embed and add one document (email)."""
-        self.delete_document(doc_id, silent=True)
-        chunks = self.text_splitter.split_text(text)
-        documents = [
+    def drop_legacy_collection(self) -> bool:
+        """Delete the collection all users shared before stores were split per user.
+
+        Nothing reads it any more; its chunks are re-embedded into the
+        per-user stores by the next index run of each mailbox.
+        """
+        if self.backend != "chroma":
+            return False
+        try:
+            self.client.delete_collection(LEGACY_COLLECTION)
+        except Exception:
+            return False
+        return True
+
+    def _embedding_metadata(self) -> Dict:
+        metadata = {"embedding_model": self.embeddings.provider.model,
+                    "embedding_dimension": self.embeddings.provider.dimension}
+        if self.backend == "numpy":
+            metadata["vector_dtype"] = VECTOR_DTYPE
+        return metadata
+
+    def _new_store(self, user_id: str):
+        metadata = {"user_id": user_id, **self._embedding_metadata()}
+        if self.backend == "numpy":
+            return NumpyStore(os.path.join(NUMPY_INDEX_PATH, collection_name(user_id)), metadata,
+                              quantize=settings.VECTOR_QUANTIZE_INT8)
+        return ChromaStore(self.client, collection_name(user_id), metadata)
+
+    def _built_with(self, store) -> Dict:
+        metadata = store.embedding_metadata()
+        return {key: metadata.get(key, LEGACY_EMBEDDING.get(key)) for key in self._embedding_metadata()}
+
+    def needs_reindex(self, user_id: str) -> bool:
+        """Whether the user's store was built with another embedding model, dimension or dtype."""
+        return self._built_with(self.store(user_id)) != self._embedding_metadata()
+
+    def rebuild_if_stale(self, user_id: str) -> bool:
+        """Drop and recreate the user's store empty if it needs a reindex; True if it did.
+
+        Only index runs call this, right before refilling the store.
+        """
+        with self._lock:
+            store = self._stores.pop(user_id, None) or self._new_store(user_id)
+            found, expected = self._built_with(store), self._embedding_metadata()
+            if found != expected:
+                print(f"Rebuilding vector store of user {user_id}: built with {found}, configured {expected}")
+                store.drop()
+                self.rebuilt_stores += 1
+                store = self._new_store(user_id)
+            self._stores[user_id] = store
+            while len(self._stores) > settings.RAG_MAX_OPEN_STORES:
+                self._stores.popitem(last=False)
+            return found != expected
+
+    def store(self, user_id: str):
+        """The user's own vector store, created on first use.
+
+        Each user's chunks live in a separate Chroma collection or NumPy
+        index (``VECTOR_BACKEND``), so a search only
+        walks that user's index. At most ``RAG_MAX_OPEN_STORES`` handles are
+        kept; older ones are dropped and reopened when the user returns.
+        This bounds handles only: Chroma sizes its own cache of loaded HNSW
+        indexes (from the open-file limit) and offers no way to unload one.
+        A store built with a different embedding model or dimension than
+        the configured one is opened as it is: searches return nothing
+        until an index run rebuilds it (``rebuild_if_stale``).
+        """
+        with self._lock:
+            store = self._stores.get(user_id)
+            if store is not None:
+                self._stores.move_to_end(user_id)
+                return store
+            store = self._new_store(user_id)
+            self._stores[user_id] = store
+            while len(self._stores) > settings.RAG_MAX_OPEN_STORES:
+                self._stores.popitem(last=False)
+            return store
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stores = {"backend": self.backend, "open_stores": len(self._stores),
+                      "rebuilt_stores": self.rebuilt_stores}
+        return {**stores, "embeddings": self.embeddings.stats()}
+
+    def split_document(self, doc_id: str, text: str, metadata: dict = None) -> List[Document]:
+        """Split one document (email) into chunks, without embedding them."""
+        created_at = datetime.utcnow().isoformat()
+        return [
             Document(
                 page_content=chunk,
                 metadata={
                     "doc_id": doc_id,
                     "chunk_index": i,
-                    "created_at": datetime.utcnow().isoformat(),
+                    "created_at": created_at,
                     **(metadata or {})
                 }
-            ) for i, chunk in enumerate(chunks)
+            ) for i, chunk in enumerate(self.text_splitter.split_text(text))
         ]
-        if documents:
-            self.vectorstore.add_documents(documents)
-            return len(documents)
-        return 0
 
-    def delete_document(self, doc_id: str, silent: bool = False) -> int:
+    def upsert_chunks(self, user_id: str, documents: List[Document], stale: List[str] = ()) -> int:
+        """Embed chunks of any number of documents in one batch and upsert them.
+
+        Chunk ids are derived from ``doc_id`` and ``chunk_index``, so
+        re-indexing a document overwrites its chunks in place. ``stale``
+        chunk ids are deleted in the same write.
+        """
+        if not documents:
+            if stale:
+                self.store(user_id).delete(list(stale))
+            return 0
+        texts = [d.page_content for d in documents]
+        self.store(user_id).upsert(
+            [chunk_id(d.metadata["doc_id"], d.metadata["chunk_index"]) for d in documents],
+            self.embeddings.embed_documents(texts),
+            texts,
+            [d.metadata for d in documents],
+            stale,
+        )
+        return len(documents)
+
+    def delete_chunks(self, user_id: str, doc_id: str, start: int, end: int):
+        """Delete chunks ``start``..``end - 1`` left over after a document got shorter."""
+        if end > start:
+            self.store(user_id).delete([chunk_id(doc_id, i) for i in range(start, end)])
+
+    def delete_documents(self, user_id: str, doc_ids: List[str]):
+        """Delete every chunk of the given documents, whatever their ids."""
+        if doc_ids:
+            self.store(user_id).delete_docs(doc_ids)
+
+    def add_document(self, user_id: str, doc_id: str, text: str, metadata: dict = None) -> int:
+        """Split, embed and add one document (email)."""
+        self.delete_document(user_id, doc_id, silent=True)
+        return self.upsert_chunks(user_id, self.split_document(doc_id, text, metadata))
+
+    def delete_document(self, user_id: str, doc_id: str, silent: bool = False) -> int:
         """Delete all chunks for a given doc_id (email)."""
-        collection = self.vectorstore._collection
-        existing = collection.get(where={"doc_id": doc_id})
-        if existing and existing.get("ids"):
-            collection.delete(where={"doc_id": doc_id})
-            return len(existing["ids"])
-        elif not silent:
+        removed = self.store(user_id).delete_docs([doc_id])
+        if not removed and not silent:
             print(f"No chunks found for document {doc_id}")
-        return 0
+        return removed
 
-    def search(self, query: str, n_results: int = 5, doc_id: str = None) -> List[Dict]:
-        """Vector similarity search with optional filtering by doc_id."""
+    def search(self, user_id: str, query: str, n_results: int = 5, doc_id: str = None) -> List[Dict]:
+        """Vector similarity search over one user's mail, optionally within one doc_id."""
         try:
-            filters = {"doc_id": doc_id} if doc_id else None
-            results = self.vectorstore.similarity_search_with_score(
-                query=query,
-                k=n_results,
-                filter=filters
-            )
+            if self.needs_reindex(user_id):
+                # vectors of another model can't be compared with this one's
+                return []
+            matches = self.store(user_id).query(self.embeddings.embed_query(query), n_results, doc_id)
             return [
                 {
-                    "content": doc.page_content,
+                    "content": text,
                     "score": float(score),
-                    "metadata": doc.metadata
+                    "metadata": metadata
                 }
-                for doc, score in results
+                for text, score, metadata in matches
             ]
         except Exception as e:
             print(f"Search error: {str(e)}")
             return []
 
     def get_relevant_content(
-        self, query: str, max_tokens: int = 120000, doc_id: Optional[str] = None
+        self, user_id: str, query: str, max_tokens: int = 120000, doc_id: Optional[str] = None
     ) -> List[Dict]:
         """Get chunks relevant to a query without exceeding token budget."""
         try:
@@ -98,7 +241,7 @@ class RAGSystem:
             n_results = 20
 
             if doc_id:
-                results = self.search(query, n_results=n_results, doc_id=doc_id)
+                results = self.search(user_id, query, n_results=n_results, doc_id=doc_id)
                 for result in results:
                     content = result["content"]
                     estimated_tokens = len(content.split()) * 1.33
@@ -110,7 +253,7 @@ class RAGSystem:
 
             remaining_tokens = max_tokens - token_count
             if remaining_tokens > 10000:
-                results = self.search(query, n_results=n_results)
+                results = self.search(user_id, query, n_results=n_results)
                 for result in results:
                     if doc_id and result["metadata"].get("doc_id") == doc_id:
                         continue
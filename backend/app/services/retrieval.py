@@ -0,0 +1,117 @@
+import asyncio
+from typing import Any, Dict, List
+
+from app.core.mongo import emails_collection
+from app.services.lexical_index import lexical_indexes
+from app.services.llm_client import answer_search, rag
+from app.services.rag_system import CHUNK_SIZE
+from app.services.text_cleaning import TEXT_FIELDS, email_text
+
+SEARCH_MODES = ("hybrid", "vector", "lexical")
+# reciprocal rank fusion constant; dampens the weight of the very top ranks
+RRF_K = 60
+
+
+def _depth(top_k: int) -> int:
+    """Candidates taken from each retriever before fusing."""
+    return max(top_k * 4, 20)
+
+
+async def _vector(user_id: str, query: str, k: int) -> List[Dict[str, Any]]:
+    chunks = await asyncio.to_thread(rag.search, user_id, query, n_results=k)
+    # several chunks of one email compete for the same slot; keep the best
+    best: Dict[str, Dict[str, Any]] = {}
+    for chunk in chunks:
+        best.setdefault(chunk["metadata"].get("email_id"), chunk)
+    return list(best.values())
+
+
+async def _lexical(user_id: str, query: str, k: int) -> List[Dict[str, Any]]:
+    hits = await lexical_indexes.search(user_id, query, k)
+    return [
+        {"content": None, "score": score,
+         "metadata": {"email_id": email_id, **meta, "date": str(meta.get("date"))}}
+        for email_id, score, meta in hits
+    ]
+
+
+async def _fill_content(user_id: str, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Add excerpts to lexical hits, dropping emails deleted since they were indexed."""
+    missing = [r["metadata"]["email_id"] for r in results if r["content"] is None]
+    if not missing:
+        return results
+    cursor = emails_collection.find({"user_id": user_id, "id": {"$in": missing}}, projection={**TEXT_FIELDS, "id": 1})
+    texts = {e["id"]: email_text(e)[:CHUNK_SIZE] async for e in cursor}
+    filled = []
+    for r in results:
+        if r["content"] is None:
+            if r["metadata"]["email_id"] not in texts:
+                continue
+            r = {**r, "content": texts[r["metadata"]["email_id"]]}
+        filled.append(r)
+    return filled
+
+
+def fuse(*rankings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Reciprocal rank fusion of result lists, best first; ``score`` becomes the fused score."""
+    scores: Dict[str, float] = {}
+    results: Dict[str, Dict[str, Any]] = {}
+    for ranking in rankings:
+        for rank, r in enumerate(ranking):
+            email_id = r["metadata"].get("email_id")
+            scores[email_id] = scores.get(email_id, 0.0) + 1 / (RRF_K + rank + 1)
+            # vector hits carry the matching chunk, so they win over a lexical excerpt
+            if email_id not in results or results[email_id]["content"] is None:
+                results[email_id] = r
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [{**results[email_id], "score": scores[email_id]} for email_id in ranked]
+
+
+async def retrieve(user_id: str, query: str, top_k: int = 5, mode: str = "hybrid") -> List[Dict[str, Any]]:
+    """The ``top_k`` emails of ``user_id`` most relevant to ``query``.
+
+    ``lexical`` ranks by BM25 over subject, sender and body and needs no
+    embedding call; ``vector`` is the Chroma similarity search; ``hybrid``
+    runs both concurrently and fuses them by reciprocal rank.
+    """
+    if mode == "lexical":
+        results = await _lexical(user_id, query, top_k)
+    elif mode == "vector":
+        results = await _vector(user_id, query, top_k)
+    else:
+        depth = _depth(top_k)
+        vector, lexical = await asyncio.gather(_vector(user_id, query, depth), _lexical(user_id, query, depth))
+        results = fuse(vector, lexical)[:top_k]
+    return await _fill_content(user_id, results)
+
+
+def _raw_matches(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "email_id": r["metadata"].get("email_id"),
+            "thread_id": r["metadata"].get("thread_id"),
+            "subject": r["metadata"].get("subject"),
+            "sender": r["metadata"].get("sender"),
+            "date": r["metadata"].get("date"),
+            "excerpt": r["content"][:200],
+            "score": r["score"]
+        } for r in results
+    ]
+
+
+async def semantic_search(user_id: str, query: str, top_k: int = 5, mode: str = "hybrid",
+                          answer: bool = True) -> Dict[str, Any]:
+    results = await retrieve(user_id, query, top_k, mode)
+    # a store built with another embedding model is left out until the mailbox is re-indexed
+    needs_reindex = mode != "lexical" and await asyncio.to_thread(rag.needs_reindex, user_id)
+    if not results:
+        return {
+            "answer": "No relevant results found.",
+            "sources": [],
+            "raw_matches": [],
+            "needs_reindex": needs_reindex
+        }
+    if not answer:
+        return {"answer": None, "sources": [], "raw_matches": _raw_matches(results), "needs_reindex": needs_reindex}
+    return {**await answer_search(query, results), "raw_matches": _raw_matches(results),
+            "needs_reindex": needs_reindex}
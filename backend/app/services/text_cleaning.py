@@ -0,0 +1,237 @@
+"""Compact model-ready text for emails, computed once at ingest.
+
+``clean_email_body`` turns HTML into text, drops quoted reply history and
+signatures, shortens long links and collapses whitespace. ``parse_email``
+stores the result as ``clean_text`` (with ``clean_tokens``); consumers read
+it through ``email_text`` so documents ingested before this stage still work.
+
+Run ``python -m app.services.text_cleaning [user_id]`` to backfill
+documents cleaned by an older ``CLEAN_VERSION`` (or never cleaned).
+"""
+import asyncio
+import json
+import re
+import sys
+from html import unescape
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from pymongo import UpdateOne
+
+from app.core.bulk_writer import BulkWriter
+from app.core.mongo import emails_collection
+
+# bump whenever the cleaning rules change so the backfill re-cleans stored emails
+CLEAN_VERSION = 1
+
+# ~4 characters per token is close enough for English email text
+CHARS_PER_TOKEN = 4
+
+# projection for consumers that read email text: clean_text, plus the raw fields
+# ``email_text`` falls back to for documents that have not been backfilled yet
+TEXT_FIELDS = {"clean_text": 1, "body": 1, "snippet": 1}
+
+_BLOCK_TAGS = {"p", "div", "br", "tr", "li", "ul", "ol", "table", "blockquote",
+               "h1", "h2", "h3", "h4", "h5", "h6", "hr", "section", "article"}
+_SKIP_TAGS = {"script", "style", "head", "title", "noscript"}
+
+# the first line of quoted history; everything from here on is dropped
+_WROTE_HEADERS = [
+    re.compile(r"^On .{0,300}wrote:$", re.IGNORECASE),
+    re.compile(r"^Le .{0,300}a écrit ?:$", re.IGNORECASE),
+    re.compile(r"^Am .{0,300}schrieb .{0,200}:$", re.IGNORECASE),
+]
+_QUOTE_HEADERS = _WROTE_HEADERS + [
+    re.compile(r"^-{2,} ?(Original|Forwarded) Message ?-{2,}", re.IGNORECASE),
+    re.compile(r"^_{10,}$"),
+]
+_OUTLOOK_HEADER = re.compile(r"^From: .+\n(Sent|Date): ", re.IGNORECASE)
+_SIGNATURE_MARKERS = [
+    re.compile(r"^--\s*$"),
+    re.compile(r"^(Sent from my|Sent from Mail for|Get Outlook for)\b", re.IGNORECASE),
+]
+_URL_RE = re.compile(r"https?://[^\s<>()\"']+")
+_LONG_URL_CHARS = 60
+_INVISIBLE_RE = re.compile(r"[​‌‍⁠﻿­]")
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skipping += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+
+
+def html_to_text(html: str) -> str:
+    parser = _TextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        # malformed markup: fall back to dropping the tags
+        return unescape(re.sub(r"<[^>]+>", " ", html))
+    return "".join(parser.parts)
+
+
+def _shorten_url(match: re.Match) -> str:
+    url = match.group(0)
+    if len(url) <= _LONG_URL_CHARS:
+        return url
+    # tracking links carry no meaning past their host
+    return f"[link: {urlsplit(url).netloc}]"
+
+
+def _starts_quote(line: str, next_line: str) -> bool:
+    if any(p.match(line) for p in _QUOTE_HEADERS):
+        return True
+    # "On <date>, <name> wrote:" is often wrapped over two lines
+    if next_line and any(p.match(f"{line} {next_line}") for p in _WROTE_HEADERS):
+        return True
+    return bool(_OUTLOOK_HEADER.match(f"{line}\n{next_line}"))
+
+
+def strip_quoted(text: str) -> str:
+    lines = [line.strip() for line in text.split("\n")]
+    kept: List[str] = []
+    for i, line in enumerate(lines):
+        if _starts_quote(line, lines[i + 1] if i + 1 < len(lines) else ""):
+            break
+        if not line.startswith(">"):
+            kept.append(line)
+    return "\n".join(kept)
+
+
+def strip_signature(text: str) -> str:
+    lines = text.split("\n")
+    for i, line in enumerate(lines):
+        if i > 0 and any(p.match(line.strip()) for p in _SIGNATURE_MARKERS):
+            return "\n".join(lines[:i])
+    return text
+
+
+def collapse_whitespace(text: str) -> str:
+    text = _INVISIBLE_RE.sub("", text.replace("\r\n", "\n").replace("\r", "\n").replace("\xa0", " "))
+    lines = [re.sub(r"[ \t\f\v]+", " ", line).strip() for line in text.split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    return text if len(text) <= max_chars else text[:max_chars] + " ..."
+
+
+def chunk_text(text: str, max_tokens: int) -> List[str]:
+    """Split ``text`` into pieces of at most ``max_tokens``, breaking on paragraphs,
+    then lines, then words."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    pieces: List[str] = []
+    for paragraph in text.split("\n\n"):
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        for line in paragraph.split("\n"):
+            while len(line) > max_chars:
+                cut = line.rfind(" ", 0, max_chars)
+                cut = cut if cut > max_chars // 2 else max_chars
+                pieces.append(line[:cut])
+                line = line[cut:].lstrip()
+            pieces.append(line)
+
+    chunks: List[str] = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + 2 + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current}\n\n{piece}" if current else piece
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+
+def clean_email_body(plain: str = "", html: str = "", snippet: str = "") -> str:
+    """Model-ready text of an email: its own words, without markup, quotes or signature."""
+    if plain and plain.strip():
+        text = plain
+    elif html and html.strip():
+        text = html_to_text(html)
+    else:
+        text = snippet or ""
+
+    text = collapse_whitespace(_URL_RE.sub(_shorten_url, text))
+    cleaned = collapse_whitespace(strip_signature(strip_quoted(text)))
+    # a message that is nothing but a forward/quote keeps its text rather than becoming empty
+    return cleaned or text
+
+
+def clean_fields(plain: str = "", html: str = "", snippet: str = "") -> Dict[str, Any]:
+    """The fields ``parse_email`` stores alongside the raw body."""
+    clean_text = clean_email_body(plain, html, snippet)
+    return {"clean_text": clean_text, "clean_tokens": estimate_tokens(clean_text),
+            "clean_version": CLEAN_VERSION}
+
+
+def email_text(email: Dict[str, Any]) -> str:
+    """The text to send to a model for ``email``, cleaning it on the fly if ingest didn't."""
+    if email.get("clean_text") is not None:
+        return email["clean_text"]
+    body = email.get("body") or ""
+    if "<" in body and ">" in body and re.search(r"</?[a-zA-Z][^>]*>", body):
+        return clean_email_body(html=body, snippet=email.get("snippet", ""))
+    return clean_email_body(plain=body, snippet=email.get("snippet", ""))
+
+
+async def backfill_clean_text(user_id: Optional[str] = None) -> Dict[str, int]:
+    """Compute ``clean_text`` for stored emails that lack it or were cleaned by an older version."""
+    query: Dict[str, Any] = {"clean_version": {"$ne": CLEAN_VERSION}}
+    if user_id:
+        query["user_id"] = user_id
+
+    cleaned = tokens_before = tokens_after = 0
+    cursor = emails_collection.find(
+        query, projection={"id": 1, "user_id": 1, "body": 1, "plain_body": 1, "html_body": 1, "snippet": 1}
+    )
+    async with BulkWriter(emails_collection) as writer:
+        async for email in cursor:
+            if email.get("plain_body") or email.get("html_body"):
+                fields = clean_fields(email.get("plain_body") or "", email.get("html_body") or "",
+                                      email.get("snippet") or "")
+            else:
+                # older documents only kept the merged body
+                clean_text = email_text({"body": email.get("body"), "snippet": email.get("snippet")})
+                fields = {"clean_text": clean_text, "clean_tokens": estimate_tokens(clean_text),
+                          "clean_version": CLEAN_VERSION}
+            await writer.add(UpdateOne({"_id": email["_id"]}, {"$set": fields}))
+            cleaned += 1
+            tokens_before += estimate_tokens(email.get("body") or email.get("snippet") or "")
+            tokens_after += fields["clean_tokens"]
+
+    return {"cleaned": cleaned, "tokens_before": tokens_before, "tokens_after": tokens_after,
+            "write_failures": writer.totals["failed"]}
+
+
+if __name__ == "__main__":
+    report = asyncio.run(backfill_clean_text(sys.argv[1] if len(sys.argv) > 1 else None))
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,97 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.mongo import emails_collection, thread_summaries_collection
+from app.core.single_flight import SingleFlight
+from app.services.llm_client import summarize_text, update_summary, PROMPT_VERSIONS
+from app.services.text_cleaning import TEXT_FIELDS, email_text, estimate_tokens
+
+SUMMARY_VERSION = f"{PROMPT_VERSIONS['summarize']}.{PROMPT_VERSIONS['summarize_update']}"
+MESSAGE_PROJECTION = {**TEXT_FIELDS, "id": 1, "sender": 1, "subject": 1, "date": 1}
+
+_refreshes = SingleFlight()
+
+
+def _format(messages: List[Dict[str, Any]]) -> str:
+    return "\n\n".join(
+        f"From: {e.get('sender', '')}\nSubject: {e.get('subject', '')}\n{email_text(e)}" for e in messages
+    )
+
+
+async def _messages(user_id: str, thread_id: str, ids: List[str]) -> List[Dict[str, Any]]:
+    cursor = emails_collection.find(
+        {"user_id": user_id, "thread_id": thread_id, "id": {"$in": ids}},
+        projection=MESSAGE_PROJECTION,
+    ).sort("date", 1)
+    return await cursor.to_list(length=None)
+
+
+async def _save(user_id: str, thread_id: str, mode: str, summary: str,
+                thread: List[Dict[str, Any]], covered: List[str], folds: int) -> Dict[str, Any]:
+    doc = {
+        "user_id": user_id,
+        "thread_id": thread_id,
+        "mode": mode,
+        "summary": summary,
+        "version": SUMMARY_VERSION,
+        "message_ids": covered,
+        "message_count": len(thread),
+        "last_message_date": thread[-1]["date"],
+        "folds": folds,
+        "updated_at": datetime.utcnow(),
+    }
+    await thread_summaries_collection.replace_one(
+        {"user_id": user_id, "thread_id": thread_id, "mode": mode}, doc, upsert=True
+    )
+    return doc
+
+
+async def _refresh(user_id: str, thread_id: str, mode: str) -> Optional[Dict[str, Any]]:
+    thread = await emails_collection.find(
+        {"user_id": user_id, "thread_id": thread_id}, projection={"id": 1, "date": 1}
+    ).sort("date", 1).to_list(length=None)
+    if not thread:
+        return None
+    ids = [e["id"] for e in thread]
+
+    stored = await thread_summaries_collection.find_one(
+        {"user_id": user_id, "thread_id": thread_id, "mode": mode}
+    )
+    if stored and stored.get("version") == SUMMARY_VERSION:
+        covered = set(stored["message_ids"])
+        new_ids = [i for i in ids if i not in covered]
+        if not new_ids and covered.issubset(ids):
+            return {**stored, "status": "cached"}
+
+        # a covered message that was deleted can only be dropped by starting over
+        if new_ids and covered.issubset(ids):
+            new = await _messages(user_id, thread_id, new_ids[-settings.THREAD_SUMMARY_MAX_MESSAGES:])
+            summary = await update_summary(stored["summary"], _format(new), mode)
+            if estimate_tokens(summary) <= settings.THREAD_SUMMARY_MAX_TOKENS:
+                doc = await _save(user_id, thread_id, mode, summary, thread,
+                                  stored["message_ids"] + new_ids, stored.get("folds", 0) + 1)
+                return {**doc, "status": "incremental"}
+
+    # long threads are summarized from their latest messages
+    messages = await _messages(user_id, thread_id, ids[-settings.THREAD_SUMMARY_MAX_MESSAGES:])
+    summary = await summarize_text(_format(messages), mode)
+    doc = await _save(user_id, thread_id, mode, summary, thread, ids, 0)
+    return {**doc, "status": "full"}
+
+
+async def summarize_thread(user_id: str, thread_id: str, mode: str = "short") -> Optional[Dict[str, Any]]:
+    """The thread's summary, brought up to date with any messages it does not cover yet.
+
+    Each summary records the message ids it covers. New replies are
+    summarized on their own and folded into the stored summary; the thread
+    is re-summarized from its messages only when the folded summary grows
+    past ``THREAD_SUMMARY_MAX_TOKENS``, a covered message disappears, or the
+    prompts change. The returned ``status`` is ``cached``, ``incremental``
+    or ``full``. Returns None for an unknown thread.
+    """
+    return await _refreshes.do(
+        f"{user_id}:{thread_id}:{mode}",
+        lambda: _refresh(user_id, thread_id, mode),
+        group="thread_summary",
+    )
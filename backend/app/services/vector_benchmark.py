@@ -0,0 +1,156 @@
+"""Compare the vector store backends on a synthetic mailbox.
+
+Builds each backend from the same clustered unit vectors and ~1000
+character chunk texts (no embedding calls), then reports recall@k against
+exact float32 search, query latency, resident memory growth and disk
+footprint. Each backend is built in one process and queried from a fresh
+one, so nothing the build left cached (Chroma keeps a client per path)
+counts towards the query side's RSS.
+
+    python -m app.services.vector_benchmark [--chunks 5000] [--dim 768] [--queries 200] [--k 10]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from typing import Any, Dict
+
+import numpy as np
+
+from app.services.vector_stores import ChromaStore, NumpyStore
+
+BACKENDS = ("chroma", "numpy-float16", "numpy-int8")
+# the indexer's default RAG_EMBED_BATCH_SIZE
+BATCH = 256
+# ~1000 characters, the indexer's CHUNK_SIZE
+TEXT_WORDS = 130
+
+
+def _rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _disk_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def _data(chunks: int, dim: int, queries: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    # mail is clustered (threads, newsletters, senders), so are its embeddings
+    centers = rng.normal(size=(max(1, chunks // 20), dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), chunks)] + 0.5 * rng.normal(size=(chunks, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    picks = vectors[rng.integers(0, chunks, queries)]
+    probes = picks + 0.3 * rng.normal(size=picks.shape).astype(np.float32)
+    probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+    return vectors, probes
+
+
+def _texts(chunks: int, seed: int = 0):
+    # about CHUNK_SIZE characters each, like the indexer's chunks; the leading number identifies the chunk
+    rng = np.random.default_rng(seed)
+    words = [f"word{i}" for i in range(2000)]
+    return [f"chunk {i} " + " ".join(rng.choice(words, TEXT_WORDS)) for i in range(chunks)]
+
+
+def _open(backend: str, path: str):
+    metadata = {"embedding_model": "benchmark", "embedding_dimension": 0}
+    if backend == "chroma":
+        import chromadb
+        from chromadb.config import Settings as ChromaSettings
+
+        client = chromadb.PersistentClient(path=path, settings=ChromaSettings(anonymized_telemetry=False))
+        return ChromaStore(client, "benchmark", metadata)
+    return NumpyStore(path, metadata, quantize=backend == "numpy-int8")
+
+
+def _build(backend: str, path: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    vectors, _ = _data(args["chunks"], args["dim"], args["queries"])
+    ids = [f"email{i // 4}:{i % 4}" for i in range(len(vectors))]
+    metadatas = [{"doc_id": f"email{i // 4}", "chunk_index": i % 4} for i in range(len(vectors))]
+    texts = _texts(len(vectors))
+
+    start = time.perf_counter()
+    store = _open(backend, path)
+    for i in range(0, len(vectors), BATCH):
+        store.upsert(ids[i:i + BATCH], vectors[i:i + BATCH].tolist(), texts[i:i + BATCH], metadatas[i:i + BATCH])
+    return {"build_seconds": round(time.perf_counter() - start, 2), "disk_mb": round(_disk_bytes(path) / 2 ** 20, 2)}
+
+
+def _serve(backend: str, path: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    """Open the store cold, as a fresh process serving a returning user would, and query it."""
+    vectors, probes = _data(args["chunks"], args["dim"], args["queries"])
+    k = args["k"]
+    truth = np.argsort(-(probes @ vectors.T), axis=1)[:, :k]
+    del vectors
+    if backend == "chroma":
+        # the library itself is loaded once per process, not per store
+        import chromadb  # noqa: F401
+
+    rss_before = _rss_bytes()
+    start = time.perf_counter()
+    store = _open(backend, path)
+    open_ms = (time.perf_counter() - start) * 1000
+    latencies, hits = [], 0
+    for probe, expected in zip(probes, truth):
+        start = time.perf_counter()
+        matches = store.query(probe.tolist(), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found = {int(text.split()[1]) for text, _, _ in matches}
+        hits += len(found & set(expected.tolist()))
+    rss_after = _rss_bytes()
+
+    return {
+        "recall_at_k": round(hits / (k * len(probes)), 4),
+        "open_ms": round(open_ms, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "rss_growth_mb": round((rss_after - rss_before) / 2 ** 20, 1),
+    }
+
+
+def _worker(step, backend: str, path: str, args: Dict[str, Any], results):
+    try:
+        results.put(step(backend, path, args))
+    except Exception as e:
+        results.put({"error": str(e)})
+
+
+def _in_process(context, step, backend: str, path: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    results = context.Queue()
+    process = context.Process(target=_worker, args=(step, backend, path, args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    args = vars(parser.parse_args())
+    backends = args.pop("backends")
+
+    context = multiprocessing.get_context("spawn")
+    report = []
+    for backend in backends:
+        # built and served by separate processes, so the query side starts with nothing cached
+        with tempfile.TemporaryDirectory() as path:
+            result = {"backend": backend, **_in_process(context, _build, backend, path, args)}
+            if "error" not in result:
+                result.update(_in_process(context, _serve, backend, path, args))
+        report.append(result)
+        print(json.dumps(result))
+
+    print(json.dumps({"config": args, "results": report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
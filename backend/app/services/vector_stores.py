@@ -0,0 +1,415 @@
+"""Per-user vector stores behind ``RAGSystem``.
+
+Both backends store unit-length embeddings of one user's chunks and
+answer ``query`` with ``(text, distance, metadata)`` triples, lowest
+distance first:
+
+* ``ChromaStore``: a Chroma collection with its persistent HNSW index.
+* ``NumpyStore``: an exact index, i.e. a few float16 (or int8 with
+  per-row scales) matrices memory-mapped from disk, searched with
+  matrix-vector products. It is smaller on disk than HNSW and never
+  misses a match.
+
+Distances are cosine distances (``1 - cosine similarity``) in both.
+"""
+import glob
+import json
+import os
+import shutil
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+Match = Tuple[str, float, Dict[str, Any]]
+# rows upcast to float32 at a time when scoring a query; NumPy has no float16 or int8 BLAS
+QUERY_BLOCK_ROWS = 4096
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+class ChromaStore:
+    def __init__(self, client, name: str, metadata: Dict[str, Any]):
+        self.client = client
+        self.name = name
+        # the metadata only applies when the collection is new; an existing one keeps its own
+        self.collection = client.get_or_create_collection(name, metadata={**metadata, "hnsw:space": "cosine"})
+        # collections created before the space was set use Chroma's default,
+        # squared L2, which is twice the cosine distance for unit vectors
+        self._l2 = (self.collection.metadata or {}).get("hnsw:space", "l2") == "l2"
+
+    def embedding_metadata(self) -> Dict[str, Any]:
+        return self.collection.metadata or {}
+
+    def drop(self):
+        self.client.delete_collection(self.name)
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], texts: List[str], metadatas: List[Dict],
+               stale: List[str] = ()):
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=texts, metadatas=metadatas)
+        if stale:
+            self.collection.delete(ids=list(stale))
+
+    def delete(self, ids: List[str]):
+        self.collection.delete(ids=ids)
+
+    def delete_docs(self, doc_ids: List[str]) -> int:
+        existing = self.collection.get(where={"doc_id": {"$in": doc_ids}}, include=[])
+        if existing["ids"]:
+            self.collection.delete(ids=existing["ids"])
+        return len(existing["ids"])
+
+    def query(self, vector: List[float], k: int, doc_id: Optional[str] = None) -> List[Match]:
+        result = self.collection.query(
+            query_embeddings=[vector],
+            n_results=k,
+            where={"doc_id": doc_id} if doc_id else None,
+            include=["documents", "metadatas", "distances"],
+        )
+        distances = result["distances"][0]
+        if self._l2:
+            distances = [d / 2 for d in distances]
+        return list(zip(result["documents"][0], distances, result["metadatas"][0]))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"chunks": self.collection.count()}
+
+
+# one lock per store directory: an evicted NumpyStore may still be writing
+# while a new instance for the same user opens the same files
+_directory_locks: Dict[str, threading.Lock] = {}
+_directory_locks_guard = threading.Lock()
+
+
+def _directory_lock(directory: str) -> threading.Lock:
+    with _directory_locks_guard:
+        return _directory_locks.setdefault(os.path.abspath(directory), threading.Lock())
+
+
+def _block_scores(vectors: np.ndarray, scales: Optional[np.ndarray], q: np.ndarray) -> np.ndarray:
+    scores = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), QUERY_BLOCK_ROWS):
+        block = vectors[start:start + QUERY_BLOCK_ROWS]
+        scores[start:start + len(block)] = block.astype(np.float32) @ q
+    return scores if scales is None else scores * scales
+
+
+class _Segment:
+    """The rows added by one write, as ``seg-<seq>.*`` files.
+
+    Vectors (and scales) are ``.npy`` matrices and the texts one UTF-8
+    blob with row offsets, both memory-mapped; only the ids and metadata
+    columns (``.json``) are read into memory.
+    """
+
+    def __init__(self, directory: str, seq: int):
+        self.seq = seq
+        prefix = os.path.join(directory, f"seg-{seq}")
+        self.vectors = np.load(prefix + ".npy", mmap_mode="r")
+        self.scales = np.load(prefix + ".scales.npy") if self.vectors.dtype == np.int8 else None
+        self._offsets = np.load(prefix + ".offsets.npy")
+        self._texts = np.memmap(prefix + ".txt", dtype=np.uint8, mode="r") if self._offsets[-1] else None
+        with open(prefix + ".json") as f:
+            self.columns: Dict[str, List] = json.load(f)
+        self.doc_ids = np.asarray(self.columns.get("doc_id", [None] * len(self)), dtype=object)
+
+    def __len__(self):
+        return len(self.columns["id"])
+
+    def text(self, row: int) -> str:
+        start, end = self._offsets[row], self._offsets[row + 1]
+        return bytes(self._texts[start:end]).decode("utf-8") if end > start else ""
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        return {key: values[row] for key, values in self.columns.items()
+                if key != "id" and values[row] is not None}
+
+    def decoded(self, rows: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        return vectors if self.scales is None else vectors * self.scales[rows, None]
+
+    @staticmethod
+    def write(directory: str, seq: int, vectors: np.ndarray, scales: Optional[np.ndarray],
+              texts: List[str], columns: Dict[str, List]):
+        prefix = os.path.join(directory, f"seg-{seq}")
+        np.save(prefix + ".npy", vectors)
+        if scales is not None:
+            np.save(prefix + ".scales.npy", scales)
+        encoded = [text.encode("utf-8") for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        np.save(prefix + ".offsets.npy", offsets)
+        with open(prefix + ".txt", "wb") as f:
+            f.write(b"".join(encoded))
+        with open(prefix + ".json", "w") as f:
+            json.dump(columns, f)
+
+    @staticmethod
+    def remove(directory: str, seq: int):
+        for path in glob.glob(os.path.join(directory, f"seg-{seq}.*")):
+            os.remove(path)
+
+
+class NumpyStore:
+    """Exact cosine-distance index of one user's chunks.
+
+    Each ``upsert`` appends its rows as a new ``_Segment`` and only
+    rewrites ``meta.json`` (the embedding model, the segment list and
+    tombstones), so a write costs the size of its batch rather than of the
+    store. A newer copy of a chunk hides older ones; a delete records a
+    tombstone that hides the chunk in every segment written before it.
+    Segments are merged like a binary counter (the newest ones whenever
+    the one before them is no bigger), so a store of ``n`` rows has
+    ``O(log n)`` segments and each row is rewritten ``O(log n)`` times; the
+    whole store is compacted once half of its rows are dead.
+
+    Queries upcast ``QUERY_BLOCK_ROWS`` rows at a time, so only the pages
+    a search touches are resident and no float32 copy is kept.
+
+    Instances for the same directory share one lock, and each reloads
+    ``meta.json`` when another instance has rewritten it since.
+    """
+
+    def __init__(self, directory: str, metadata: Dict[str, Any], quantize: bool = False):
+        self.directory = directory
+        self.quantize = quantize
+        self._lock = _directory_lock(directory)
+        with self._lock:
+            self._load(metadata)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _meta_version(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self._path("meta.json"))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _refresh(self):
+        """Pick up writes made through another instance; called with the lock held."""
+        if self._meta_version() != self._version:
+            self._load(self.info)
+
+    def _load(self, metadata: Dict[str, Any]):
+        self._version = self._meta_version()
+        try:
+            with open(self._path("meta.json")) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            meta = {"info": metadata, "segments": [], "next_seq": 0, "tombstones": {}}
+        if "columns" in meta:
+            meta = self._migrate(meta)
+        self.info: Dict[str, Any] = meta["info"]
+        self._next_seq: int = meta["next_seq"]
+        self._tombstones: Dict[str, int] = meta["tombstones"]
+        self._segments: List[_Segment] = [_Segment(self.directory, seq) for seq in meta["segments"]]
+
+        # chunk id -> (segment index, row) of its live copy; newest segment first
+        self._rows: Dict[str, Tuple[int, int]] = {}
+        alive = []
+        for index in reversed(range(len(self._segments))):
+            segment = self._segments[index]
+            mask = np.zeros(len(segment), dtype=bool)
+            for row, chunk in enumerate(segment.columns["id"]):
+                if chunk not in self._rows and self._tombstones.get(chunk, -1) < segment.seq:
+                    self._rows[chunk] = (index, row)
+                    mask[row] = True
+            alive.append(mask)
+        self._alive: List[np.ndarray] = alive[::-1]
+
+    def _migrate(self, meta: Dict[str, Any]) -> Dict[str, Any]:
+        """Turn a store written as one ``vectors.npy`` + ``meta.json`` into a single segment."""
+        columns = dict(meta["columns"])
+        texts = columns.pop("text")
+        if columns["id"]:
+            vectors = np.load(self._path("vectors.npy"))
+            scales = np.load(self._path("scales.npy")) if vectors.dtype == np.int8 else None
+            _Segment.write(self.directory, 0, vectors, scales, texts, columns)
+        migrated = {"info": meta["info"], "segments": [0] if columns["id"] else [], "next_seq": 1, "tombstones": {}}
+        self._write_meta(migrated)
+        for name in ("vectors.npy", "scales.npy"):
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+        return migrated
+
+    def _write_meta(self, meta: Dict[str, Any]):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path("meta.tmp.json"), "w") as f:
+            json.dump(meta, f)
+        os.replace(self._path("meta.tmp.json"), self._path("meta.json"))
+        self._version = self._meta_version()
+
+    def _save_meta(self):
+        self._write_meta({"info": self.info, "segments": [s.seq for s in self._segments],
+                          "next_seq": self._next_seq, "tombstones": self._tombstones})
+
+    def _encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        if not self.quantize:
+            return vectors.astype(np.float16), None
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def _append(self, vectors: np.ndarray, scales: Optional[np.ndarray], texts: List[str],
+                columns: Dict[str, List]) -> _Segment:
+        os.makedirs(self.directory, exist_ok=True)
+        seq = self._next_seq
+        _Segment.write(self.directory, seq, vectors, scales, texts, columns)
+        self._next_seq += 1
+        return _Segment(self.directory, seq)
+
+    def _kill(self, alive: List[np.ndarray], chunks, tombstone: Optional[int]) -> int:
+        """Mark the live copies of ``chunks`` dead in ``alive`` (copying the masks it changes)."""
+        copied = set()
+        killed = 0
+        for chunk in chunks:
+            location = self._rows.pop(chunk, None)
+            if location is None:
+                continue
+            index, row = location
+            if index not in copied:
+                alive[index] = alive[index].copy()
+                copied.add(index)
+            alive[index][row] = False
+            killed += 1
+            if tombstone is not None:
+                self._tombstones[chunk] = tombstone
+        return killed
+
+    def _compact(self):
+        """Merge the newest segments while the one before them is no bigger, or everything
+        once half the rows are dead."""
+        sizes = [len(s) for s in self._segments]
+        full = sum(int(m.sum()) for m in self._alive) * 2 < sum(sizes)
+        start, tail = len(sizes) - 1, sizes[-1] if sizes else 0
+        while start > 0 and sizes[start - 1] <= tail:
+            start -= 1
+            tail += sizes[start]
+        if full:
+            start = 0
+        elif len(sizes) - start < 2:
+            return
+        merged = self._segments[start:]
+
+        parts, texts, columns = [], [], {}
+        count = 0
+        for segment, mask in zip(merged, self._alive[start:]):
+            rows = np.flatnonzero(mask)
+            if not len(rows):
+                continue
+            parts.append(segment.decoded(rows))
+            texts += [segment.text(row) for row in rows]
+            for key in set(columns) | set(segment.columns):
+                values = segment.columns.get(key)
+                columns.setdefault(key, [None] * count).extend(
+                    [values[row] for row in rows] if values is not None else [None] * len(rows))
+            count += len(rows)
+
+        segments, alive = self._segments[:start], self._alive[:start]
+        if count:
+            vectors, scales = self._encode(np.concatenate(parts))
+            segment = self._append(vectors, scales, texts, columns)
+            for row, chunk in enumerate(columns["id"]):
+                self._rows[chunk] = (start, row)
+            segments.append(segment)
+            alive.append(np.ones(count, dtype=bool))
+        if start == 0:
+            # nothing older is left for a tombstone to hide
+            self._tombstones = {}
+        self._segments, self._alive = segments, alive
+        self._save_meta()
+        for segment in merged:
+            _Segment.remove(self.directory, segment.seq)
+
+    def embedding_metadata(self) -> Dict[str, Any]:
+        return self.info
+
+    def drop(self):
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self._load(self.info)
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], texts: List[str], metadatas: List[Dict],
+               stale: List[str] = ()):
+        vectors, scales = self._encode(_normalize(np.asarray(embeddings, dtype=np.float32)))
+        columns: Dict[str, List] = {"id": list(ids)}
+        for key in set().union(*metadatas):
+            columns[key] = [m.get(key) for m in metadatas]
+        with self._lock:
+            self._refresh()
+            if self._segments and self._segments[-1].vectors.shape[1] != vectors.shape[1]:
+                raise ValueError(f"embeddings of dimension {vectors.shape[1]} don't fit a store "
+                                 f"of dimension {self._segments[-1].vectors.shape[1]}")
+            segment = self._append(vectors, scales, list(texts), columns)
+            alive = list(self._alive)
+            # older copies of the upserted chunks are hidden by the new segment itself
+            self._kill(alive, ids, None)
+            self._kill(alive, [chunk for chunk in stale if chunk not in set(ids)], segment.seq - 1)
+            index = len(self._segments)
+            for row, chunk in enumerate(ids):
+                self._rows[chunk] = (index, row)
+            self._segments = self._segments + [segment]
+            self._alive = alive + [np.ones(len(ids), dtype=bool)]
+            self._save_meta()
+            self._compact()
+
+    def _delete(self, ids) -> int:
+        alive = list(self._alive)
+        removed = self._kill(alive, ids, self._next_seq - 1)
+        if removed:
+            self._alive = alive
+            self._save_meta()
+            self._compact()
+        return removed
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            self._refresh()
+            self._delete(ids)
+
+    def delete_docs(self, doc_ids: List[str]) -> int:
+        with self._lock:
+            self._refresh()
+            chunks = []
+            for segment, mask in zip(self._segments, self._alive):
+                rows = np.flatnonzero(mask & np.isin(segment.doc_ids, list(doc_ids)))
+                chunks += [segment.columns["id"][row] for row in rows]
+            return self._delete(chunks)
+
+    def query(self, vector: List[float], k: int, doc_id: Optional[str] = None) -> List[Match]:
+        with self._lock:
+            self._refresh()
+            segments, alive = self._segments, self._alive
+        q = _normalize(np.asarray(vector, dtype=np.float32))
+        # exact, so recall is 1 by construction; each segment's best k, then the best of those
+        candidates: List[Tuple[float, _Segment, int]] = []
+        for segment, mask in zip(segments, alive):
+            if doc_id:
+                mask = mask & (segment.doc_ids == doc_id)
+            rows = np.flatnonzero(mask)
+            if not len(rows) or k <= 0:
+                continue
+            scores = _block_scores(segment.vectors, segment.scales, q)[rows]
+            top = min(k, len(rows))
+            best = np.argpartition(-scores, top - 1)[:top]
+            candidates += [(float(scores[i]), segment, int(rows[i])) for i in best]
+
+        candidates.sort(key=lambda c: -c[0])
+        return [(segment.text(row), 1.0 - score, segment.metadata(row))
+                for score, segment, row in candidates[:k]]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh()
+            segments, alive = self._segments, self._alive
+        return {
+            "chunks": sum(int(m.sum()) for m in alive),
+            "segments": len(segments),
+            "dtype": str(segments[-1].vectors.dtype) if segments else None,
+            "bytes": sum(int(s.vectors.nbytes) for s in segments),
+        }
@@ -22,7 +22,7 @@ const SummaryPanel = ({ email }) => {
       if (cachedSummary) {
         setSummary(cachedSummary);
       } else {
-        const result = await summarizeEmail(email.id, user.id, selectedMode);
+        const result = await summarizeEmail(email.id, user.id, selectedMode, setSummary);
         setSummary(result);
       }
     } catch (error) {
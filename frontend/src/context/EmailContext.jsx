@@ -8,6 +8,8 @@ export const EmailProvider = ({ children }) => {
   const [filteredEmails, setFilteredEmails] = useState([]);
   const [selectedEmail, setSelectedEmail] = useState(null);
   const [loading, setLoading] = useState(false);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [summaries, setSummaries] = useState({});
   const [threadSummaries, setThreadSummaries] = useState({});
   const [draft, setDraft] = useState("");
@@ -45,10 +47,12 @@ export const EmailProvider = ({ children }) => {
           );
           setEmails(sortedEmails);
           setFilteredEmails(sortedEmails);
+          setNextCursor(response.next_cursor || null);
         } else {
           console.warn("Invalid email response format:", response);
           setEmails([]);
           setFilteredEmails([]);
+          setNextCursor(null);
         }
 
         if (!ragIndexInFlight.current) {
@@ -70,6 +74,33 @@ export const EmailProvider = ({ children }) => {
     []
   );
 
+  // appends the page after the last one loaded; a no-op once the list is exhausted
+  const loadMoreEmails = useCallback(
+    async (userId) => {
+      if (!userId || !nextCursor || loadingMore) return;
+
+      setLoadingMore(true);
+      try {
+        const res = await mailAPI.getEmails(userId, { cursor: nextCursor });
+        const response = res.data;
+        const page = Array.isArray(response.emails) ? response.emails : [];
+
+        const append = (prev) => {
+          const seen = new Set(prev.map((e) => e.id));
+          return [...prev, ...page.filter((e) => !seen.has(e.id))];
+        };
+        setEmails(append);
+        setFilteredEmails(append);
+        setNextCursor(response.next_cursor || null);
+      } catch (err) {
+        console.error("Failed to load more emails:", err);
+      } finally {
+        setLoadingMore(false);
+      }
+    },
+    [nextCursor, loadingMore]
+  );
+
   const fetchEmail = useCallback(
     async (emailId, userId) => {
       if (!emailId || !userId) return;
@@ -80,17 +111,32 @@ export const EmailProvider = ({ children }) => {
 
       if (localEmail) {
         setSelectedEmail(localEmail);
-        return;
+        if (localEmail.body !== undefined) return;
+      }
+
+      // list responses omit bodies; load the full email on selection
+      try {
+        const res = await mailAPI.getEmail(localEmail?.id || emailId, userId);
+        const fullEmail = res.data.email;
+        setSelectedEmail(fullEmail);
+        const merge = (prev) =>
+          prev.map((e) => (e.id === fullEmail.id ? { ...e, ...fullEmail } : e));
+        setEmails(merge);
+        setFilteredEmails(merge);
+      } catch (err) {
+        console.error("Failed to fetch email:", err);
       }
     },
     [emails]
   );
 
-  const generateReplyDraft = useCallback(async (userId, draftReq) => {
+  // with onToken, the draft is streamed and onToken receives the text so far
+  const generateReplyDraft = useCallback(async (userId, draftReq, onToken) => {
     setLoading(true);
     try {
-      const res = await mailAPI.generateReplyDraft(userId, draftReq);
-      return res.data.draft;
+      return onToken
+        ? (await mailAPI.streamReplyDraft(userId, draftReq, (_, soFar) => onToken(soFar))).text
+        : (await mailAPI.generateReplyDraft(userId, draftReq)).data.draft;
     } catch (err) {
       console.error("Failed to generate reply draft:", err);
       return "";
@@ -115,17 +161,19 @@ export const EmailProvider = ({ children }) => {
     [fetchEmails]
   );
 
+  // with onToken, the summary is streamed and onToken receives the text so far
   const summarizeEmail = useCallback(
-    async (emailId, userId, mode = "short") => {
+    async (emailId, userId, mode = "short", onToken) => {
       setLoading(true);
       try {
-        const res = await mailAPI.summarizeEmail(emailId, userId, mode);
-        const data = res.data;
+        const summary = onToken
+          ? (await mailAPI.streamSummary(emailId, userId, mode, (_, soFar) => onToken(soFar))).text
+          : (await mailAPI.summarizeEmail(emailId, userId, mode)).data.summary;
         setSummaries((prev) => ({
           ...prev,
-          [emailId]: { ...(prev[emailId] || {}), [mode]: data.summary },
+          [emailId]: { ...(prev[emailId] || {}), [mode]: summary },
         }));
-        return data.summary;
+        return summary;
       } catch (err) {
         console.error("Failed to summarize email:", err);
         return null;
@@ -157,12 +205,14 @@ export const EmailProvider = ({ children }) => {
     []
   );
 
-  const generateDraftEmail = useCallback(async (userId, draftReq) => {
+  const generateDraftEmail = useCallback(async (userId, draftReq, onToken) => {
     setLoading(true);
     try {
-      const res = await mailAPI.generateDraft(userId, draftReq);
-      setDraft(res.data.draft);
-      return res.data.draft;
+      const text = onToken
+        ? (await mailAPI.streamDraft(userId, draftReq, (_, soFar) => onToken(soFar))).text
+        : (await mailAPI.generateDraft(userId, draftReq)).data.draft;
+      setDraft(text);
+      return text;
     } catch (err) {
       console.error("Failed to generate draft:", err);
       return "";
@@ -230,6 +280,9 @@ export const EmailProvider = ({ children }) => {
         selectedEmail,
         loading,
         fetchEmails,
+        loadMoreEmails,
+        hasMoreEmails: Boolean(nextCursor),
+        loadingMore,
         fetchEmail,
         filterAllEmails,
         setFilteredEmails,
@@ -25,6 +25,9 @@ const Emails = () => {
     emails,
     filteredEmails,
     fetchEmails,
+    loadMoreEmails,
+    hasMoreEmails,
+    loadingMore,
     selectedEmail,
     fetchEmail,
     filterAllEmails,
@@ -101,7 +104,7 @@ const Emails = () => {
       context: "Respond politely and clearly",
       reply_to: email.plain_body || email.html_body || email.snippet,
     };
-    const draft = await generateReplyDraft(user.id, draftReq);
+    const draft = await generateReplyDraft(user.id, draftReq, setReplyDraft);
     setReplyDraft(draft);
   };
 
@@ -199,11 +202,25 @@ const Emails = () => {
                 />
               </>
             ) : (
-              <EmailList
-                emails={filteredEmails}
-                onSelectEmail={handleSelectEmail}
-                selectedEmailId={selectedEmailId}
-              />
+              <>
+                <EmailList
+                  emails={filteredEmails}
+                  onSelectEmail={handleSelectEmail}
+                  selectedEmailId={selectedEmailId}
+                />
+                {hasMoreEmails && (
+                  <div className="p-3 flex justify-center border-t border-subtle">
+                    <Button
+                      onClick={() => loadMoreEmails(user.id)}
+                      disabled={loadingMore}
+                      variant="outline"
+                      size="sm"
+                    >
+                      {loadingMore ? "Loading..." : "Load more"}
+                    </Button>
+                  </div>
+                )}
+              </>
             )}
           </div>
         </div>
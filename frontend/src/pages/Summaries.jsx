@@ -9,7 +9,7 @@ import Modal from '../components/ui/Modal';
 
 const Summaries = () => {
   const { user } = useAuth();
-  const { emails, summarizeEmail, summarizeThread, generateDraft } = useEmail();
+  const { emails, summarizeEmail, summarizeThread, generateDraftEmail } = useEmail();
   const [loading, setLoading] = useState(true);
   const [selectedEmail, setSelectedEmail] = useState(null);
   const [selectedThread, setSelectedThread] = useState(null);
@@ -70,7 +70,7 @@ const Summaries = () => {
   const handleGenerateDraft = async () => {
     setIsGenerating(true);
     try {
-      const draft = await generateDraft(user.id, draftData);
+      const draft = await generateDraftEmail(user.id, draftData, setGeneratedDraft);
       setGeneratedDraft(draft);
     } catch (error) {
       console.error('Failed to generate draft:', error);
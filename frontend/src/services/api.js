@@ -10,6 +10,52 @@ const api = axios.create({
   },
 });
 
+// POSTs to a Server-Sent Events endpoint and calls onToken(text, fullSoFar) per
+// token; resolves with the final "done" payload.
+const streamSSE = async (path, { params = {}, body, onToken } = {}) => {
+  const url = new URL(path, API_BASE_URL);
+  Object.entries(params).forEach(([key, value]) => url.searchParams.set(key, value));
+
+  const res = await fetch(url, {
+    method: "POST",
+    headers: { "Content-Type": "application/json", Accept: "text/event-stream" },
+    body: body ? JSON.stringify(body) : undefined,
+  });
+  if (!res.ok) {
+    const detail = await res.json().catch(() => ({}));
+    throw new Error(detail.detail || `Request failed with status ${res.status}`);
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let text = "";
+
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const raw = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      const event = raw.match(/^event: (.*)$/m)?.[1];
+      const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || "{}");
+      if (event === "token") {
+        text += data.text;
+        onToken?.(data.text, text);
+      } else if (event === "error") {
+        throw new Error(data.detail);
+      } else if (event === "done") {
+        return data;
+      }
+    }
+  }
+  return { text };
+};
+
 export const authAPI = {
   getAuthUrl: () => api.get("/emails/auth/google"),
 };
@@ -17,14 +63,29 @@ export const authAPI = {
 export const mailAPI = {
   fetchEmails: (userId) =>
     api.get("/emails/mails/fetch", { params: { user_id: userId } }),
-  getEmails: (userId) =>
-    api.get("/emails/mails", { params: { user_id: userId } }),
+  getEmails: (userId, params = {}) =>
+    api.get("/emails/mails", { params: { user_id: userId, ...params } }),
+  getEmail: (emailId, userId) =>
+    api.get(`/emails/mails/${emailId}`, { params: { user_id: userId } }),
+
+  startBackfill: (userId, restart = false) =>
+    api.post("/emails/mails/backfill/start", null, {
+      params: { user_id: userId, restart },
+    }),
+  getBackfillStatus: (userId) =>
+    api.get("/emails/mails/backfill/status", { params: { user_id: userId } }),
 
   summarizeEmail: (emailId, userId, mode = "short") =>
     api.post(`/summarize/emails/${emailId}/summarize`, null, {
       params: { user_id: userId, mode },
     }),
 
+  streamSummary: (emailId, userId, mode = "short", onToken) =>
+    streamSSE(`/summarize/emails/${emailId}/summarize/stream`, {
+      params: { user_id: userId, mode },
+      onToken,
+    }),
+
   summarizeThread: (threadId, userId, mode = "short") =>
     api.post(`/summarize/threads/${threadId}/summarize`, null, {
       params: { user_id: userId, mode },
@@ -35,6 +96,13 @@ export const mailAPI = {
       params: { user_id: userId },
     }),
 
+  streamDraft: (userId, draft, onToken) =>
+    streamSSE(`/summarize/drafts/generate/stream`, {
+      params: { user_id: userId },
+      body: draft,
+      onToken,
+    }),
+
   filterEmail: (emailId, userId) =>
     api.post(`/filtering/emails/${emailId}/filter`, null, {
       params: { user_id: userId },
@@ -48,6 +116,13 @@ export const mailAPI = {
   generateReplyDraft: (userId, draftReq) =>
     api.post(`/personalized/drafts/reply?user_id=${userId}`, draftReq),
 
+  streamReplyDraft: (userId, draftReq, onToken) =>
+    streamSSE(`/personalized/drafts/reply/stream`, {
+      params: { user_id: userId },
+      body: draftReq,
+      onToken,
+    }),
+
   ragIndex: async (userId) => {
     try {
       await api.post(`/search/rag/index?user_id=${userId}`);